@@ -1,32 +1,60 @@
-import music21 as m21
 import numpy as np
-import sklearn as skl
-import sys
 from collections import defaultdict
-from random import shuffle
+from common.lazy import lazy_import
+
+m21 = lazy_import('music21')
 
 PLAYABLE_MODES = ['major', 'minor']
-mode_intervals = {}
 
-for mode in PLAYABLE_MODES:
+# number of measures the local key of a measure is analyzed over
+KEY_WINDOW_SIZE = 8
+
+# how much better (in correlation with the key profile) a local key must fit than the global key when
+# it's the relative major/minor of it, and than the key of the previous measure, to be used instead.
+# The relative key margin only settles near ties (where the window really can't tell the two apart),
+# so that passages that do move to the relative key are still analyzed in it
+RELATIVE_KEY_MARGIN = 0.02
+KEY_CHANGE_MARGIN = 0.05
+
+# tonic spellings for each pitch class (spelled with the fewest accidentals)
+MAJOR_TONICS = ['C', 'D-', 'D', 'E-', 'E', 'F', 'F#', 'G', 'A-', 'A', 'B-', 'B']
+MINOR_TONICS = ['c', 'c#', 'd', 'e-', 'e', 'f', 'f#', 'g', 'g#', 'a', 'b-', 'b']
+
+mode_intervals = None
+
+def get_mode_intervals():
+    """
+    Returns the intervals above the tonic of each scale degree (from the second on), by mode.
+    """
+    global mode_intervals
+
+    if mode_intervals is None:
+        intervals_by_mode = {}
 
-    added_intervals = []
-    intervals = [i for i in m21.scale.AbstractDiatonicScale(mode).getIntervals()]
+        for mode in PLAYABLE_MODES:
 
-    # add up the intervals
-    for i in range(len(intervals)):
-        added_intervals.append(m21.interval.add(intervals[:i + 1]))
+            added_intervals = []
+            intervals = [i for i in m21.scale.AbstractDiatonicScale(mode).getIntervals()]
 
-    mode_intervals[mode] = added_intervals
+            # add up the intervals
+            for i in range(len(intervals)):
+                added_intervals.append(m21.interval.add(intervals[:i + 1]))
 
+            intervals_by_mode[mode] = added_intervals
 
-def analyze(song_file):
+        mode_intervals = intervals_by_mode
+
+    return mode_intervals
+
+
+def analyze(song_file, interner=None):
 
     """
     Takes in a song file and parses it into measures of AnalyzedElement objects
 
     Args:
         song_file (String): the song's file path (currently tested with .xml files)
+        interner (MeasureInterner): optional interner that identical measures are shared through
 
     Returns:
         measures_of_analyzed_elements (List[List[AnalyzedElement]]): grouped AnalyzedElement objects
@@ -36,7 +64,7 @@ def analyze(song_file):
     song = m21.converter.parse(song_file)
 
     # split into parts
-    measures_of_analyzed_elements = analyze_elements_by_measure(song)
+    measures_of_analyzed_elements = analyze_elements_by_measure(song, interner)
 
     return measures_of_analyzed_elements, song
 
@@ -97,18 +125,20 @@ def generate_rhythmic_transitions_distributions(stream):
 
     return new_dist
 
-def to_stream(measures_of_analyzed_elements):
+def to_stream(measures_of_analyzed_elements, stream_cache=None):
 
     """
     Converts a group of measures of AnalyzedElement objects detailing a song, back into a playable stream.
     Args:
         measures (List[List[AnalyzedElement]]) AnalyzedElements grouped in measures
+        stream_cache (MeasureStreamCache): optional cache, to only rebuild the measures that changed
+                                           since the last conversion
 
     Returns:
         stream (m21.stream.Stream) playable stream object with the measures
     """
 
-    stream = analyze_element_measures_to_stream(measures_of_analyzed_elements)
+    stream = analyze_element_measures_to_stream(measures_of_analyzed_elements, stream_cache)
 
     return stream
 
@@ -145,21 +175,33 @@ def get_note_roman_numeral(element, songKey):
     return roman
 
 
-def analyze_elements_by_measure(song):
+def analyze_elements_by_measure(song, interner=None, window_size=KEY_WINDOW_SIZE):
 
     """
     Returns the scale degrees of a list of notes relative to
     the given key, all wrapped within an AnalyzedElement object.
 
+    Each measure is analyzed in its local key (see analyze_keys_by_measure). If window_size is None,
+    the whole song is analyzed in a single key instead.
+
+    If an interner is given, measures with identical content are replaced by a single shared
+    measure, so the AnalyzedElements of a repeated measure keep the measureNumber of its first occurrence.
+
     Args:
         song (m21.stream.Score)
+        interner (MeasureInterner): optional interner shared by all the parts of the song
+        window_size (int): number of measures each local key is analyzed over
 
     Returns:
         parts (List[List[List[AnalyzedElement]]]): List of all notes grouped by their
                                                      corresponding measures.
     """
 
-    songKey = song.analyze("key")
+    if window_size is None:
+        songKey = song.analyze("key")
+    else:
+        measure_keys = analyze_keys_by_measure(song, window_size)
+
     parts = []
 
     # break the song up into parts
@@ -168,10 +210,13 @@ def analyze_elements_by_measure(song):
         notes_by_measure = []
 
         #TODO: track last time signature and add to each following measure
-        for measure in measures:
+        for index, measure in enumerate(measures):
             m = measure.number
             t = measure.timeSignature
 
+            if window_size is not None:
+                songKey = measure_keys[index]
+
             # filter out elements != {Note, Chord or Rest}
             playable = list(filter(lambda x: is_note_or_chord_or_rest(x), measure))
             # notes in the measure
@@ -184,6 +229,13 @@ def analyze_elements_by_measure(song):
 
                 offset += el.duration.quarterLength
 
+            # the measure's signature is computed once here, for everything that caches by it
+            notes = Measure(notes)
+
+            # reuse an identical measure if one has already been seen
+            if interner is not None:
+                notes = interner.intern(notes)
+
             # add the measure of notes to the list of measures.
             notes_by_measure.append(notes)
 
@@ -191,6 +243,211 @@ def analyze_elements_by_measure(song):
 
     return parts
 
+def get_measure_histograms(song):
+    """
+    Returns the duration weighted pitch class histogram of every measure, across all parts.
+
+    Args:
+        song (m21.stream.Score)
+
+    Returns:
+        histograms (List[np.array]): histogram of each measure, by measure index
+    """
+    histograms = []
+    for part in song.parts:
+        measures = part.getElementsByClass(m21.stream.Measure)
+
+        for index, measure in enumerate(measures):
+            if index == len(histograms):
+                histograms.append(np.zeros(12))
+
+            for el in filter(lambda x: is_note_or_chord_or_rest(x), measure):
+                if not el.isRest:
+                    for p in el.pitches:
+                        histograms[index][p.pitchClass] += el.duration.quarterLength
+
+    return histograms
+
+def get_global_key(song, histograms=None):
+    """
+    Returns the key of the whole song, from the pitch class histogram of all of its measures.
+
+    Args:
+        song (m21.stream.Score)
+        histograms (List[np.array]): the song's measure histograms, if already computed
+
+    Returns:
+        key (m21.key.Key)
+    """
+    if histograms is None:
+        histograms = get_measure_histograms(song)
+
+    key = get_key_from_histogram(np.sum(histograms, axis=0)) if histograms else None
+    return key if key is not None else m21.key.Key('C', 'major')
+
+def analyze_keys_by_measure(song, window_size=KEY_WINDOW_SIZE):
+
+    """
+    Returns the local key of every measure in the song, found by correlating the pitch class
+    histogram of a window of measures around it with the major and minor key profiles.
+    The window's histogram is updated incrementally as it slides (adding the measure that enters
+    and subtracting the one that leaves), so each measure costs a constant amount of work. At the
+    start and end of the song the window is mirrored back into the song, so it keeps its size.
+
+    A local key that is the relative major/minor of the song's global key has to fit better than the
+    global key (by RELATIVE_KEY_MARGIN, which only decides near ties), and the key only changes from one
+    measure to the next if the new key fits clearly better than the previous one (by KEY_CHANGE_MARGIN).
+
+    Note that measures analyzed in their local key are each transposed from that key to the target key,
+    so a modulating passage ends up in the target key too: the modulation itself is flattened. Analyze
+    with window_size=None (a single key for the whole song) to keep modulations when transposing.
+
+    Args:
+        song (m21.stream.Score)
+        window_size (int): number of measures in the window
+
+    Returns:
+        keys (List[m21.key.Key]): key of each measure, by measure index
+    """
+
+    histograms = get_measure_histograms(song)
+    count = len(histograms)
+    if count == 0:
+        return []
+
+    profiles, profile_keys = get_key_profiles()
+    global_key = get_global_key(song, histograms)
+    global_index = get_key_profile_index(global_key)
+
+    # the window spans [index - behind, index + ahead], reflected at the ends of the song
+    ahead = window_size // 2
+    behind = window_size - ahead - 1
+
+    def mirror(index):
+        if index < 0:
+            index = -index
+        if index >= count:
+            index = 2 * (count - 1) - index
+        return min(max(index, 0), count - 1)
+
+    window = np.zeros(12)
+    for index in range(-behind - 1, ahead):
+        window += histograms[mirror(index)]
+
+    keys = []
+    last_index = None
+    for index in range(count):
+        window += histograms[mirror(index + ahead)]
+        window -= histograms[mirror(index - behind - 1)]
+
+        scores = get_key_scores(window)
+        if scores is None:
+            # windows without any notes take the key of the closest previous window (or the global key)
+            keys.append(None)
+            continue
+
+        best = int(np.argmax(scores))
+
+        # the relative key shares the global key's notes, so only trust it when it's clearly better
+        if best == get_relative_key_index(global_index) and scores[best] - scores[global_index] < RELATIVE_KEY_MARGIN:
+            best = global_index
+
+        # hysteresis: stay in the previous key unless the new one is clearly better
+        if last_index is not None and best != last_index and scores[best] - scores[last_index] < KEY_CHANGE_MARGIN:
+            best = last_index
+
+        keys.append(profile_keys[best])
+        last_index = best
+
+    last_key = global_key
+    for index in range(len(keys)):
+        if keys[index] is None:
+            keys[index] = last_key
+        last_key = keys[index]
+
+    return keys
+
+def get_key_scores(histogram):
+    """
+    Returns the correlation of the pitch class histogram with the profile of each key (in the order
+    of get_key_profiles), or None if the histogram is flat (i.e. there are no notes).
+
+    Args:
+        histogram (np.array) duration weighted count of each of the 12 pitch classes
+
+    Returns:
+        scores (np.array)
+    """
+    deviation = histogram.std()
+    if deviation < 1e-9:
+        return None
+
+    profiles, keys = get_key_profiles()
+
+    # correlation of the histogram with each (standardized) key profile
+    standardized = (histogram - histogram.mean()) / deviation
+    return profiles.dot(standardized) / len(standardized)
+
+def get_key_from_histogram(histogram):
+    """
+    Returns the key whose profile best correlates with the pitch class histogram,
+    or None if the histogram is flat (i.e. there are no notes).
+
+    Args:
+        histogram (np.array) duration weighted count of each of the 12 pitch classes
+
+    Returns:
+        key (m21.key.Key)
+    """
+    scores = get_key_scores(histogram)
+    if scores is None:
+        return None
+
+    profiles, keys = get_key_profiles()
+    return keys[int(np.argmax(scores))]
+
+def get_key_profile_index(key):
+    """
+    Returns the index of the key in get_key_profiles (major keys by pitch class, then minor keys).
+    """
+    return key.tonic.pitchClass + (12 if key.mode == 'minor' else 0)
+
+def get_relative_key_index(index):
+    """
+    Returns the index in get_key_profiles of the relative minor/major of the key at index.
+    """
+    if index < 12:
+        return 12 + (index + 9) % 12
+    else:
+        return (index - 12 + 3) % 12
+
+key_profiles = None
+
+def get_key_profiles():
+    """
+    Returns the standardized key profiles of all 24 major and minor keys, as a (24 x 12) matrix,
+    along with the corresponding keys. Uses the same weights as song.analyze("key").
+    """
+    global key_profiles
+
+    if key_profiles is None:
+        weights = m21.analysis.discrete.AardenEssen()
+        profiles = []
+        keys = []
+
+        for mode, tonics in [('major', MAJOR_TONICS), ('minor', MINOR_TONICS)]:
+            profile = np.array(weights.getWeights(mode))
+            profile = (profile - profile.mean()) / profile.std()
+
+            for pitch_class in range(12):
+                # rotate so that the tonic weight falls on the pitch class
+                profiles.append(np.roll(profile, pitch_class))
+                keys.append(m21.key.Key(tonics[pitch_class], mode))
+
+        key_profiles = (np.array(profiles), keys)
+
+    return key_profiles
+
 def is_note_or_chord_or_rest(element):
     """
     Returns whether the element is a note or a rest object
@@ -208,37 +465,100 @@ def is_note_or_chord_or_rest(element):
 
     return note or rest or chord
 
-def analyze_element_measures_to_stream(parts):
+def analyze_element_measures_to_stream(parts, stream_cache=None):
     """
     Returns list of analyzed notes grouped by measure converted into a playable
     Stream object
 
     Args:
         parts (List[List[List[AnalyzedElement]]]) AnalyzedElements grouped in measures, separated by parts
+        stream_cache (MeasureStreamCache): optional cache, to only rebuild the measures that changed
+                                           since the last conversion
 
     Returns:
         stream (m21.stream.Stream) playable stream object with the measures
     """
+    if stream_cache is not None:
+        return stream_cache.build(parts)
+
     stream = m21.stream.Stream()
 
     for part in parts:
         p = m21.stream.Part()
 
         for measure in part:
-            m = m21.stream.Measure()
-            m.timeSignature = None
+            p.append(measure_to_stream(measure))
+
+        stream.insert(0, p)
 
-            for note in measure:
-                if m.timeSignature is None:
-                    m.timeSignature = note.timeSignature
+    return stream
 
-                m.append(note.element)
+def measure_to_stream(measure):
+    """
+    Returns a measure of analyzed notes converted into a music21 Measure
 
-            p.append(m)
+    Args:
+        measure (List[AnalyzedElement]) AnalyzedElements of the measure
 
-        stream.insert(0, p)
+    Returns:
+        m (m21.stream.Measure) the measure object
+    """
+    m = m21.stream.Measure()
+    m.timeSignature = None
 
-    return stream
+    for note in measure:
+        if m.timeSignature is None:
+            m.timeSignature = note.timeSignature
+
+        m.append(note.element)
+
+    return m
+
+def get_measure_signature(measure):
+    """
+    Returns a hashable summary of a measure's content: for each element its type, pitches,
+    duration, beat offset and key. Measures with equal signatures transform identically.
+
+    Args:
+        measure (List[AnalyzedElement]) the measure of interest
+
+    Returns:
+        signature (Tuple) hashable content of the measure
+    """
+    signature = []
+
+    for note in measure:
+        element = note.element
+
+        if note.is_rest():
+            pitches = ()
+        elif note.is_note():
+            pitches = (element.pitch.nameWithOctave,)
+        else:
+            pitches = tuple([p.nameWithOctave for p in element.pitches])
+
+        time_signature = note.timeSignature.ratioString if note.timeSignature is not None else None
+
+        signature.append((type(element).__name__, pitches, element.duration.quarterLength,
+                          note.beatOffset, str(note.key), time_signature))
+
+    return tuple(signature)
+
+def get_measure_key(measure):
+    """
+    Returns the signature of a measure's content (see get_measure_signature): the one computed when it was
+    created if it's a Measure, otherwise computed from its content now.
+
+    Args:
+        measure (List[AnalyzedElement]) the measure of interest
+
+    Returns:
+        signature (Tuple) hashable content of the measure
+    """
+    if isinstance(measure, Measure):
+        return measure.signature
+
+    return get_measure_signature(measure)
 
 def get_semitone_difference_for_new_key(oldMode, newMode, degree):
     """
@@ -257,8 +577,8 @@ def get_semitone_difference_for_new_key(oldMode, newMode, degree):
     index = degree - 2
 
     #add up all the intervals up until the scale degree, to get the interval above the tonic
-    oldNoteInt = mode_intervals[oldMode][index]
-    newNoteInt = mode_intervals[newMode][index]
+    oldNoteInt = get_mode_intervals()[oldMode][index]
+    newNoteInt = get_mode_intervals()[newMode][index]
 
     difference = newNoteInt.semitones - oldNoteInt.semitones
     return difference
@@ -320,37 +640,24 @@ class AnalyzedElement:
 
         return AnalyzedElement(key, element, measureNumber, timeSignature, beatOffset)
 
-    def in_new_key(self, newKey):
+    def transpose_element(self, newKey, duration=None):
 
         """
-        Return a new AnalyzedElement with the same scale degree in
-        a different key.
-
-        Major key -> Major key: simple transposition.
-        Major key -> Minor key (or vice versa):
-            - take into account the difference in scale structure and intervals.
-
-        TODO: account for natural/melodic/harmonic minors
-        TODO: Map the new note's pitch relative to self.note's octave
+        Return a new music21 note or chord with the same scale degree(s) as this element in a different key.
+        Only a single new object is created, so this can be used to transpose and re-time an element at once.
 
         Args:
             self (AnalyzedElement): this note.
-            key (music21.key.Key): The new key signature
+            newKey (music21.key.Key): The new key signature
+            duration (music21.duration.Duration): optional duration for the new element, instead of
+                                                  the current element's duration
 
         Returns:
-            new_note (AnalyzedElement): new note analyzed in a different key.
+            newElement (music21.note.Note || music21.chord.Chord): the transposed element
         """
 
-        #TODO: get interval.Interval(Ko_tonic, Kn_tonic), intv.transpose(no)
-        #TODO: Start wrapping transformations within a future, non-blocking
-
-        #return itself if its a rest
-        if self.is_rest():
-            return self
-
-        # get the interval and transpose the element
+        # get the interval between the keys
         interval = m21.interval.Interval(self.key.tonic, newKey.tonic).name
-        newElement = self.element.transpose(interval)
 
         #TODO: Fix the enharmonic naming of this function!!
         # print (self.element.name)
@@ -358,14 +665,20 @@ class AnalyzedElement:
         # print(newElement.name)
 
         if self.is_note():
+            newElement = self.element.transpose(interval)
+
             scaleDegreeData = self.roman.scaleDegreeWithAlteration
 
             if (scaleDegreeData[0] >= 2) and (self.key.mode != newKey.mode):
                 difference = get_semitone_difference_for_new_key(self.key.mode, newKey.mode, scaleDegreeData[0])
 
-                newElement = newElement.transpose(m21.interval.Interval(difference))
+                newElement.transpose(m21.interval.Interval(difference), inPlace=True)
+
+            if duration is not None:
+                newElement.duration = duration
         else:
             # the element is a chord, whose overall roman numeral analysis is self.roman
+            transposedPitches = [p.transpose(interval) for p in self.element.pitches]
 
             # initialize new chord list
             newChord = []
@@ -383,11 +696,175 @@ class AnalyzedElement:
                 if (data[0] >= 2) and (self.key.mode != newKey.mode):
                     difference = get_semitone_difference_for_new_key(self.key.mode, newKey.mode, data[0])
 
-                    newChord.append(newElement.pitches[i].transpose(difference))
+                    newChord.append(transposedPitches[i].transpose(difference))
                 else:
-                    newChord.append(newElement.pitches[i])
+                    newChord.append(transposedPitches[i])
 
             newElement = m21.chord.Chord(newChord)
-            newElement.duration = self.element.duration
+            newElement.duration = duration if duration is not None else self.element.duration
+
+        return newElement
+
+    def in_new_key(self, newKey):
+
+        """
+        Return a new AnalyzedElement with the same scale degree in
+        a different key.
+
+        Major key -> Major key: simple transposition.
+        Major key -> Minor key (or vice versa):
+            - take into account the difference in scale structure and intervals.
+
+        TODO: account for natural/melodic/harmonic minors
+        TODO: Map the new note's pitch relative to self.note's octave
+
+        Args:
+            self (AnalyzedElement): this note.
+            key (music21.key.Key): The new key signature
+
+        Returns:
+            new_note (AnalyzedElement): new note analyzed in a different key.
+        """
+
+        #TODO: get interval.Interval(Ko_tonic, Kn_tonic), intv.transpose(no)
+        #TODO: Start wrapping transformations within a future, non-blocking
+
+        #return itself if its a rest
+        if self.is_rest():
+            return self
+
+        newElement = self.transpose_element(newKey)
 
         return self.copy(key=newKey, element=newElement)
+
+
+class Measure(list):
+    """
+    A measure of AnalyzedElements, along with the signature of its content (see get_measure_signature),
+    computed once when it's created rather than every time a transformation cache looks it up. Its
+    elements shouldn't change afterwards.
+    """
+    def __init__(self, elements=()):
+        super(Measure, self).__init__(elements)
+        self.signature = get_measure_signature(self)
+
+
+class MeasureInterner:
+    """
+    Keeps a single shared copy of every distinct measure (by content), and counts how many
+    of the measures it has seen were duplicates.
+    """
+    def __init__(self):
+        self.measures = {}
+        self.total = 0
+
+    def intern(self, measure):
+        """
+        Returns the shared measure with the same content as the given measure, registering
+        the given measure if its content hasn't been seen before.
+        """
+        self.total += 1
+        signature = get_measure_key(measure)
+
+        shared = self.measures.get(signature)
+        if shared is None:
+            self.measures[signature] = measure
+            shared = measure
+
+        return shared
+
+    def get_stats(self):
+        """
+        Returns the number of measures seen, how many of them were unique, and the dedup ratio
+        (the fraction of measures that were duplicates of an earlier measure).
+        """
+        unique = len(self.measures)
+        duplicates = self.total - unique
+        ratio = float(duplicates) / self.total if self.total else 0.0
+
+        return {'measures': self.total, 'unique': unique, 'duplicates': duplicates, 'dedup_ratio': ratio}
+
+
+class MeasureStreamCache:
+    """
+    Converts parts of analyzed measures into a Stream, like analyze_element_measures_to_stream, but keeps
+    the music21 objects it built. On the next conversion, a measure whose AnalyzedElements are the same
+    objects as last time reuses its Measure, and parts (or the whole stream) with no changed measures are
+    reused as well. Only measures whose AnalyzedElements changed get rebuilt.
+    """
+    def __init__(self):
+        # (part index, measure index) -> (AnalyzedElements, m21.stream.Measure)
+        self.measures = {}
+
+        # part index -> (m21.stream.Measures, m21.stream.Part)
+        self.parts = {}
+
+        self.stream = None
+        self.stream_parts = ()
+
+        self.rebuilt = 0
+        self.reused = 0
+
+    def build(self, parts):
+        part_streams = []
+
+        for i in range(len(parts)):
+            measure_streams = []
+
+            for j in range(len(parts[i])):
+                measure = parts[i][j]
+                cached = self.measures.get((i, j))
+
+                if cached is not None and is_same_elements(cached[0], measure):
+                    m = cached[1]
+                    self.reused += 1
+                else:
+                    m = measure_to_stream(measure)
+                    self.measures[(i, j)] = (tuple(measure), m)
+                    self.rebuilt += 1
+
+                measure_streams.append(m)
+
+            cached = self.parts.get(i)
+            if cached is not None and is_same_elements(cached[0], measure_streams):
+                p = cached[1]
+            else:
+                p = m21.stream.Part()
+                for m in measure_streams:
+                    p.append(m)
+
+                self.parts[i] = (tuple(measure_streams), p)
+
+            part_streams.append(p)
+
+        # nothing changed at all
+        if self.stream is not None and is_same_elements(self.stream_parts, part_streams):
+            return self.stream
+
+        stream = m21.stream.Stream()
+        for p in part_streams:
+            stream.insert(0, p)
+
+        self.stream = stream
+        self.stream_parts = tuple(part_streams)
+
+        return stream
+
+    def get_stats(self):
+        """
+        Returns how many measures were rebuilt and reused over all the conversions so far.
+        """
+        return {'rebuilt': self.rebuilt, 'reused': self.reused}
+
+def is_same_elements(a, b):
+    """
+    Returns whether the two sequences hold the very same objects, in the same order.
+    """
+    if len(a) != len(b):
+        return False
+
+    for x, y in zip(a, b):
+        if x is not y:
+            return False
+
+    return True
@@ -1,7 +1,21 @@
-import os
+import sys
 import math
+import socket
+import av_input
+
+# python av-writer.py [--socket | --fifo]: append values to the av file, or send them to the av socket or fifo
+use_socket = '--socket' in sys.argv[1:]
+use_fifo = '--fifo' in sys.argv[1:]
+
+if use_socket:
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+elif use_fifo:
+    # waits for the reader to open its end
+    av_input.create_fifo(av_input.AV_FIFO_PATH)
+    f = open(av_input.AV_FIFO_PATH, 'w')
+else:
+    f = open(av_input.AV_FILE_PATH, 'w')
 
-f = open('./data/av.txt', 'w')
 while True:
     inp = input('arousal/valence:')
     input_check = inp.split(' ')
@@ -13,9 +27,15 @@ while True:
 
             if math.fabs(a) <= 1 and math.fabs(v) <= 1:
                 print("Arousal and Valence Value to Write = " + inp)
-                f.write(inp + "\n")
-                f.flush()
-                os.fsync(f.fileno())
+                if use_socket:
+                    try:
+                        av_input.send_av(sock, a, v)
+                    except (ConnectionRefusedError, FileNotFoundError):
+                        print("Nothing is listening on " + av_input.AV_SOCKET_PATH)
+                else:
+                    # flushed for the reader to see, but no need to wait for the disk
+                    f.write(inp + "\n")
+                    f.flush()
             else:
                 print("Values must be between -1 and 1")
 
@@ -23,5 +43,8 @@ while True:
             print('invalid input')
     elif inp == 'close':
         print("Closing writer")
-        f.close()
+        if use_socket:
+            sock.close()
+        else:
+            f.close()
         break
@@ -1,12 +1,28 @@
-import numpy
-import music21 as m21
 import random
 import numpy as np
 import copy
+import os
 
 DISTANCE_EXPONENT = 2.0
 DISTANCE_CUTOFF = 0.45
 
+# names of the synth's patches, by patch number
+PATCHES_FILE_PATH = './synth_data/synth_patches.txt'
+
+# columns of a binary point file: the value fields (tab-separated, as in the text files), arousal and valence.
+# The value column is as wide as the longest value of the file, and at least this wide
+MIN_VALUE_WIDTH = 64
+
+def get_point_dtype(value_width=MIN_VALUE_WIDTH):
+    return np.dtype([('value', 'U%d' % value_width), ('arousal', 'f8'), ('valence', 'f8')])
+
+# cells per side of a grid's raster, and the file (next to the point file) it's saved to
+RASTER_SIZE = 256
+RASTER_SUFFIX = '.raster.npz'
+
+# rows of raster cells computed at once (memory use grows with rows x size x points)
+RASTER_BLOCK_ROWS = 16
+
 class AVGrid:
 
     """
@@ -30,10 +46,14 @@ class AVGrid:
         self.current_point = None
         self.last_point = None
 
-    def insert(self, value, arousal, valence):
+        # precomputed sampling distributions (see build_raster), None until built
+        self.raster = None
+
+    def insert(self, value, arousal, valence, sort=True):
 
         """
-        Slow implementation: if this creates a bottleneck, will optimize
+        Slow implementation: if this creates a bottleneck, will optimize. When inserting many points,
+        use insert_points, or pass sort=False and call sort_points() once at the end.
         """
 
         # shift point within bounds if it doesn't originally fit
@@ -43,19 +63,79 @@ class AVGrid:
         arousal = min(arousal, self.max_arousal)
 
         # create point
-        point = ParameterPoint(value, arousal, valence)
+        point = ParameterPoint(self.check_value(value), arousal, valence)
         self.points.append(point)
 
-        # sort the points
+        if sort:
+            self.sort_points()
+
+        # the raster no longer matches the points
+        self.raster = None
+
+    def insert_points(self, values, arousals, valences):
+
+        """
+        Inserts many points at once, from a list of values and arrays of their arousals and valences.
+        """
+
+        # shift points within bounds if they don't originally fit
+        arousals = np.clip(np.asarray(arousals, dtype=float), self.min_arousal, self.max_arousal)
+        valences = np.clip(np.asarray(valences, dtype=float), self.min_valence, self.max_valence)
+
+        # in the order of sort_points (by valence, then arousal)
+        order = np.lexsort((arousals, valences)).tolist()
+        arousals = arousals.tolist()
+        valences = valences.tolist()
+        points = [ParameterPoint(self.check_value(values[i]), arousals[i], valences[i]) for i in order]
+
+        if self.points:
+            self.points.extend(points)
+            self.sort_points()
+        else:
+            self.points = points
+
+        # the raster no longer matches the points
+        self.raster = None
+
+    def sort_points(self):
         self.points = sorted(self.points, key=lambda p : [p.valence, p.arousal])
 
+    def check_value(self, value):
+        """
+        Returns the parameter value as it should be stored, within the bounds of the kind of grid.
+        """
+        return value
+
+    def parse_value(self, fields):
+        """
+        Returns the parameter value written in the value fields of a point file line: by default a single number.
+        """
+        return float(fields[0])
+
+    def parse_point_file(self, filepath):
+        """
+        Inserts all the points of a point file: either a tab-separated text file with a line per point
+        (the value fields, then arousal and valence), or a .npy file converted from one (see convert_point_file).
+        """
+        values, arousals, valences = read_point_file(filepath)
+        self.insert_points([self.parse_value(str(value).split('\t')) for value in values], arousals, valences)
+
     def sample_parameter_point(self, arousal, valence):
 
         """
         Create a probability distribution of all points based off of distance to inputted point (valence, arousal), and
-		then randomly sample a point.
+		then randomly sample a point. If the grid was rasterized, the distribution of the raster cell the point falls in
+		is used instead, and no distribution is returned.
         """
 
+        if self.raster is not None:
+            selected_point = self.sample_raster(arousal, valence)
+
+            self.last_point = self.current_point
+            self.current_point = selected_point
+
+            return selected_point, None
+
         distances = []
         points_within = []
         distribution = {}
@@ -86,6 +166,106 @@ class AVGrid:
 
         return selected_point, distribution
 
+    def compute_raster(self, size=RASTER_SIZE):
+        """
+        Computes, for the center of each of size x size cells covering the grid, the points that can be sampled there and
+        their cumulative probabilities (the same distribution as sample_parameter_point). Returns a dict of
+        candidates (size x size x k point indexes, -1 past the last candidate) and cumulative (size x size x k).
+        """
+        point_arousals = np.array([p.arousal for p in self.points])
+        point_valences = np.array([p.valence for p in self.points])
+
+        # cell centers: arousal along the rows, valence along the columns
+        arousals = np.linspace(self.min_arousal, self.max_arousal, size)
+        valences = np.linspace(self.min_valence, self.max_valence, size)[np.newaxis, :, np.newaxis]
+
+        def block_distances(start):
+            # distances of every point from the cell centers of a block of rows, rows x size x points
+            rows = arousals[start:start + RASTER_BLOCK_ROWS, np.newaxis, np.newaxis]
+            return np.sqrt((point_arousals - rows) ** 2 + (point_valences - valences) ** 2)
+
+        # most candidates of any cell
+        k = 1
+        for start in range(0, size, RASTER_BLOCK_ROWS):
+            k = max(k, int((block_distances(start) <= DISTANCE_CUTOFF).sum(axis=2).max(initial=0)))
+
+        candidates = np.full((size, size, k), -1, dtype=np.int32)
+        cumulative = np.zeros((size, size, k), dtype=np.float32)
+
+        for start in range(0, size, RASTER_BLOCK_ROWS):
+            distances = block_distances(start)
+            within = distances <= DISTANCE_CUTOFF
+
+            furthest = np.where(within, distances, -np.inf).max(axis=2, initial=-np.inf)
+
+            # candidates of each cell first, in point order: each goes to the slot of its rank among them
+            rows, cols, points = np.nonzero(within)
+            slots = (np.cumsum(within, axis=2) - 1)[rows, cols, points]
+            weights = np.zeros((len(distances), size, k))
+            weights[rows, cols, slots] = (furthest[rows, cols] - distances[rows, cols, points]) ** DISTANCE_EXPONENT
+            denominator = weights.sum(axis=2)
+
+            # cells where every weight is 0 (no point, or only one, within the cutoff) have no distribution
+            has_distribution = denominator[rows, cols] > 0
+            candidates[start:start + RASTER_BLOCK_ROWS][rows[has_distribution], cols[has_distribution],
+                                                        slots[has_distribution]] = points[has_distribution]
+
+            cumulative[start:start + RASTER_BLOCK_ROWS] = \
+                np.cumsum(weights, axis=2) / np.where(denominator > 0, denominator, 1.0)[:, :, np.newaxis]
+
+        return {'candidates': candidates, 'cumulative': cumulative}
+
+    def build_raster(self, point_filepath=None, size=RASTER_SIZE):
+        """
+        Rasterizes the grid so that sampling is a lookup. If the grid was loaded from point_filepath, the raster is saved
+        next to it and loaded from there next time, as long as the point file hasn't changed.
+        """
+        if point_filepath is None:
+            self.raster = self.compute_raster(size)
+            return self.raster
+
+        raster_filepath = point_filepath + RASTER_SUFFIX
+        stat = os.stat(point_filepath)
+        source = np.array([stat.st_mtime, stat.st_size, len(self.points), size, DISTANCE_CUTOFF, DISTANCE_EXPONENT])
+
+        try:
+            with np.load(raster_filepath) as data:
+                if np.array_equal(data['source'], source):
+                    self.raster = {'candidates': data['candidates'], 'cumulative': data['cumulative']}
+                    return self.raster
+        except (IOError, KeyError, ValueError):
+            pass
+
+        self.raster = self.compute_raster(size)
+
+        try:
+            np.savez(raster_filepath, source=source, **self.raster)
+        except IOError:
+            print("couldn't save raster to " + raster_filepath)
+
+        return self.raster
+
+    def sample_raster(self, arousal, valence):
+        """
+        Randomly samples a point from the distribution of the raster cell (arousal, valence) falls in.
+        """
+        candidates = self.raster['candidates']
+        size = candidates.shape[0]
+
+        # nearest cell center, clamped to the grid
+        i = int(round((arousal - self.min_arousal) / (self.max_arousal - self.min_arousal) * (size - 1)))
+        j = int(round((valence - self.min_valence) / (self.max_valence - self.min_valence) * (size - 1)))
+        i = min(max(i, 0), size - 1)
+        j = min(max(j, 0), size - 1)
+
+        cell_candidates = candidates[i, j]
+        count = int((cell_candidates >= 0).sum())
+        if count == 0:
+            raise ValueError('no points to sample near ' + str((arousal, valence)))
+
+        index = int(np.searchsorted(self.raster['cumulative'][i, j, :count], random.random()))
+        return self.points[cell_candidates[min(index, count - 1)]]
+
     def get_last_point(self):
         return self.last_point
 
@@ -105,28 +285,16 @@ class TempoGrid(AVGrid):
         self.min_tempo = 60
         self.max_tempo = 240
 
-    def insert(self, value, arousal, valence):
+    def check_value(self, value):
 
         # use minimum and maximum tempo bounds
         value = max(value, self.min_tempo)
         value = min(value, self.max_tempo)
 
-        # use ancestor's insert method with new value
-        super(TempoGrid, self).insert(value, arousal, valence)
+        return value
 
-    def parse_point_file(self, filepath):
-        # open text file
-        f = open(filepath, 'r')
-
-        # read all regions
-        for line in f.readlines():
-            line = line.strip().split('\t')
-
-            value = int(line[0])
-            # print(line[1].split(' '))
-            point = [float(i) for i in line[1:]]
-
-            self.insert(value, point[0], point[1])
+    def parse_value(self, fields):
+        return int(fields[0])
 
 
 class InstrumentGrid(AVGrid):
@@ -138,43 +306,27 @@ class InstrumentGrid(AVGrid):
     def __init__(self):
         super(InstrumentGrid, self).__init__()
 
-        self.instruments_file_path = './synth_data/synth_patches.txt'
-        self.instruments = []
-
-        # open text file
-        f = open(self.instruments_file_path, 'r')
+        self.instruments_file_path = PATCHES_FILE_PATH
+        self.instruments = get_patch_names(self.instruments_file_path)
 
-        # index all the instruments
-        for line in f.readlines():
-            line = line.split()
-            self.instruments.append(" ".join(line[1:]))
+    def get_patches(self):
+        """
+        Returns the set of all the patches used by the points of the grid.
+        """
+        return set(patch for point in self.points for patch in point.get_value())
 
-    def insert(self, value, arousal, valence):
+    def check_value(self, value):
 
         # use minimum and maximum instrument bounds
+        value = list(value)
         for i in range(len(value)):
             value[i] = max(value[i], 0)
             value[i] = min(value[i], len(self.instruments) - 1)
 
-        # use ancestor's insert method with new value
-        super(InstrumentGrid, self).insert(tuple(value), arousal, valence)
-
-    def parse_point_file(self, filepath):
-        # open text file
-        f = open(filepath, 'r')
-
-        # read all regions
-        for line in f.readlines():
-            line = line.strip().split('\t')
-
-            value = [int(n) for n in line[0:-2] if n is not '']
-            print(value)
+        return tuple(value)
 
-            # print(line[1].split(' '))
-            point = [float(i) for i in line[-2:]]
-            print(point)
-
-            self.insert(value, point[0], point[1])
+    def parse_value(self, fields):
+        return [int(n) for n in fields if n != '']
 
 
 class KeySignatureGrid(AVGrid):
@@ -190,32 +342,17 @@ class KeySignatureGrid(AVGrid):
         self.accidentals = ['', '-', '#']
         self.modes = ['major', 'minor']
 
-    def insert(self, value, arousal, valence):
+    def check_value(self, value):
 
         # verify key signature values
         key = value[0] if value[0] in self.tonics else 'c'
         accidental = value[1] if value[1] in self.accidentals else ''
         mode = value[2] if value[2] in self.modes else 'major'
 
-        value = (key, accidental, mode)
-
-        # use ancestor's insert method with new value
-        super(KeySignatureGrid, self).insert(value, arousal, valence)
-
-    def parse_point_file(self, filepath):
-
-		# open text file
-        f = open(filepath, 'r')
+        return (key, accidental, mode)
 
-        # read all regions
-        for line in f.readlines():
-            line = line.strip().split('\t')
-
-            value = tuple(line[0].split(' '))
-            # print(line[1].split(' '))
-            point = [float(i) for i in line[1:]]
-
-            self.insert(value, point[0], point[1])
+    def parse_value(self, fields):
+        return tuple(fields[0].split(' '))
 
 
 class RhythmGrid(AVGrid):
@@ -227,30 +364,14 @@ class RhythmGrid(AVGrid):
     def __init__(self):
         super(RhythmGrid, self).__init__()
 
-    def insert(self, value, arousal, valence):
+    def check_value(self, value):
 
         assert len(value) == 4
 
-        # use ancestor's insert method with new value
-        super(RhythmGrid, self).insert(value, arousal, valence)
-
-
-    def parse_point_file(self, filepath):
-
-        # open text file
-        f = open(filepath, 'r')
-
-        # read all regions
-        for line in f.readlines():
-            line = line.strip().split('\t')
-
-            value = tuple([int(n) for n in line[0].split(' ')])
-            print(value)
-            # print(line[1].split(' '))
-            point = [float(i) for i in line[1:]]
-
-            self.insert(value, point[0], point[1])
+        return value
 
+    def parse_value(self, fields):
+        return tuple([int(n) for n in fields[0].split(' ')])
 
 
 
@@ -337,3 +458,67 @@ def weighted_random(distribution):
         if roll <= total:
             return k
     assert False, 'unreachable'
+
+
+# patch names, by file path (shared by all the instrument grids)
+patch_names = {}
+
+def get_patch_names(filepath=PATCHES_FILE_PATH):
+    if filepath not in patch_names:
+        with open(filepath, 'r') as f:
+            patch_names[filepath] = [" ".join(line.split()[1:]) for line in f.readlines()]
+
+    return patch_names[filepath]
+
+def read_point_file(filepath):
+    """
+    Returns the (value fields, arousals, valences) columns of a point file. Binary (.npy) point files are memory-mapped.
+    """
+    if filepath.endswith('.npy'):
+        points = np.load(filepath, mmap_mode='r')
+        return points['value'], np.asarray(points['arousal']), np.asarray(points['valence'])
+
+    values = []
+    arousals = []
+    valences = []
+
+    with open(filepath, 'r') as f:
+        for line in f.readlines():
+            line = line.strip().split('\t')
+            if len(line) < 3:
+                continue
+
+            values.append('\t'.join(line[:-2]))
+            arousals.append(float(line[-2]))
+            valences.append(float(line[-1]))
+
+    return values, np.array(arousals), np.array(valences)
+
+def convert_point_file(filepath, npy_filepath=None):
+    """
+    Converts a tab-separated point file to a binary (.npy) one, saved next to it by default.
+    """
+    if npy_filepath is None:
+        npy_filepath = os.path.splitext(filepath)[0] + '.npy'
+
+    values, arousals, valences = read_point_file(filepath)
+
+    width = max([MIN_VALUE_WIDTH] + [len(value) for value in values])
+    points = np.empty(len(values), dtype=get_point_dtype(width))
+    points['value'] = values
+    points['arousal'] = arousals
+    points['valence'] = valences
+
+    # numpy strings silently lose trailing null characters, so make sure every value comes back as it went in
+    if points['value'].tolist() != list(values):
+        raise ValueError("values of " + filepath + " can't be stored in a binary point file")
+
+    np.save(npy_filepath, points)
+    return npy_filepath
+
+
+# python av_grid.py <point files...>: convert text point files to binary ones
+if __name__ == '__main__':
+    import sys
+    for filepath in sys.argv[1:]:
+        print(filepath + ' -> ' + convert_point_file(filepath))
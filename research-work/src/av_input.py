@@ -0,0 +1,374 @@
+import os
+import math
+import select
+import socket
+import threading
+import time
+import ctypes
+import ctypes.util
+from collections import deque, namedtuple
+
+# where the writer (av-writer.py) sends arousal/valence values
+AV_FILE_PATH = './data/av.txt'
+AV_SOCKET_PATH = './data/av.sock'
+AV_FIFO_PATH = './data/av.fifo'
+
+# how long a source's thread blocks before checking whether it was stopped
+WAIT_TIMEOUT = 0.5
+
+# a single arousal/valence reading, with the time it arrived at
+AVSample = namedtuple('AVSample', ['time', 'arousal', 'valence'])
+
+# inotify events for a file being written to
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+
+
+def parse_av_line(line):
+    """
+    Parses an "arousal valence" line, returning (arousal, valence) or None if the line isn't valid.
+    """
+    values = line.split()
+    if len(values) != 2:
+        return None
+
+    try:
+        return float(values[0]), float(values[1])
+    except ValueError:
+        return None
+
+
+def create_fifo(filepath):
+    """
+    Creates the named pipe at filepath, if it doesn't exist yet.
+    """
+    if not os.path.exists(filepath):
+        os.mkfifo(filepath)
+
+
+class AVSource:
+
+    """
+    A source of arousal/valence samples. Samples are read on a background thread and
+    queued, and the engine collects whatever arrived since the last time with poll().
+
+    read_lines is called on the thread, and returns a generator of the lines as they're read. It
+    yields None whenever it waited WAIT_TIMEOUT without reading anything, so that the thread can
+    stop, and it's closed (running its cleanup) when the thread does.
+    """
+
+    def __init__(self, read_lines):
+        self.read_lines = read_lines
+        self.samples = deque()
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        if not self.running:
+            self.running = True
+            self.thread = threading.Thread(target=self._run)
+            self.thread.daemon = True
+            self.thread.start()
+
+    def stop(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join(2 * WAIT_TIMEOUT)
+            self.thread = None
+
+    def poll(self):
+        """
+        Returns the samples that arrived since the last poll, oldest first.
+        """
+        samples = []
+        while self.samples:
+            samples.append(self.samples.popleft())
+
+        return samples
+
+    def push_line(self, line):
+        av = parse_av_line(line)
+        if av is not None:
+            self.samples.append(AVSample(time.time(), av[0], av[1]))
+
+    def _run(self):
+        lines = self.read_lines()
+        try:
+            for line in lines:
+                if not self.running:
+                    break
+                if line is not None:
+                    self.push_line(line)
+        finally:
+            lines.close()
+
+
+class FileTailSource(AVSource):
+
+    """
+    Follows a text file of "arousal valence" lines as they're appended. Waits for changes with
+    inotify where it's available (Linux), and otherwise checks the file every poll_interval seconds.
+    Lines already in the file when it starts are history, and only the last of them (the current
+    value, if seed_last) is used, rather than all arriving at once with the same time.
+    """
+
+    def __init__(self, filepath=AV_FILE_PATH, seed_last=True, poll_interval=0.05):
+        super(FileTailSource, self).__init__(self._read_lines)
+        self.filepath = filepath
+        self.seed_last = seed_last
+        self.poll_interval = poll_interval
+
+    def _read_lines(self):
+        f = open(self.filepath, 'r')
+
+        # skip the history, except for its last value (a line still being written is kept for later)
+        lines = f.read().split('\n')
+        partial = lines.pop()
+        if self.seed_last:
+            for line in reversed(lines):
+                if parse_av_line(line) is not None:
+                    yield line
+                    break
+
+        inotify_fd = self._open_inotify()
+
+        try:
+            while True:
+                # the writer starts the file over when it opens it
+                if os.path.getsize(self.filepath) < f.tell():
+                    f.seek(0)
+                    partial = ''
+
+                # read complete lines, keeping anything after the last newline for later
+                data = f.read()
+                if data:
+                    lines = (partial + data).split('\n')
+                    partial = lines.pop()
+                    for line in lines:
+                        yield line
+
+                self._wait(inotify_fd)
+                yield None
+        finally:
+            f.close()
+            if inotify_fd is not None:
+                os.close(inotify_fd)
+
+    def _open_inotify(self):
+        """
+        Returns an inotify file descriptor watching the file for writes, or None if inotify isn't available.
+        """
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+            fd = libc.inotify_init()
+            if fd < 0:
+                return None
+
+            if libc.inotify_add_watch(fd, self.filepath.encode('utf-8'), IN_MODIFY | IN_CLOSE_WRITE) < 0:
+                os.close(fd)
+                return None
+
+            return fd
+        except (OSError, AttributeError, TypeError):
+            return None
+
+    def _wait(self, inotify_fd):
+        if inotify_fd is None:
+            time.sleep(self.poll_interval)
+            return
+
+        readable, _, _ = select.select([inotify_fd], [], [], WAIT_TIMEOUT)
+        if readable:
+            # the events themselves don't matter, only that the file changed
+            os.read(inotify_fd, 4096)
+
+
+class FifoSource(AVSource):
+
+    """
+    Reads "arousal valence" lines from a named pipe (created if it doesn't exist), blocking until
+    they're written. Writers can come and go.
+    """
+
+    def __init__(self, filepath=AV_FIFO_PATH):
+        super(FifoSource, self).__init__(self._read_lines)
+        self.filepath = filepath
+
+        create_fifo(self.filepath)
+
+    def _read_lines(self):
+        # non-blocking open, so that stop() doesn't wait on a writer that never comes. Holding a
+        # write end of our own means the pipe never reads as closed between writers.
+        fd = os.open(self.filepath, os.O_RDONLY | os.O_NONBLOCK)
+        keep_open_fd = os.open(self.filepath, os.O_WRONLY | os.O_NONBLOCK)
+        partial = b''
+
+        try:
+            while True:
+                readable, _, _ = select.select([fd], [], [], WAIT_TIMEOUT)
+                if not readable:
+                    yield None
+                    continue
+
+                lines = (partial + os.read(fd, 4096)).split(b'\n')
+                partial = lines.pop()
+                for line in lines:
+                    yield line.decode('utf-8', 'ignore')
+        finally:
+            os.close(keep_open_fd)
+            os.close(fd)
+
+
+class SocketSource(AVSource):
+
+    """
+    Receives "arousal valence" lines as datagrams on a local UNIX socket.
+    """
+
+    def __init__(self, socket_path=AV_SOCKET_PATH):
+        super(SocketSource, self).__init__(self._read_lines)
+        self.socket_path = socket_path
+
+    def _read_lines(self):
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        sock.bind(self.socket_path)
+        sock.settimeout(WAIT_TIMEOUT)
+
+        try:
+            while True:
+                try:
+                    data = sock.recv(4096)
+                except socket.timeout:
+                    yield None
+                    continue
+
+                for line in data.decode('utf-8', 'ignore').split('\n'):
+                    yield line
+        finally:
+            sock.close()
+            os.unlink(self.socket_path)
+
+
+def send_av(sock, arousal, valence, socket_path=AV_SOCKET_PATH):
+    """
+    Sends an arousal/valence value to a SocketSource listening on socket_path.
+    """
+    sock.sendto(('%s %s\n' % (arousal, valence)).encode('utf-8'), socket_path)
+
+
+class OneEuroFilter:
+
+    """
+    One Euro filter (Casiez et al.): exponential smoothing whose cutoff frequency rises with the
+    speed of the signal, so that it's smooth when the signal is still and responsive when it moves.
+    With beta = 0 it's plain exponential smoothing at min_cutoff Hz.
+    """
+
+    def __init__(self, min_cutoff=1.0, beta=0.0, d_cutoff=1.0):
+        self.min_cutoff = min_cutoff
+        self.beta = beta
+        self.d_cutoff = d_cutoff
+
+        self.value = None
+        self.derivative = 0.0
+        self.time = None
+
+    def get_alpha(self, cutoff, elapsed):
+        tau = 1.0 / (2 * math.pi * cutoff)
+        return 1.0 / (1.0 + tau / elapsed)
+
+    def filter(self, value, t):
+        if self.value is None:
+            self.value = value
+            self.time = t
+            return value
+
+        elapsed = t - self.time
+        if elapsed <= 0:
+            return self.value
+
+        # smoothed speed of the signal
+        derivative = (value - self.value) / elapsed
+        a = self.get_alpha(self.d_cutoff, elapsed)
+        self.derivative = a * derivative + (1 - a) * self.derivative
+
+        # the faster the signal moves, the less it gets smoothed
+        cutoff = self.min_cutoff + self.beta * abs(self.derivative)
+        a = self.get_alpha(cutoff, elapsed)
+        self.value = a * value + (1 - a) * self.value
+        self.time = t
+
+        return self.value
+
+
+class AVSmoother:
+
+    """
+    Smooths a stream of arousal/valence samples (with a One Euro filter on each). The input is
+    sparse (it only changes when a new sample arrives), so step() the filters every frame to keep
+    moving toward the latest sample in between.
+    """
+
+    def __init__(self, min_cutoff=1.0, beta=0.0):
+        self.arousal_filter = OneEuroFilter(min_cutoff, beta)
+        self.valence_filter = OneEuroFilter(min_cutoff, beta)
+
+        # the latest raw sample, which the filters move toward
+        self.latest = None
+
+    def filter(self, sample):
+        self.latest = sample
+        return self.step(sample.time)
+
+    def step(self, t):
+        """
+        Advances the filters to time t toward the latest sample, returning the smoothed
+        value (or None before the first sample).
+        """
+        if self.latest is None:
+            return None
+
+        arousal = self.arousal_filter.filter(self.latest.arousal, t)
+        valence = self.valence_filter.filter(self.latest.valence, t)
+        return AVSample(t, arousal, valence)
+
+
+class ParameterGate:
+
+    """
+    Decides when a musical parameter should follow the arousal/valence input again: only once the
+    input is at least distance away from where the parameter last changed (hysteresis), and at least
+    dwell beats after that change.
+    """
+
+    def __init__(self, distance, dwell):
+        self.distance = distance
+        self.dwell = dwell
+
+        # where and when the parameter last changed
+        self.arousal = None
+        self.valence = None
+        self.beat = None
+
+        # stats
+        self.passed = 0
+        self.held = 0
+
+    def check(self, arousal, valence, beat):
+        """
+        Returns whether the parameter should change at this point and beat, and if so, records the change.
+        """
+        if self.beat is not None:
+            moved = math.hypot(arousal - self.arousal, valence - self.valence)
+            if moved < self.distance or beat - self.beat < self.dwell:
+                self.held += 1
+                return False
+
+        self.arousal = arousal
+        self.valence = valence
+        self.beat = beat
+        self.passed += 1
+        return True
@@ -8,12 +8,15 @@
 #
 #####################################################################
 
-import pyaudio
 import numpy as np
 from . import core
+from .lazy import lazy_import
 import time
 from configparser import ConfigParser
 
+# only loaded once audio is actually opened, so tools that don't play audio don't need it
+pyaudio = lazy_import('pyaudio')
+
 class Audio(object):
     # global variable: might change when Audio driver is set up.
     sample_rate = 44100
@@ -0,0 +1,74 @@
+#####################################################################
+#
+# basewidget.py
+#
+# Copyright (c) 2015, Eran Egozy
+#
+# Released under the MIT License (http://opensource.org/licenses/MIT)
+#
+#####################################################################
+
+from kivy.core.window import Window
+from kivy.uix.widget import Widget
+from kivy.clock import Clock
+from .core import FrameScheduler
+
+
+class BaseWidget(Widget):
+    """Has some common core functionality we want in all
+    our apps - handling key up/down, closing the app, and update on every frame.
+    The subclass of BaseWidget can optionally define these methods, which will
+    get called if defined:
+       def on_key_down(self, keycode, modifiers):
+       def on_key_up(self, keycode):
+       def on_close(self):
+       def on_update(self):
+    on_update is a critical task of self.frame_scheduler, and runs every frame.
+    Work that can wait when a frame runs long (like updating text) can be added
+    to it as deferrable tasks, with self.frame_scheduler.add_task(name, func).
+    """
+
+    def __init__(self, **kwargs):
+        super(BaseWidget, self).__init__(**kwargs)
+
+        if hasattr(self.__class__, 'on_init'):
+            Clock.schedule_once(self._init, 0)
+
+        # keyboard up / down messages
+        self.down_keys = []
+        kb = Window.request_keyboard(target=self, callback=None)
+        kb.bind(on_key_down=self._key_down)
+        kb.bind(on_key_up=self._key_up)
+
+        # get called when app is about to shut down
+        if hasattr(self.__class__, 'on_close'):
+            Window.bind(on_close=self._close)
+
+        # create a clock to poll us every frame, running the frame's tasks
+        self.frame_scheduler = FrameScheduler()
+        if hasattr(self.__class__, 'on_update'):
+            self.frame_scheduler.add_task('update', self.on_update, critical=True)
+        Clock.schedule_interval(self._update, 0)
+
+    def get_mouse_pos(self) :
+        return Window.mouse_pos
+
+    def _key_down(self, keyboard, keycode, text, modifiers):
+        if not keycode[1] in self.down_keys:
+            self.down_keys.append(keycode[1])
+
+            if hasattr(self.__class__, 'on_key_down'):
+                self.on_key_down(keycode, modifiers)
+
+    def _key_up(self, keyboard, keycode):
+        if keycode[1] in self.down_keys:
+            self.down_keys.remove(keycode[1])
+
+            if hasattr(self.__class__, 'on_key_up'):
+                self.on_key_up(keycode)
+
+    def _close(self, *args):
+        self.on_close()
+
+    def _update(self, dt):
+        self.frame_scheduler.run_frame()
@@ -9,6 +9,9 @@
 #####################################################################
 
 import time
+import threading
+import traceback
+from collections import deque, defaultdict
 import numpy as np
 from .audio import Audio
 
@@ -200,12 +203,21 @@ class AudioScheduler(object):
         self.tempo_map = tempo_map
         self.commands = []
 
+        # commands can be posted from other threads (see LookaheadScheduler)
+        self.lock = threading.RLock()
+
         self.generator = None
         self.cur_frame = 0
 
+        self.event_bus = None
+
     def set_generator(self, gen) :
         self.generator = gen
 
+    # musical events are published to this event bus (see EventBus)
+    def set_event_bus(self, bus) :
+        self.event_bus = bus
+
     def generate(self, num_frames, num_channels) :
         output = np.empty(num_channels * num_frames, dtype = np.float32)
         o_idx = 0
@@ -214,18 +226,22 @@ class AudioScheduler(object):
         end_frame = self.cur_frame + num_frames
 
         # advance time and fire off commands for this time frame
-        while self.commands:
-            # find the exact frame at which the next command should happen
-            cmd_tick = self.commands[0].tick
-            cmd_time = self.tempo_map.tick_to_time(cmd_tick)
-            cmd_frame = int(cmd_time * Audio.sample_rate)
-
-            if cmd_frame < end_frame:
-                o_idx = self._generate_until(cmd_frame, num_channels, output, o_idx)
+        while True:
+            with self.lock:
+                if not self.commands:
+                    break
+
+                # find the exact frame at which the next command should happen
+                cmd_tick = self.commands[0].tick
+                cmd_time = self.tempo_map.tick_to_time(cmd_tick)
+                cmd_frame = int(cmd_time * Audio.sample_rate)
+
+                if cmd_frame >= end_frame:
+                    break
                 command = self.commands.pop(0)
-                command.execute()
-            else:
-                break
+
+            o_idx = self._generate_until(cmd_frame, num_channels, output, o_idx)
+            command.execute()
 
         self._generate_until(end_frame, num_channels, output, o_idx)
 
@@ -264,20 +280,40 @@ class AudioScheduler(object):
         post_time = self.tempo_map.tick_to_time(tick)
 
         if post_time <= now_time:
-            func(tick, arg)
+            func(tick, *args)
             return None
         else:
             # create a command to hold the function/arg and sort by tick
             cmd = Command(tick, func, *args)
-            self.commands.append(cmd)
-            self.commands.sort(key = lambda x: x.tick)
+            with self.lock:
+                self.commands.append(cmd)
+                self.commands.sort(key = lambda x: x.tick)
             return cmd
 
+    # play a batch of midi events (see fluidsynth.Synth.apply_events) on the
+    # generator at the particular tick
+    def post_events_at_tick(self, tick, events):
+        return self.post_at_tick(tick, self._apply_events, events)
+
+    def _apply_events(self, tick, events):
+        self.generator.apply_events(events)
+
+    # publish an event to the event bus. Call it from a command to publish as
+    # the command plays, or use publish_at_tick.
+    def publish(self, tick, kind, *args):
+        if self.event_bus is not None:
+            self.event_bus.publish(kind, tick, *args)
+
+    # publish an event to the event bus when the particular tick plays
+    def publish_at_tick(self, tick, kind, *args):
+        return self.post_at_tick(tick, self.publish, kind, *args)
+
     # attempt a removal. Does nothing if cmd is not found
     def remove(self, cmd):
-        if cmd in self.commands:
-            idx = self.commands.index(cmd)
-            del self.commands[idx]
+        with self.lock:
+            if cmd in self.commands:
+                idx = self.commands.index(cmd)
+                del self.commands[idx]
 
     def now_str(self):
         time = self.get_time()
@@ -304,6 +340,197 @@ class Command(object):
     def __repr__(self):
         return 'cmd:%d' % self.tick
 
+# EventBus carries musical events (note on, measure start, key change...) from
+# the audio thread, where the scheduler plays them, to the UI thread. Publishing
+# only appends to a deque, which is atomic, so the audio thread never waits on a
+# lock. The UI calls drain() once per frame, which calls the callbacks subscribed
+# to each kind of event as callback(tick, *args). At most max_events are handled
+# per frame and the rest wait for the next one, so a burst of notes can't stall
+# a frame. If the UI falls max_queued events behind, the oldest are dropped.
+class EventBus(object):
+    def __init__(self, max_queued = 1024):
+        super(EventBus, self).__init__()
+        self.queue = deque(maxlen = max_queued)
+        self.subscribers = defaultdict(list)
+
+        # stats
+        self.published = 0
+        self.handled = 0
+
+    def subscribe(self, kind, callback):
+        self.subscribers[kind].append(callback)
+
+    def unsubscribe(self, kind, callback):
+        if callback in self.subscribers[kind]:
+            self.subscribers[kind].remove(callback)
+
+    # can be called from any thread
+    def publish(self, kind, tick, *args):
+        self.published += 1
+        self.queue.append((kind, tick, args))
+
+    # call from the UI thread. Returns the number of events handled.
+    def drain(self, max_events = None):
+        count = 0
+        while self.queue and (max_events is None or count < max_events):
+            kind, tick, args = self.queue.popleft()
+            for callback in self.subscribers.get(kind, ()):
+                callback(tick, *args)
+            count += 1
+
+        self.handled += count
+        return count
+
+    def get_num_queued(self):
+        return len(self.queue)
+
+    def now_str(self):
+        queued = len(self.queue)
+        dropped = max(0, self.published - self.handled - queued)
+        return "events: %d queued, %d dropped" % (queued, dropped)
+
+
 # helper function for quantization:
 def quantize_tick_up(tick, grid) :
     return tick - (tick % grid) + grid
+
+
+# SequencerScheduler is an AudioScheduler that hands midi events to FluidSynth's
+# own sequencer (a fluidsynth.Sequencer on the generator synth, with a time scale
+# of Audio.sample_rate), timestamped to the exact sample. The synth plays them
+# while it renders, so blocks with only midi events render in one piece. Other
+# commands posted with post_at_tick still split the block where they happen.
+# The sequencer only knows samples, so call retime() when the tempo changes.
+class SequencerScheduler(AudioScheduler):
+    def __init__(self, tempo_map, sequencer) :
+        super(SequencerScheduler, self).__init__(tempo_map)
+        self.sequencer = sequencer
+
+        # sequencer time minus scheduler frame. The sequencer's clock runs with
+        # the synth, which can render audio the scheduler didn't ask for, so
+        # this is measured again at the start of every block.
+        self.sequencer_offset = sequencer.get_tick()
+
+        # (tick, send function, args) of the events handed to the sequencer and
+        # not played yet, to send them again at their new times if the tempo changes
+        self.pending = []
+
+    def generate(self, num_frames, num_channels) :
+        with self.lock:
+            self.sequencer_offset = self.sequencer.get_tick() - self.cur_frame
+
+        output = super(SequencerScheduler, self).generate(num_frames, num_channels)
+
+        # forget the events that played in this block
+        with self.lock:
+            if self.pending:
+                now_tick = self.get_tick()
+                self.pending = [p for p in self.pending if p[0] >= now_tick]
+
+        return output
+
+    # sequencer time (in samples) of the tick
+    def _sequencer_time(self, tick):
+        frame = int(self.tempo_map.tick_to_time(tick) * Audio.sample_rate)
+        return max(frame + self.sequencer_offset, self.sequencer.get_tick())
+
+    def _send(self, tick, func, *args):
+        with self.lock:
+            self.pending.append((tick, func, args))
+            func(self._sequencer_time(tick), *args, absolute=True)
+
+    def post_noteon_at_tick(self, tick, chan, key, vel):
+        self._send(tick, self.sequencer.noteon_at, chan, key, vel)
+
+    def post_noteoff_at_tick(self, tick, chan, key):
+        self._send(tick, self.sequencer.noteoff_at, chan, key)
+
+    def post_cc_at_tick(self, tick, chan, ctrl, val):
+        self._send(tick, self.sequencer.cc_at, chan, ctrl, val)
+
+    def post_events_at_tick(self, tick, events):
+        self._send(tick, self.sequencer.send_events_at, events)
+
+    # drop all the midi events that haven't played yet
+    def clear_events(self):
+        with self.lock:
+            self.pending = []
+            self.sequencer.clear()
+
+    # take back the events that haven't played yet and send them again at the
+    # sample their tick now falls on
+    def retime(self):
+        with self.lock:
+            now_tick = self.get_tick()
+            self.pending = [p for p in self.pending if p[0] >= now_tick]
+            self.sequencer.clear()
+
+            for tick, func, args in self.pending:
+                func(self._sequencer_time(tick), *args, absolute=True)
+
+
+# LookaheadScheduler keeps the scheduler filled with lookahead beats of music
+# ahead of its current tick, from its own thread (so UI frame hitches don't
+# delay it). callback(tick) must post everything from tick on (e.g. a measure)
+# and return how many ticks it posted; the next call starts where it ended.
+class LookaheadScheduler(object):
+    def __init__(self, sched, callback, lookahead = 4, start_tick = 0, period = 0.01):
+        super(LookaheadScheduler, self).__init__()
+        self.sched = sched
+        self.callback = callback
+        self.lookahead = lookahead
+        self.next_tick = start_tick
+        self.period = period
+
+        # number of times the callback came in after its tick had already passed
+        self.late = 0
+
+        # the exception that stopped the thread, if any
+        self.error = None
+
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        if not self.running:
+            self.running = True
+            self.thread = threading.Thread(target = self._run)
+            self.thread.daemon = True
+            self.thread.start()
+
+    def stop(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def get_next_tick(self):
+        return self.next_tick
+
+    # posts everything due up to lookahead beats ahead of now
+    def fill(self):
+        now_tick = self.sched.get_tick()
+
+        # if we fell behind, start again from now rather than posting the past all at once
+        if self.next_tick < now_tick:
+            self.late += 1
+            self.next_tick = now_tick
+
+        while self.next_tick < now_tick + self.lookahead * kTicksPerQuarter:
+            length = self.callback(self.next_tick)
+            if length <= 0:
+                break
+            self.next_tick += length
+
+    # a failing callback would fail again every period, so report it once and stop
+    def _run(self):
+        while self.running:
+            try:
+                self.fill()
+            except Exception as e:
+                print('lookahead scheduler stopped:')
+                traceback.print_exc()
+                self.error = e
+                self.running = False
+                break
+            time.sleep(self.period)
@@ -10,67 +10,124 @@
 
 
 
-import kivy
-from kivy.app import App
-from kivy.core.window import Window
-from kivy.uix.widget import Widget
-from kivy.clock import Clock
+import time
 import traceback
 
+__all__ = ['BaseWidget', 'FrameScheduler', 'register_terminate_func', 'run', 'lookup']
+
+
+# BaseWidget (in basewidget.py) needs Kivy, so it's only imported when it's
+# first asked for. The rest of this module can be used without Kivy.
+def __getattr__(name):
+    if name == 'BaseWidget':
+        from .basewidget import BaseWidget
+        return BaseWidget
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
+
+
+# a task run by a FrameScheduler, with its timing stats
+class FrameTask(object):
+    def __init__(self, name, func, critical):
+        super(FrameTask, self).__init__()
+        self.name = name
+        self.func = func
+        self.critical = critical
+
+        # moving average of how long it takes to run, in seconds
+        self.avg_time = None
+
+        # frames skipped in a row, and in total
+        self.skips = 0
+        self.total_skips = 0
+        self.runs = 0
+
+
+# FrameScheduler runs the work of each frame within a time budget (in seconds).
+# Critical tasks (the audio pump) run every frame, first. Deferrable tasks
+# (event dispatch, animation, label text) run after them, each only if its
+# average time still fits in what's left of the budget, longest waiting first.
+# A deferrable task that was skipped max_skips frames in a row runs anyway, so
+# nothing starves.
+class FrameScheduler(object):
+    def __init__(self, budget = 1 / 60., max_skips = 10, smoothing = 0.9):
+        super(FrameScheduler, self).__init__()
+        self.budget = budget
+        self.max_skips = max_skips
+        self.smoothing = smoothing
+        self.tasks = []
+
+        # stats
+        self.avg_frame_time = 0
+        self.frames = 0
+        self.overruns = 0
+
+    # add a task that calls func() every frame (or as often as the budget allows
+    # for tasks that aren't critical). Tasks of each kind run in the order added.
+    def add_task(self, name, func, critical = False):
+        task = FrameTask(name, func, critical)
+        self.tasks.append(task)
+        return task
+
+    def remove_task(self, name):
+        self.tasks = [t for t in self.tasks if t.name != name]
+
+    def get_task(self, name):
+        for task in self.tasks:
+            if task.name == name:
+                return task
+        return None
 
-class BaseWidget(Widget):
-    """Has some common core functionality we want in all
-    our apps - handling key up/down, closing the app, and update on every frame.
-    The subclass of BaseWidget can optionally define these methods, which will
-    get called if defined:
-       def on_key_down(self, keycode, modifiers):
-       def on_key_up(self, keycode):
-       def on_close(self):
-       def on_update(self):
-    """
-
-    def __init__(self, **kwargs):
-        super(BaseWidget, self).__init__(**kwargs)
-
-        if hasattr(self.__class__, 'on_init'):
-            Clock.schedule_once(self._init, 0)
-
-        # keyboard up / down messages
-        self.down_keys = []
-        kb = Window.request_keyboard(target=self, callback=None)
-        kb.bind(on_key_down=self._key_down)
-        kb.bind(on_key_up=self._key_up)
-
-        # get called when app is about to shut down
-        if hasattr(self.__class__, 'on_close'):
-            Window.bind(on_close=self._close)
-
-        # create a clock to poll us every frame
-        if hasattr(self.__class__, 'on_update'):
-            Clock.schedule_interval(self._update, 0)
-
-    def get_mouse_pos(self) :
-        return Window.mouse_pos
-
-    def _key_down(self, keyboard, keycode, text, modifiers):
-        if not keycode[1] in self.down_keys:
-            self.down_keys.append(keycode[1])
-
-            if hasattr(self.__class__, 'on_key_down'):
-                self.on_key_down(keycode, modifiers)
-
-    def _key_up(self, keyboard, keycode):
-        if keycode[1] in self.down_keys:
-            self.down_keys.remove(keycode[1])
-
-            if hasattr(self.__class__, 'on_key_up'):
-                self.on_key_up(keycode)
-
-    def _close(self, *args):
-        self.on_close()
-
-    def _update(self, dt):
-        self.on_update()
+    def run_frame(self):
+        start = time.time()
+
+        for task in self.tasks:
+            if task.critical:
+                self._run(task)
+
+        # sorting is stable, so tasks waiting equally long keep their order
+        deferrable = sorted([t for t in self.tasks if not t.critical], key = lambda t: -t.skips)
+        for task in deferrable:
+            elapsed = time.time() - start
+            if task.avg_time is None or task.skips >= self.max_skips or elapsed + task.avg_time <= self.budget:
+                self._run(task)
+            else:
+                task.skips += 1
+                task.total_skips += 1
+
+        frame_time = time.time() - start
+        a = self.smoothing
+        self.avg_frame_time = a * self.avg_frame_time + (1-a) * frame_time
+        self.frames += 1
+        if frame_time > self.budget:
+            self.overruns += 1
+
+    def _run(self, task):
+        t_start = time.time()
+        task.func()
+        dt = time.time() - t_start
+
+        if task.avg_time is None:
+            task.avg_time = dt
+        else:
+            a = self.smoothing
+            task.avg_time = a * task.avg_time + (1-a) * dt
+
+        task.skips = 0
+        task.runs += 1
+
+    def get_stats(self):
+        return {t.name: {'critical': t.critical,
+                         'avg_time': t.avg_time or 0,
+                         'runs': t.runs,
+                         'skips': t.total_skips} for t in self.tasks}
+
+    def now_str(self):
+        txt = "frame:%.1fms (%d over budget)" % (1000 * self.avg_frame_time, self.overruns)
+        for t in self.tasks:
+            txt += "\n  %s:%.1fms" % (t.name, 1000 * (t.avg_time or 0))
+            if not t.critical:
+                txt += " (%d skipped)" % t.total_skips
+        return txt
 
 
 # to guarantee a termination/shutdown function being called at the end of the
@@ -88,6 +145,8 @@ def run(widget):
     even if it was caused by a program crash
     """
 
+    from kivy.app import App
+
     class MainApp(App):
         def build(self):
             return widget()
@@ -188,6 +188,75 @@ fluid_synth_set_reverb_on = cfunc('fluid_synth_set_reverb_on', c_void_p,
                                  ('synth', c_void_p, 1),
                                  ('on', c_int, 1))
 
+# Sequencer (timestamped events, played by the synth as it renders audio).
+# Not every build of FluidSynth exports these, so they are None when missing.
+try:
+    new_fluid_sequencer2 = cfunc('new_fluid_sequencer2', c_void_p,
+                                 ('use_system_timer', c_int, 1))
+
+    delete_fluid_sequencer = cfunc('delete_fluid_sequencer', None,
+                                   ('seq', c_void_p, 1))
+
+    fluid_sequencer_register_fluidsynth = cfunc('fluid_sequencer_register_fluidsynth', c_short,
+                                                ('seq', c_void_p, 1),
+                                                ('synth', c_void_p, 1))
+
+    fluid_sequencer_get_tick = cfunc('fluid_sequencer_get_tick', c_uint,
+                                     ('seq', c_void_p, 1))
+
+    fluid_sequencer_set_time_scale = cfunc('fluid_sequencer_set_time_scale', None,
+                                           ('seq', c_void_p, 1),
+                                           ('scale', c_double, 1))
+
+    fluid_sequencer_send_at = cfunc('fluid_sequencer_send_at', c_int,
+                                    ('seq', c_void_p, 1),
+                                    ('evt', c_void_p, 1),
+                                    ('time', c_uint, 1),
+                                    ('absolute', c_int, 1))
+
+    fluid_sequencer_remove_events = cfunc('fluid_sequencer_remove_events', None,
+                                          ('seq', c_void_p, 1),
+                                          ('source', c_short, 1),
+                                          ('dest', c_short, 1),
+                                          ('type', c_int, 1))
+
+    new_fluid_event = cfunc('new_fluid_event', c_void_p)
+
+    delete_fluid_event = cfunc('delete_fluid_event', None,
+                               ('evt', c_void_p, 1))
+
+    fluid_event_set_source = cfunc('fluid_event_set_source', None,
+                                   ('evt', c_void_p, 1),
+                                   ('src', c_short, 1))
+
+    fluid_event_set_dest = cfunc('fluid_event_set_dest', None,
+                                 ('evt', c_void_p, 1),
+                                 ('dest', c_short, 1))
+
+    fluid_event_noteon = cfunc('fluid_event_noteon', None,
+                               ('evt', c_void_p, 1),
+                               ('channel', c_int, 1),
+                               ('key', c_short, 1),
+                               ('vel', c_short, 1))
+
+    fluid_event_noteoff = cfunc('fluid_event_noteoff', None,
+                                ('evt', c_void_p, 1),
+                                ('channel', c_int, 1),
+                                ('key', c_short, 1))
+
+    fluid_event_control_change = cfunc('fluid_event_control_change', None,
+                                       ('evt', c_void_p, 1),
+                                       ('channel', c_int, 1),
+                                       ('control', c_short, 1),
+                                       ('val', c_int, 1))
+
+    fluid_event_program_change = cfunc('fluid_event_program_change', None,
+                                       ('evt', c_void_p, 1),
+                                       ('channel', c_int, 1),
+                                       ('val', c_int, 1))
+except AttributeError:
+    new_fluid_sequencer2 = None
+
 def fluid_synth_write_s16_stereo(synth, len):
     """Return generated samples in stereo 16-bit format
 
@@ -200,6 +269,45 @@ def fluid_synth_write_s16_stereo(synth, len):
     return numpy.fromstring(buf[:], dtype=numpy.int16)
 
 
+# Batched MIDI events
+#
+# A batch is a NumPy structured array, one event per row: what to do
+# (EVENT_*), on which channel, the key (or controller / program) and the value
+# (velocity / controller value). The checks run on the whole batch at once;
+# fluidsynth itself still takes the events one call at a time.
+
+EVENT_NOTEON = 0
+EVENT_NOTEOFF = 1
+EVENT_CC = 2
+EVENT_PROGRAM_CHANGE = 3
+
+EVENT_FIELDS = [('type', 'i4'), ('chan', 'i4'), ('key', 'i4'), ('value', 'i4')]
+
+def event_dtype():
+    """Return the NumPy dtype of a batch of events"""
+    import numpy
+    return numpy.dtype(EVENT_FIELDS)
+
+def new_event_array(events):
+    """Return a batch of events built from a list of (type, chan, key, value) tuples"""
+    import numpy
+    return numpy.array(events, dtype=event_dtype())
+
+def valid_events(events):
+    """Return the events of the batch that pass the same checks as
+    Synth.noteon(), Synth.noteoff() and Synth.cc(), as a plain list of
+    (type, chan, key, value) tuples"""
+    import numpy
+    events = numpy.asarray(events, dtype=event_dtype())
+
+    types, chans, keys, values = events['type'], events['chan'], events['key'], events['value']
+    valid = (chans >= 0) & (keys >= 0) & (keys <= 128)
+    valid &= (types != EVENT_NOTEON) | ((values >= 0) & (values <= 128))
+
+    # as python ints, so the ctypes calls don't convert numpy scalars one by one
+    return events[valid].tolist()
+
+
 # Object-oriented interface, simplifies access to functions
 
 class Synth(object):
@@ -282,6 +390,32 @@ class Synth(object):
             return False
         return fluid_synth_noteoff(self.synth, chan, key)
 
+    def apply_events(self, events):
+        """Apply a batch of events in order
+
+        events is a structured array of event_dtype() (see
+        new_event_array()), or a list of (type, chan, key, value) tuples.
+        Events are checked all at once, with the same rules as noteon(),
+        noteoff() and cc(), and invalid events are skipped.  Returns the
+        number of events applied.
+
+        """
+        events = valid_events(events)
+
+        # one call into fluidsynth per event, with no per-event checks
+        synth = self.synth
+        for event_type, chan, key, value in events:
+            if event_type == EVENT_NOTEON:
+                fluid_synth_noteon(synth, chan, key, value)
+            elif event_type == EVENT_NOTEOFF:
+                fluid_synth_noteoff(synth, chan, key)
+            elif event_type == EVENT_CC:
+                fluid_synth_cc(synth, chan, key, value)
+            elif event_type == EVENT_PROGRAM_CHANGE:
+                fluid_synth_program_change(synth, chan, key)
+
+        return len(events)
+
     def pitch_bend(self, chan, val):
         """Adjust pitch of a playing channel by small amounts
 
@@ -354,6 +488,84 @@ class Synth(object):
         """Turns reverb on (True) or off (False)"""
         return fluid_synth_set_reverb_on(self.synth, on)
 
+class Sequencer(object):
+    """Sequencer plays timestamped events on a Synth as it renders audio"""
+    def __init__(self, synth, time_scale=1000):
+        """Create a sequencer for the synth
+
+        The sequencer's clock advances with the audio rendered by the
+        synth (not with the system clock), at time_scale ticks per
+        second. Use the synth's sample rate to timestamp events in
+        samples.
+
+        """
+        if new_fluid_sequencer2 is None:
+            raise ImportError("This FluidSynth library has no sequencer.")
+
+        self.sequencer = new_fluid_sequencer2(0)
+        fluid_sequencer_set_time_scale(self.sequencer, time_scale)
+        self.synth_id = fluid_sequencer_register_fluidsynth(self.sequencer, synth.synth)
+
+        # events are copied when they are sent, so one is enough
+        self.event = new_fluid_event()
+        fluid_event_set_source(self.event, -1)
+        fluid_event_set_dest(self.event, self.synth_id)
+
+    def delete(self):
+        delete_fluid_event(self.event)
+        delete_fluid_sequencer(self.sequencer)
+
+    def get_tick(self):
+        """Return the sequencer's current time, in ticks"""
+        return fluid_sequencer_get_tick(self.sequencer)
+
+    def _send_at(self, time, absolute):
+        return fluid_sequencer_send_at(self.sequencer, self.event, int(time), absolute)
+
+    def noteon_at(self, time, chan, key, vel, absolute=True):
+        """Play a note at the given time (or in time ticks, if not absolute)"""
+        fluid_event_noteon(self.event, chan, key, vel)
+        return self._send_at(time, absolute)
+
+    def noteoff_at(self, time, chan, key, absolute=True):
+        """Stop a note at the given time"""
+        fluid_event_noteoff(self.event, chan, key)
+        return self._send_at(time, absolute)
+
+    def cc_at(self, time, chan, ctrl, val, absolute=True):
+        """Send a control change at the given time"""
+        fluid_event_control_change(self.event, chan, ctrl, val)
+        return self._send_at(time, absolute)
+
+    def send_events_at(self, time, events, absolute=True):
+        """Send a batch of events (see Synth.apply_events()) to play at the given time
+
+        Returns the number of events sent.
+
+        """
+        events = valid_events(events)
+
+        event = self.event
+        for event_type, chan, key, value in events:
+            if event_type == EVENT_NOTEON:
+                fluid_event_noteon(event, chan, key, value)
+            elif event_type == EVENT_NOTEOFF:
+                fluid_event_noteoff(event, chan, key)
+            elif event_type == EVENT_CC:
+                fluid_event_control_change(event, chan, key, value)
+            elif event_type == EVENT_PROGRAM_CHANGE:
+                fluid_event_program_change(event, chan, key)
+            else:
+                continue
+            self._send_at(time, absolute)
+
+        return len(events)
+
+    def clear(self):
+        """Remove all the events that haven't been played yet"""
+        fluid_sequencer_remove_events(self.sequencer, -1, -1, -1)
+
+
 def raw_audio_string(data):
     """Return a string of bytes to send to soundcard
 
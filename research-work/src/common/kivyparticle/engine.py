@@ -2,17 +2,19 @@
 
 from kivy.uix.widget import Widget
 from kivy.clock import Clock
-from kivy.graphics import Color, Callback, Rotate, PushMatrix, PopMatrix, Translate, Quad
+from kivy.graphics import Callback, Mesh, RenderContext
 from kivy.graphics.opengl import glBlendFunc, GL_SRC_ALPHA, GL_ONE, GL_ZERO, GL_SRC_COLOR, GL_ONE_MINUS_SRC_COLOR, GL_ONE_MINUS_SRC_ALPHA, GL_DST_ALPHA, GL_ONE_MINUS_DST_ALPHA, GL_DST_COLOR, GL_ONE_MINUS_DST_COLOR
 from kivy.core.image import Image
 from kivy.logger import Logger
 from xml.dom.minidom import parse as parse_xml
-from .utils import random_variance, random_color_variance
+from .utils import random_variance_array, random_color_variance_array
 from kivy.properties import NumericProperty, BooleanProperty, ListProperty, StringProperty, ObjectProperty
 
 import sys
 import os
 import math
+import array
+import numpy as np
 
 __all__ = ['EMITTER_TYPE_GRAVITY', 'EMITTER_TYPE_RADIAL', 'Particle', 'ParticleSystem']
 
@@ -33,6 +35,41 @@ BLEND_FUNC = {0: GL_ZERO,
 }
 
 
+# per-particle state, stored as one array per field (structure of arrays)
+PARTICLE_FIELDS = ['x', 'y', 'rotation', 'current_time', 'total_time', 'scale',
+                   'start_x', 'start_y', 'velocity_x', 'velocity_y',
+                   'radial_acceleration', 'tangent_acceleration',
+                   'emit_radius', 'emit_radius_delta', 'emit_rotation', 'emit_rotation_delta',
+                   'rotation_delta', 'scale_delta']
+PARTICLE_COLOR_FIELDS = ['color', 'color_delta']
+
+# all particles are drawn as one mesh, each one a quad of 4 vertices (x, y, u, v, r, g, b, a)
+MESH_FORMAT = [(b'vPosition', 2, 'float'), (b'vTexCoords0', 2, 'float'), (b'vColor', 4, 'float')]
+VERTEX_SIZE = 8
+QUAD_INDICES = [0, 1, 2, 2, 3, 0]
+
+# mesh indices are unsigned shorts, so that's as many quads as one mesh can hold
+MAX_MESH_PARTICLES = 65536 // 4
+
+# the same as Kivy's default shader, but with the color per vertex rather than from a Color instruction
+MESH_VERTEX_SHADER = '''$HEADER$
+attribute vec4 vColor;
+
+void main(void) {
+    frag_color = vColor * vec4(1.0, 1.0, 1.0, opacity);
+    tex_coord0 = vTexCoords0;
+    gl_Position = projection_mat * modelview_mat * vec4(vPosition.xy, 0.0, 1.0);
+}
+'''
+
+MESH_FRAGMENT_SHADER = '''$HEADER$
+
+void main(void) {
+    gl_FragColor = frag_color * texture2D(texture0, tex_coord0);
+}
+'''
+
+
 class Particle(object):
     x, y, rotation, current_time = -256, -256, 0, 0
     scale, total_time = 1.0, 0.
@@ -90,12 +127,19 @@ class ParticleSystem(Widget):
     def __init__(self, config, **kwargs):
         super(ParticleSystem, self).__init__(**kwargs)
         self.capacity = 0
-        self.particles = list()
-        self.particles_dict = dict()
+        self.particles = dict((name, np.zeros(0)) for name in PARTICLE_FIELDS)
+        self.particles.update((name, np.zeros((0, 4))) for name in PARTICLE_COLOR_FIELDS)
         self.emission_time = 0.0
         self.frame_time = 0.0
         self.num_particles = 0
 
+        # vertex buffer of the mesh, with a numpy view on it to fill it in place
+        self.vertex_buffer = array.array('f')
+        self.vertices = np.zeros((0, 4, VERTEX_SIZE), dtype=np.float32)
+        self.index_buffer = array.array('H')
+        self.mesh = None
+        self.mesh_num_particles = 0
+
         if config is not None:
             self._parse_config(config)
         self.emission_rate = self.max_num_particles / self.life_span
@@ -108,9 +152,16 @@ class ParticleSystem(Widget):
         with self.canvas.after:
             Callback(self._reset_blend_func)
 
+        self.render_context = RenderContext(use_parent_projection=True, use_parent_modelview=True)
+        self.render_context.shader.vs = MESH_VERTEX_SHADER
+        self.render_context.shader.fs = MESH_FRAGMENT_SHADER
+        with self.render_context:
+            self.mesh = Mesh(fmt=MESH_FORMAT, mode='triangles', texture=self.texture)
+        self.canvas.add(self.render_context)
+
         Clock.schedule_once(self._update, self.update_interval)
 
-    def start(self, duration=sys.maxint):
+    def start(self, duration=sys.maxsize):
         if self.emission_rate != 0:
             self.emission_time = duration
 
@@ -118,8 +169,7 @@ class ParticleSystem(Widget):
         self.emission_time = 0.0
         if clear:
             self.num_particles = 0
-            self.particles_dict = dict()
-            self.canvas.clear()
+            self._render()
 
     def on_max_num_particles(self, instance, value):
         self.max_capacity = value
@@ -130,12 +180,9 @@ class ParticleSystem(Widget):
         self.emission_rate = self.max_num_particles / self.life_span
 
     def on_texture(self, instance, value):
-        for p in self.particles:
-            try:
-                self.particles_dict[p]['rect'].texture = self.texture
-            except KeyError:
-                # if particle isn't initialized yet, you can't change its texture.
-                pass
+        self._set_tex_coords()
+        if self.mesh is not None:
+            self.mesh.texture = self.texture
 
     def on_life_span(self, instance, value):
         self.emission_rate = self.max_num_particles / value
@@ -221,182 +268,213 @@ class ParticleSystem(Widget):
         if not self._is_paused:
             Clock.schedule_once(self._update, self.update_interval)
 
-    def _create_particle(self):
-        return Particle()
+    def get_particle(self, index):
+        """Returns a copy of the state of the particle at index, as a Particle"""
+        particle = Particle()
+        for name in PARTICLE_FIELDS:
+            setattr(particle, name, float(self.particles[name][index]))
+        for name in PARTICLE_COLOR_FIELDS:
+            setattr(particle, name, self.particles[name][index].tolist())
+        return particle
 
-    def _init_particle(self, particle):
-        life_span = random_variance(self.life_span, self.life_span_variance)
-        if life_span <= 0.0:
-            return
+    def _init_particles(self, start, count):
+        # initializes the count particles from index start, all at once
+        p = self.particles
+        new = slice(start, start + count)
 
-        particle.current_time = 0.0
-        particle.total_time = life_span
+        life_span = random_variance_array(self.life_span, self.life_span_variance, count)
 
-        particle.x = random_variance(self.emitter_x, self.emitter_x_variance)
-        particle.y = random_variance(self.emitter_y, self.emitter_y_variance)
-        particle.start_x = self.emitter_x
-        particle.start_y = self.emitter_y
+        # particles without a life span die right away
+        alive = life_span > 0.0
+        life_span = np.where(alive, life_span, 1.0)
 
-        angle = random_variance(self.emit_angle, self.emit_angle_variance)
-        speed = random_variance(self.speed, self.speed_variance)
-        particle.velocity_x = speed * math.cos(angle)
-        particle.velocity_y = speed * math.sin(angle)
+        p['current_time'][new] = 0.0
+        p['total_time'][new] = np.where(alive, life_span, 0.0)
 
-        particle.emit_radius = random_variance(self.max_radius, self.max_radius_variance)
-        particle.emit_radius_delta = (self.max_radius - self.min_radius) / life_span
+        p['x'][new] = random_variance_array(self.emitter_x, self.emitter_x_variance, count)
+        p['y'][new] = random_variance_array(self.emitter_y, self.emitter_y_variance, count)
+        p['start_x'][new] = self.emitter_x
+        p['start_y'][new] = self.emitter_y
 
-        particle.emit_rotation = random_variance(self.emit_angle, self.emit_angle_variance)
-        particle.emit_rotation_delta = random_variance(self.rotate_per_second, self.rotate_per_second_variance)
+        angle = random_variance_array(self.emit_angle, self.emit_angle_variance, count)
+        speed = random_variance_array(self.speed, self.speed_variance, count)
+        p['velocity_x'][new] = speed * np.cos(angle)
+        p['velocity_y'][new] = speed * np.sin(angle)
 
-        particle.radial_acceleration = random_variance(self.radial_acceleration, self.radial_acceleration_variance)
-        particle.tangent_acceleration = random_variance(self.tangential_acceleration, self.tangential_acceleration_variance)
+        p['emit_radius'][new] = random_variance_array(self.max_radius, self.max_radius_variance, count)
+        p['emit_radius_delta'][new] = (self.max_radius - self.min_radius) / life_span
 
-        start_size = random_variance(self.start_size, self.start_size_variance)
-        end_size = random_variance(self.end_size, self.end_size_variance)
+        p['emit_rotation'][new] = random_variance_array(self.emit_angle, self.emit_angle_variance, count)
+        p['emit_rotation_delta'][new] = random_variance_array(self.rotate_per_second, self.rotate_per_second_variance, count)
 
-        start_size = max(0.1, start_size)
-        end_size = max(0.1, end_size)
+        p['radial_acceleration'][new] = random_variance_array(self.radial_acceleration, self.radial_acceleration_variance, count)
+        p['tangent_acceleration'][new] = random_variance_array(self.tangential_acceleration, self.tangential_acceleration_variance, count)
 
-        particle.scale = start_size / self.texture.width
-        particle.scale_delta = ((end_size - start_size) / life_span) / self.texture.width
+        start_size = np.maximum(0.1, random_variance_array(self.start_size, self.start_size_variance, count))
+        end_size = np.maximum(0.1, random_variance_array(self.end_size, self.end_size_variance, count))
+
+        p['scale'][new] = start_size / self.texture.width
+        p['scale_delta'][new] = ((end_size - start_size) / life_span) / self.texture.width
 
         # colors
-        start_color = random_color_variance(self.start_color, self.start_color_variance)
-        end_color = random_color_variance(self.end_color, self.end_color_variance)
+        start_color = random_color_variance_array(self.start_color, self.start_color_variance, count)
+        end_color = random_color_variance_array(self.end_color, self.end_color_variance, count)
 
-        particle.color_delta = [(end_color[i] - start_color[i]) / life_span for i in range(4)]
-        particle.color = start_color
+        p['color_delta'][new] = (end_color - start_color) / life_span[:, np.newaxis]
+        p['color'][new] = start_color
 
         # rotation
-        start_rotation = random_variance(self.start_rotation, self.start_rotation_variance)
-        end_rotation = random_variance(self.end_rotation, self.end_rotation_variance)
-        particle.rotation = start_rotation
-        particle.rotation_delta = (end_rotation - start_rotation) / life_span
+        start_rotation = random_variance_array(self.start_rotation, self.start_rotation_variance, count)
+        end_rotation = random_variance_array(self.end_rotation, self.end_rotation_variance, count)
+        p['rotation'][new] = start_rotation
+        p['rotation_delta'][new] = (end_rotation - start_rotation) / life_span
+
+    def _advance_particles(self, start, count, passed_time):
+        # advances the count particles from index start by passed_time (a number, or an array with one per particle)
+        p = self.particles
+        live = slice(start, start + count)
 
-    def _advance_particle(self, particle, passed_time):
-        passed_time = min(passed_time, particle.total_time - particle.current_time)
-        particle.current_time += passed_time
+        passed_time = np.minimum(passed_time, p['total_time'][live] - p['current_time'][live])
+        p['current_time'][live] += passed_time
 
         if self.emitter_type == EMITTER_TYPE_RADIAL:
-            particle.emit_rotation += particle.emit_rotation_delta * passed_time
-            particle.emit_radius -= particle.emit_radius_delta * passed_time
-            particle.x = self.emitter_x - math.cos(particle.emit_rotation) * particle.emit_radius
-            particle.y = self.emitter_y - math.sin(particle.emit_rotation) * particle.emit_radius
+            p['emit_rotation'][live] += p['emit_rotation_delta'][live] * passed_time
+            p['emit_radius'][live] -= p['emit_radius_delta'][live] * passed_time
+            p['x'][live] = self.emitter_x - np.cos(p['emit_rotation'][live]) * p['emit_radius'][live]
+            p['y'][live] = self.emitter_y - np.sin(p['emit_rotation'][live]) * p['emit_radius'][live]
 
-            if particle.emit_radius < self.min_radius:
-                particle.current_time = particle.total_time
+            ended = p['emit_radius'][live] < self.min_radius
+            p['current_time'][live] = np.where(ended, p['total_time'][live], p['current_time'][live])
 
         else:
-            distance_x = particle.x - particle.start_x
-            distance_y = particle.y - particle.start_y
-            distance_scalar = math.sqrt(distance_x * distance_x + distance_y * distance_y)
-            if distance_scalar < 0.01:
-                distance_scalar = 0.01
+            distance_x = p['x'][live] - p['start_x'][live]
+            distance_y = p['y'][live] - p['start_y'][live]
+            distance_scalar = np.maximum(0.01, np.sqrt(distance_x * distance_x + distance_y * distance_y))
 
             radial_x = distance_x / distance_scalar
             radial_y = distance_y / distance_scalar
-            tangential_x = radial_x
-            tangential_y = radial_y
 
-            radial_x *= particle.radial_acceleration
-            radial_y *= particle.radial_acceleration
+            tangential_x = -radial_y * p['tangent_acceleration'][live]
+            tangential_y = radial_x * p['tangent_acceleration'][live]
 
-            new_y = tangential_x
-            tangential_x = -tangential_y * particle.tangent_acceleration
-            tangential_y = new_y * particle.tangent_acceleration
+            radial_x *= p['radial_acceleration'][live]
+            radial_y *= p['radial_acceleration'][live]
 
-            particle.velocity_x += passed_time * (self.gravity_x + radial_x + tangential_x)
-            particle.velocity_y += passed_time * (self.gravity_y + radial_y + tangential_y)
+            p['velocity_x'][live] += passed_time * (self.gravity_x + radial_x + tangential_x)
+            p['velocity_y'][live] += passed_time * (self.gravity_y + radial_y + tangential_y)
 
-            particle.x += particle.velocity_x * passed_time
-            particle.y += particle.velocity_y * passed_time
+            p['x'][live] += p['velocity_x'][live] * passed_time
+            p['y'][live] += p['velocity_y'][live] * passed_time
 
-        particle.scale += particle.scale_delta * passed_time
-        particle.rotation += particle.rotation_delta * passed_time
+        p['scale'][live] += p['scale_delta'][live] * passed_time
+        p['rotation'][live] += p['rotation_delta'][live] * passed_time
 
-        particle.color = [particle.color[i] + particle.color_delta[i] * passed_time for i in range(4)]
+        p['color'][live] += p['color_delta'][live] * passed_time[:, np.newaxis]
 
-    def _raise_capacity(self, by_amount):
-        old_capacity = self.capacity
-        new_capacity = min(self.max_capacity, self.capacity + by_amount)
+    def _resize(self, capacity):
+        capacity = int(capacity)
+        for name, values in self.particles.items():
+            resized = np.zeros((capacity,) + values.shape[1:])
+            kept = min(capacity, len(values))
+            resized[:kept] = values[:kept]
+            self.particles[name] = resized
+
+        self._resize_mesh(capacity)
+
+    def _resize_mesh(self, capacity):
+        # reallocates the vertex and index buffers for capacity particles
+        capacity = min(capacity, MAX_MESH_PARTICLES)
+        self.vertex_buffer = array.array('f', bytes(capacity * 4 * VERTEX_SIZE * self.vertex_buffer.itemsize))
+        self.vertices = np.frombuffer(self.vertex_buffer, dtype=np.float32).reshape((capacity, 4, VERTEX_SIZE))
+        self._set_tex_coords()
+
+        # the quads never change order, so neither do the indices
+        indices = (np.arange(capacity)[:, np.newaxis] * 4 + QUAD_INDICES).ravel()
+        self.index_buffer = array.array('H', indices.astype(np.uint16).tobytes())
+        self.mesh_num_particles = -1
 
-        for i in range(int(new_capacity - old_capacity)):
-            self.particles.append(self._create_particle())
+    def _set_tex_coords(self):
+        if self.texture is not None:
+            self.vertices[:, :, 2:4] = np.reshape(self.texture.tex_coords, (4, 2))
 
-        self.num_particles = int(new_capacity)
+    def _raise_capacity(self, by_amount):
+        new_capacity = min(self.max_capacity, self.capacity + by_amount)
+        self._resize(new_capacity)
         self.capacity = new_capacity
 
     def _lower_capacity(self, by_amount):
-        old_capacity = self.capacity
         new_capacity = max(0, self.capacity - by_amount)
-
-        for i in range(int(old_capacity - new_capacity)):
-            try:
-                self.canvas.remove(self.particles_dict[self.particles.pop()]['rect'])
-            except:
-                pass
-
-        self.num_particles = int(new_capacity)
+        self._resize(new_capacity)
+        self.num_particles = int(min(self.num_particles, new_capacity))
         self.capacity = new_capacity
 
     def _advance_time(self, passed_time):
-        particle_index = 0
+        p = self.particles
+        num_particles = self.num_particles
+
+        # remove the particles that ended, keeping the live ones at the front
+        alive = p['current_time'][:num_particles] < p['total_time'][:num_particles]
+        if not alive.all():
+            num_alive = int(alive.sum())
+            for name, values in p.items():
+                values[:num_alive] = values[:num_particles][alive]
+            self.num_particles = num_alive
+            if self.num_particles == 0:
+                Logger.debug('Particle: COMPLETE')
 
         # advance existing particles
-        while particle_index < self.num_particles:
-            particle = self.particles[particle_index]
-            if particle.current_time < particle.total_time:
-                self._advance_particle(particle, passed_time)
-                particle_index += 1
-            else:
-                if particle_index != self.num_particles - 1:
-                    next_particle = self.particles[self.num_particles - 1]
-                    self.particles[self.num_particles - 1] = particle
-                    self.particles[particle_index] = next_particle
-                self.num_particles -= 1
-                if self.num_particles == 0:
-                    Logger.debug('Particle: COMPLETE')
+        self._advance_particles(0, self.num_particles, passed_time)
 
         # create and advance new particles
         if self.emission_time > 0:
             time_between_particles = 1.0 / self.emission_rate
             self.frame_time += passed_time
 
-            while self.frame_time > 0:
-                if self.num_particles < self.max_capacity:
-                    if self.num_particles == self.capacity:
-                        self._raise_capacity(self.capacity)
+            if self.frame_time > 0:
+                # one particle every time_between_particles, each advanced by the time left in the frame after it
+                count = int(math.ceil(self.frame_time / time_between_particles))
+                passed_times = self.frame_time - np.arange(count) * time_between_particles
+
+                # particles that don't fit are skipped
+                count = int(min(count, self.max_capacity - self.num_particles))
+                if count > 0:
+                    if self.num_particles + count > self.capacity:
+                        self._raise_capacity(self.num_particles + count - self.capacity)
 
-                    particle = self.particles[self.num_particles]
-                    self.num_particles += 1
-                    self._init_particle(particle)
-                    self._advance_particle(particle, self.frame_time)
+                    self._init_particles(self.num_particles, count)
+                    self._advance_particles(self.num_particles, count, passed_times[:count])
+                    self.num_particles += count
 
-                self.frame_time -= time_between_particles
+                self.frame_time -= len(passed_times) * time_between_particles
 
-            if self.emission_time != sys.maxint:
+            if self.emission_time != sys.maxsize:
                 self.emission_time = max(0.0, self.emission_time - passed_time)
 
     def _render(self):
-        if self.num_particles == 0:
+        if self.mesh is None:
             return
-        for i in range(self.num_particles):
-            particle = self.particles[i]
-            size = (self.texture.size[0] * particle.scale, self.texture.size[1] * particle.scale)
-            if particle not in self.particles_dict:
-                self.particles_dict[particle] = dict()
-                color = particle.color[:]
-                with self.canvas:
-                    self.particles_dict[particle]['color'] = Color(color[0], color[1], color[2], color[3])
-                    PushMatrix()
-                    self.particles_dict[particle]['translate'] = Translate()
-                    self.particles_dict[particle]['rotate'] = Rotate()
-                    self.particles_dict[particle]['rotate'].set(particle.rotation, 0, 0, 1)
-                    self.particles_dict[particle]['rect'] = Quad(texture=self.texture, points=(-size[0] * 0.5, -size[1] * 0.5, size[0] * 0.5, -size[1] * 0.5, size[0] * 0.5,  size[1] * 0.5, -size[0] * 0.5,  size[1] * 0.5))
-                    self.particles_dict[particle]['translate'].xy = (particle.x, particle.y)
-                    PopMatrix()
-            else:
-                self.particles_dict[particle]['rotate'].angle = particle.rotation
-                self.particles_dict[particle]['translate'].xy = (particle.x, particle.y)
-                self.particles_dict[particle]['color'].rgba = particle.color
-                self.particles_dict[particle]['rect'].points = (-size[0] * 0.5, -size[1] * 0.5, size[0] * 0.5, -size[1] * 0.5, size[0] * 0.5,  size[1] * 0.5, -size[0] * 0.5,  size[1] * 0.5)
+
+        num_particles = min(self.num_particles, len(self.vertices))
+        if num_particles > 0:
+            p = self.particles
+            half_widths = self.texture.size[0] * p['scale'][:num_particles] * 0.5
+            half_heights = self.texture.size[1] * p['scale'][:num_particles] * 0.5
+
+            # rotation is applied in degrees, as the Rotate instruction it replaces did
+            rotations = np.radians(p['rotation'][:num_particles])
+            cos, sin = np.cos(rotations), np.sin(rotations)
+
+            # corners (-w, -h), (w, -h), (w, h), (-w, h) of each quad, rotated and moved to the particle
+            corners_x = half_widths[:, np.newaxis] * [-1, 1, 1, -1]
+            corners_y = half_heights[:, np.newaxis] * [-1, -1, 1, 1]
+            vertices = self.vertices[:num_particles]
+            vertices[:, :, 0] = p['x'][:num_particles, np.newaxis] + corners_x * cos[:, np.newaxis] - corners_y * sin[:, np.newaxis]
+            vertices[:, :, 1] = p['y'][:num_particles, np.newaxis] + corners_x * sin[:, np.newaxis] + corners_y * cos[:, np.newaxis]
+            vertices[:, :, 4:8] = p['color'][:num_particles, np.newaxis, :]
+
+        # only draw the quads that have a particle in them
+        if num_particles != self.mesh_num_particles:
+            self.mesh.indices = self.index_buffer[:num_particles * len(QUAD_INDICES)]
+            self.mesh_num_particles = num_particles
+
+        self.mesh.vertices = self.vertex_buffer
@@ -1,8 +1,9 @@
 # -*- coding: utf-8 -*-
 
 import random
+import numpy as np
 
-__all__ = ['random_variance', 'random_color_variance']
+__all__ = ['random_variance', 'random_color_variance', 'random_variance_array', 'random_color_variance_array']
 
 
 def random_variance(base, variance):
@@ -11,3 +12,13 @@ def random_variance(base, variance):
 
 def random_color_variance(base, variance):
     return [min(max(0.0, (random_variance(base[i], variance[i]))), 1.0) for i in range(4)]
+
+
+def random_variance_array(base, variance, count):
+    return base + variance * (np.random.random(count) * 2.0 - 1.0)
+
+
+def random_color_variance_array(base, variance, count):
+    base = np.asarray(base, dtype=float)
+    variance = np.asarray(variance, dtype=float)
+    return np.clip(base + variance * (np.random.random((count, 4)) * 2.0 - 1.0), 0.0, 1.0)
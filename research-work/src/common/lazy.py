@@ -0,0 +1,42 @@
+#####################################################################
+#
+# lazy.py
+#
+# Released under the MIT License (http://opensource.org/licenses/MIT)
+#
+#####################################################################
+
+import sys
+import importlib.util
+
+
+# Stands in for a module that isn't installed, so that importing a module that
+# only needs it for some of its functionality still works. Using it raises the
+# ImportError.
+class MissingModule(object):
+    def __init__(self, name):
+        super(MissingModule, self).__init__()
+        self.__name = name
+
+    def __getattr__(self, attr):
+        raise ImportError("No module named '%s'" % self.__name)
+
+
+# returns the (top-level) module called name, which is only actually loaded the
+# first time one of its attributes is used. Use it in place of "import name" for
+# heavy modules that are only needed by some of the code:
+#   pyaudio = lazy_import('pyaudio')
+def lazy_import(name):
+    if name in sys.modules:
+        return sys.modules[name]
+
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        return MissingModule(name)
+
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
@@ -8,7 +8,6 @@
 #
 #####################################################################
 
-from kivy.core.window import Window
 import numpy as np
 from collections import namedtuple
 
@@ -34,6 +33,7 @@ class Modifier(object):
 
     def on_key_down(self, key) :
         if key in list(self.mods.keys()):
+            from kivy.core.window import Window
             self.cur_key = key
             self.pos = Window.mouse_pos[1]
 
@@ -44,6 +44,7 @@ class Modifier(object):
 
     def on_update(self):
         if self.cur_key:
+            from kivy.core.window import Window
             p = Window.mouse_pos[1]
             delta = p - self.pos
             if delta > 10:
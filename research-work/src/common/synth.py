@@ -8,23 +8,107 @@
 #
 #####################################################################
 
+import os
+import time
+import threading
+from collections import OrderedDict
 import numpy as np
 from . import fluidsynth
 from .audio import Audio
 
+# a channel that is never played on, used to warm up presets
+PRELOAD_CHANNEL = 255
+
+# peak memory of the process in KB, if the platform can tell
+def _get_peak_memory():
+    try:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    except (ImportError, AttributeError):
+        return None
+
+# Per-synth soundfont bookkeeping: the soundfonts loaded into the synth (so
+# that a file is only loaded into it once), how long each took to load and how
+# much memory it took, and the presets warmed up so far
+class SoundFontStats(object):
+    def __init__(self, synth):
+        super(SoundFontStats, self).__init__()
+        self.synth = synth
+        # file path -> soundfont id
+        self.sfids = {}
+        # file path -> (load time in seconds, memory in KB or None)
+        self.load_stats = {}
+        # (soundfont id, bank, preset) already warmed up, and how long that took
+        self.preloaded = set()
+        self.preload_time = 0
+
+    # returns the soundfont id of the file, loading it into the synth the first time
+    def load(self, filepath):
+        path = os.path.abspath(filepath)
+
+        if path not in self.sfids:
+            memory_before = _get_peak_memory()
+            start = time.time()
+
+            sfid = self.synth.sfload(filepath)
+            if sfid == -1:
+                raise Exception('Error in fluidsynth.sfload(): cannot open ' + filepath)
+
+            load_time = time.time() - start
+            memory_after = _get_peak_memory()
+            memory = memory_after - memory_before if memory_before is not None else None
+
+            self.sfids[path] = sfid
+            self.load_stats[path] = (load_time, memory)
+
+        return self.sfids[path]
+
+    # plays each preset once, silently, so that the first real note on it doesn't glitch
+    def preload_presets(self, sfid, presets, bank = 0):
+        start = time.time()
+        count = 0
+
+        for preset in presets:
+            key = (sfid, bank, preset)
+            if key in self.preloaded:
+                continue
+
+            self.synth.program_select(PRELOAD_CHANNEL, sfid, bank, preset)
+            self.synth.noteon(PRELOAD_CHANNEL, 60, 1)
+            self.synth.noteoff(PRELOAD_CHANNEL, 60)
+            self.synth.get_samples(64)
+
+            self.preloaded.add(key)
+            count += 1
+
+        self.preload_time += time.time() - start
+        return count
+
+    def now_str(self):
+        txt = 'soundfonts:'
+        for path, (load_time, memory) in self.load_stats.items():
+            txt += ' %s %.2fs' % (os.path.basename(path), load_time)
+            if memory is not None:
+                txt += ' (+%dKB)' % memory
+        txt += ' preloaded:%d (%.2fs)' % (len(self.preloaded), self.preload_time)
+        return txt
+
 # create another kind of generator that generates audio based on the fluid
 # synth synthesizer
 class Synth(fluidsynth.Synth, object):
     def __init__(self, filepath, gain = 0.8):
         super(Synth, self).__init__(gain, samplerate=Audio.sample_rate)
-        self.sfid = self.sfload(filepath)
-        if self.sfid == -1:
-            raise Exception('Error in fluidsynth.sfload(): cannot open ' + filepath)
+        self.soundfonts = SoundFontStats(self)
+        self.sfid = self.soundfonts.load(filepath)
         self.program(0, 0, 0)
 
     def program(self, chan, bank, preset):
         self.program_select(chan, self.sfid, bank, preset)
 
+    # warm up presets (of bank) ahead of time, so that switching to them later doesn't glitch
+    def preload(self, presets, bank = 0):
+        return self.soundfonts.preload_presets(self.sfid, presets, bank)
+
     def generate(self, num_frames, num_channels):
         assert(num_channels == 2)
         # get_samples() returns interleaved stereo, so all we have to do is scale
@@ -32,3 +116,151 @@ class Synth(fluidsynth.Synth, object):
         samples = self.get_samples(num_frames).astype(np.float32)
         samples *= (1.0/32768.0)
         return (samples, True)
+
+    def now_str(self):
+        return self.soundfonts.now_str()
+
+
+# Sits in front of a Synth and keeps track of the voices (notes) sounding on each
+# channel. Note-ons to muted channels are dropped, and when the number of voices
+# reaches max_voices, the lowest priority, oldest voice is stolen to make room
+# (or, if every voice outranks the new note, the new note is dropped).
+class VoiceManager(object):
+    def __init__(self, synth, max_voices = 64):
+        super(VoiceManager, self).__init__()
+        self.synth = synth
+        self.max_voices = max_voices
+
+        # (chan, key) -> velocity, oldest first
+        self.voices = OrderedDict()
+        self.channel_voices = {}
+
+        self.muted = set()
+        self.priorities = {}
+
+        # notes and control changes come from the audio and worker threads
+        self.lock = threading.Lock()
+
+        # metrics
+        self.peak_voices = 0
+        self.stolen = 0
+        # note-ons dropped because their channel was muted / because no voice could be freed for them
+        self.muted_notes = 0
+        self.suppressed = 0
+
+    # higher priority channels keep their voices over lower priority ones (default 0)
+    def set_priority(self, chan, priority):
+        self.priorities[chan] = priority
+
+    # drops note-ons to the channel, and releases what's sounding on it
+    def mute(self, chan):
+        with self.lock:
+            self.muted.add(chan)
+            for key in list(self.channel_voices.get(chan, ())):
+                self._release(chan, key)
+
+    # lets notes through to the channel again. If sync_from is given, the channel
+    # also starts sounding the notes that channel is holding (to mirror it right away)
+    def unmute(self, chan, sync_from = None):
+        with self.lock:
+            self.muted.discard(chan)
+            if sync_from is not None:
+                for key, vel in list(self.channel_voices.get(sync_from, {}).items()):
+                    self._noteon(chan, key, vel)
+
+    def is_muted(self, chan):
+        return chan in self.muted
+
+    def noteon(self, chan, key, vel):
+        with self.lock:
+            return self._noteon(chan, key, vel)
+
+    def noteoff(self, chan, key):
+        with self.lock:
+            self._noteoff(chan, key)
+
+    # same as Synth.apply_events, with note events going through the voice manager
+    def apply_events(self, events):
+        with self.lock:
+            for event_type, chan, key, value in fluidsynth.valid_events(events):
+                if event_type == fluidsynth.EVENT_NOTEON:
+                    self._noteon(chan, key, value)
+                elif event_type == fluidsynth.EVENT_NOTEOFF:
+                    self._noteoff(chan, key)
+                elif event_type == fluidsynth.EVENT_CC:
+                    self.synth.cc(chan, key, value)
+                elif event_type == fluidsynth.EVENT_PROGRAM_CHANGE:
+                    self.synth.program_change(chan, key)
+
+    # the events of the batch that aren't note-ons to muted channels
+    def filter_muted(self, events):
+        events = np.asarray(events, dtype=fluidsynth.event_dtype())
+        with self.lock:
+            muted = np.isin(events['chan'], list(self.muted)) & (events['type'] == fluidsynth.EVENT_NOTEON)
+            self.muted_notes += int(muted.sum())
+        return events[~muted]
+
+    def get_num_voices(self, chan = None):
+        if chan is None:
+            return len(self.voices)
+        return len(self.channel_voices.get(chan, ()))
+
+    def get_metrics(self):
+        with self.lock:
+            return {'voices': len(self.voices),
+                    'channels': {chan: len(keys) for chan, keys in self.channel_voices.items() if keys},
+                    'peak': self.peak_voices,
+                    'stolen': self.stolen,
+                    'muted': self.muted_notes,
+                    'suppressed': self.suppressed}
+
+    def now_str(self):
+        txt = "voices:%d/%d (peak:%d stolen:%d muted:%d suppressed:%d)" % \
+            (len(self.voices), self.max_voices, self.peak_voices, self.stolen, self.muted_notes, self.suppressed)
+        return txt
+
+    def _noteon(self, chan, key, vel):
+        if chan in self.muted:
+            self.muted_notes += 1
+            return False
+
+        # a retriggered note replaces its old voice
+        if (chan, key) in self.voices:
+            self._release(chan, key)
+
+        if len(self.voices) >= self.max_voices and not self._steal(self.priorities.get(chan, 0)):
+            self.suppressed += 1
+            return False
+
+        self.synth.noteon(chan, key, vel)
+        self.voices[(chan, key)] = vel
+        self.channel_voices.setdefault(chan, OrderedDict())[key] = vel
+        self.peak_voices = max(self.peak_voices, len(self.voices))
+        return True
+
+    def _noteoff(self, chan, key):
+        # notes that were dropped or stolen are already off
+        if (chan, key) in self.voices:
+            self._release(chan, key)
+
+    def _release(self, chan, key):
+        self.synth.noteoff(chan, key)
+        del self.voices[(chan, key)]
+        del self.channel_voices[chan][key]
+
+    # frees the oldest of the lowest priority voices, if it doesn't outrank priority
+    def _steal(self, priority):
+        victim = None
+        victim_priority = None
+        for chan, key in self.voices:
+            chan_priority = self.priorities.get(chan, 0)
+            if victim is None or chan_priority < victim_priority:
+                victim = (chan, key)
+                victim_priority = chan_priority
+
+        if victim is None or victim_priority > priority:
+            return False
+
+        self._release(*victim)
+        self.stolen += 1
+        return True
@@ -0,0 +1,78 @@
+import threading
+
+
+class CoalescingDispatcher:
+
+    """
+    Runs jobs on an executor, keeping at most one job running and one waiting for each key.
+    Submitting a job for a key that already has one waiting replaces it (latest value wins),
+    so bursts of updates don't pile up stale work on the executor.
+    """
+
+    def __init__(self, executor):
+        self.executor = executor
+        self.lock = threading.Lock()
+
+        # key -> (func, args) of the job waiting for the running one to finish
+        self.pending = {}
+        # key -> future of the job running for that key
+        self.running = {}
+
+        # stats
+        self.submitted = 0
+        self.dropped = 0
+        self.completed = 0
+
+    def submit(self, key, func, *args):
+        """
+        Runs func(*args) as the job for key, as soon as the job already running for key (if any) is done.
+        """
+        with self.lock:
+            self.submitted += 1
+
+            if key in self.pending:
+                # superseded before it ever started
+                self.dropped += 1
+
+            self.pending[key] = (func, args)
+
+            if key not in self.running:
+                self._start(key)
+
+    def _start(self, key):
+        func, args = self.pending.pop(key)
+        self.running[key] = self.executor.submit(self._run, key, func, args)
+
+    def _run(self, key, func, args):
+        try:
+            func(*args)
+        except Exception as e:
+            print("job " + str(key) + " failed:", e)
+        finally:
+            with self.lock:
+                self.completed += 1
+                del self.running[key]
+
+                # the latest job submitted while this one ran
+                if key in self.pending:
+                    self._start(key)
+
+    def get_queue_depth(self):
+        """
+        Returns the number of jobs running or waiting to run.
+        """
+        with self.lock:
+            return len(self.pending) + len(self.running)
+
+    def get_stats(self):
+        with self.lock:
+            return {'submitted': self.submitted,
+                    'dropped': self.dropped,
+                    'completed': self.completed,
+                    'pending': len(self.pending),
+                    'running': len(self.running)}
+
+    def now_str(self):
+        stats = self.get_stats()
+        return "jobs: %d queued, %d dropped, %d done" % \
+            (stats['pending'] + stats['running'], stats['dropped'], stats['completed'])
@@ -0,0 +1,33 @@
+import sys
+import subprocess
+
+# python import-benchmark.py [module ...]: time a cold import of each module (in a fresh interpreter),
+# and list the heavy dependencies it loaded along the way
+
+# what the headless tools (analysis, offline rendering) import
+MODULES = ['analyzer', 'transformer', 'modulation', 'looper', 'av_grid', 'av_input',
+           'common.core', 'common.audio', 'common.clock', 'common.synth', 'common.modifier']
+
+HEAVY_MODULES = ['kivy', 'pyaudio', 'music21', 'sklearn', 'pygame']
+
+# modules loaded lazily are in sys.modules from the start, so only count them once they're really loaded
+CHILD_SCRIPT = '''
+import sys, time, importlib.util
+start = time.time()
+try:
+    import %s
+    error = ''
+except Exception as e:
+    error = '%%s: %%s' %% (type(e).__name__, e)
+elapsed = time.time() - start
+loaded = [m for m in %r if m in sys.modules and not isinstance(sys.modules[m], importlib.util._LazyModule)]
+print('%%.3f|%%s|%%s' %% (elapsed, ','.join(loaded), error))
+'''
+
+modules = sys.argv[1:] or MODULES
+
+print('%-18s %8s  %s' % ('module', 'seconds', 'heavy modules loaded'))
+for module in modules:
+    output = subprocess.check_output([sys.executable, '-c', CHILD_SCRIPT % (module, HEAVY_MODULES)])
+    elapsed, loaded, error = output.decode('utf-8').strip().split('\n')[-1].split('|', 2)
+    print('%-18s %8s  %s' % (module, elapsed, loaded or '-') + ('  (' + error + ')' if error else ''))
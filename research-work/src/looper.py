@@ -1,40 +1,78 @@
-import pygame, sys
-import music21 as m21
-import pygame.locals
-from io import BytesIO
-import shutil
 from cachetools import TTLCache
-import time
+import threading
+import traceback
 import analyzer
 import transformer
 import copy
 import modulation
-# import concurrent.futures as fut
+import concurrent.futures as fut
+from common.lazy import lazy_import
 
-converter = m21.converter
+m21 = lazy_import('music21')
 
-# entire stream.Score of the song
-song = converter.parse('../scores/bare-necessities.xml')
+class LockedCache:
+    """
+    Wraps a cachetools cache (which isn't thread-safe) so that it can be shared by the threads
+    that prefetch, transform and warm measures.
+    """
+    def __init__(self, cache):
+        self.cache = cache
+        self.lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self.lock:
+            return self.cache.get(key, default)
+
+    def __getitem__(self, key):
+        with self.lock:
+            return self.cache[key]
+
+    def __setitem__(self, key, value):
+        with self.lock:
+            self.cache[key] = value
+
+    def __contains__(self, key):
+        with self.lock:
+            return key in self.cache
+
+    def __len__(self):
+        with self.lock:
+            return len(self.cache)
 
 #TODO: When loading in the song, get all of the information from the stream and load them in.
 class SongLooper:
-    def __init__(self, song_file, tempo):
+    def __init__(self, song_file, tempo, lazy=False, lookahead=2):
         super(SongLooper, self).__init__()
 
         self.song_file = song_file
 
+        # in lazy mode, measures are only transformed when they're about to be played
+        self.lazy = lazy
+        self.lookahead = lookahead
+
         self.tempo = m21.tempo.MetronomeMark(number = tempo)
-        self.original_parts, self.song = analyzer.analyze(song_file)
+
+        # identical measures across all parts share a single copy, and are only transformed once
+        self.measure_interner = analyzer.MeasureInterner()
+        self.original_parts, self.song = analyzer.analyze(song_file, self.measure_interner)
         self.time_signature = self.original_parts[0][0][0].timeSignature
 
-        # get the key of the song
-        self.initial_key = str(self.song.analyze("key")).lower()
+        # the key of the song as a whole (the measures were already analyzed in their local keys,
+        # which can be the relative major/minor of it, and shouldn't decide the key transforms start from)
+        self.initial_key = str(analyzer.get_global_key(self.song)).lower()
 
         self.length = len(self.original_parts[0])
 
-        self.parts = copy.deepcopy(self.original_parts)
+        # lazy mode never transforms whole parts, so it has no use for a copy of them
+        if self.lazy:
+            self.parts = self.original_parts
+        else:
+            self.parts = copy.deepcopy(self.original_parts)
+
+        self.transformation_cache = LockedCache(TTLCache(maxsize=50, ttl=600))
 
-        self.transformation_cache = transformation_cache = TTLCache(maxsize=50, ttl=600)
+        # transformed measures, keyed by transformation and measure content
+        self.measure_cache = LockedCache(TTLCache(maxsize=5000, ttl=600))
 
         # Keep track of the current measure of music, and index, for all the parts
         self.current_measure_in_parts = [part[0] for part in self.parts]
@@ -55,28 +93,41 @@ class SongLooper:
 
         self.target_rhythm = None
 
+        # fully built modulation measures by (start key, end key, rhythm, beats per measure), warmed in
+        # the background for the keys neighboring the current key
+        self.modulation_block_cache = {}
+        self.warm_executor = fut.ThreadPoolExecutor(max_workers=1)
+        self.warm_future = None
+
+        # lazily transformed measures of each part (measure index -> measure). A newer transform
+        # request bumps the generation, so that measures computed for an older request are discarded.
+        self.lazy_measures = [{} for i in range(len(self.parts))]
+        self.transform_generation = 0
+
         # temporary
 
     def initialize(self):
-        # cache the measures of each individual part
-        for i in range(len(self.original_parts)):
-            cache_key = self.get_cache_key(i, self.current_key, self.current_rhythms[i])
-            self.transformation_cache[cache_key] = copy.deepcopy(self.original_parts[i])
+        # cache the measures of each individual part (lazy mode transforms measures one by one instead)
+        if not self.lazy:
+            for i in range(len(self.original_parts)):
+                cache_key = self.get_cache_key(i, self.current_key, self.current_rhythms[i])
+                self.transformation_cache[cache_key] = copy.deepcopy(self.original_parts[i])
 
         self.reset()
+        self.warm_modulation_blocks()
 
     def set_tempo(self, tempo):
         self.tempo = m21.tempo.MetronomeMark(number = tempo)
 
     def reset(self):
-        self.current_measure_in_parts = [part[0] for part in self.parts]
         self.measure_index = 0
+        self.current_measure_in_parts = self._get_measures_in_parts(self.measure_index)
 
     def step(self, beat):
         if not self.modulating:
             print("not modulating at all")
             self.measure_index = (self.measure_index + 1) % self.length
-            self.current_measure_in_parts = [part[self.measure_index] for part in self.parts]
+            self.current_measure_in_parts = self._get_measures_in_parts(self.measure_index)
 
         else:
             if self.modulation_progression:
@@ -90,20 +141,107 @@ class SongLooper:
 
         self.last_measure_beat = beat
 
+    def prefetch(self):
+        """
+        Transforms the next few measures of every part ahead of time (lazy mode only).
+        Meant to be run off of the audio/UI thread right after a step.
+        """
+        if not self.lazy:
+            return
+
+        for offset in range(1, self.lookahead + 1):
+            index = (self.measure_index + offset) % self.length
+            for i in range(len(self.parts)):
+                self.get_transformed_measure(i, index)
+
+    def get_transformed_measure(self, part_index, measure_index):
+        """
+        Returns the measure of the part under the current key and rhythm, transforming and
+        memoizing it if it hasn't been computed yet.
+        """
+        generation = self.transform_generation
+        measures = self.lazy_measures[part_index]
+
+        measure = measures.get(measure_index)
+        if measure is None:
+            measure = self._transform_measure(part_index, measure_index)
+
+            # only keep it if no newer transform request came in while computing it
+            if generation == self.transform_generation:
+                measures[measure_index] = measure
+
+        return measure
+
+    def _transform_measure(self, part_index, measure_index):
+        key = self.current_key
+        rhythm = self.current_rhythms[part_index]
+
+        measures = [self.original_parts[part_index][measure_index]]
+        k = key.split(" ")
+
+        if rhythm != 'ORIGINAL' and key != self.initial_key:
+            measures = self._transform_key_and_rhythm(measures, k[0], k[1], rhythm)
+        elif rhythm != 'ORIGINAL':
+            measures = transformer.fill_ostinato(measures, rhythm, self.measure_cache)
+        elif key != self.initial_key:
+            measures = self._transform_key(measures, k[0], k[1])
+
+        return measures[0]
+
+    def _get_measures_in_parts(self, measure_index):
+        if self.lazy:
+            return [self.get_transformed_measure(i, measure_index) for i in range(len(self.parts))]
+        else:
+            return [part[measure_index] for part in self.parts]
+
+    def _transform_lazily(self, part_indexes, key, rhythm):
+        # record the new targets, and throw away everything computed for the old ones
+        if key is not None:
+            self.current_key = key
+
+        for i in part_indexes:
+            if rhythm is not None:
+                self.current_rhythms[i] = copy.deepcopy(rhythm)
+
+        self.transform_generation += 1
+        for i in range(len(self.parts)):
+            if key is not None or i in part_indexes:
+                self.lazy_measures[i] = {}
+
+        # wait for the full modulation to complete:
+        while not self.modulation_complete:
+            pass
+
+        if self.modulating:
+            self.reset()
+
+        self.modulating = False
+
+        self.current_measure_in_parts = self._get_measures_in_parts(self.measure_index)
+
+        if key is not None:
+            self.warm_modulation_blocks()
+
     def _transform_key(self, measures, tonic, mode):
         functioning_key = m21.key.Key(tonic, mode)
 
         # call the transpose_to_new_key function on the analayzed measures
-        transposed_measures = transformer.transpose_to_new_key(measures, functioning_key)
+        transposed_measures = transformer.transpose_to_new_key(measures, functioning_key, self.measure_cache)
 
         return transposed_measures
 
+    def _transform_key_and_rhythm(self, measures, tonic, mode, rhythm):
+        functioning_key = m21.key.Key(tonic, mode)
+
+        # same result as _transform_rhythm followed by _transform_key, without the intermediate copies
+        return transformer.fill_ostinato_in_key(measures, rhythm, functioning_key, self.measure_cache)
+
     def _transform_rhythm(self, measures, rhythm):
 
         rhythm_id = self.rhythm_to_string(rhythm)
 
         # call the fill_ostinato function on the measures
-        ostinated_measures = transformer.fill_ostinato(measures, rhythm)
+        ostinated_measures = transformer.fill_ostinato(measures, rhythm, self.measure_cache)
 
         # place in cache
         self.transformation_cache[rhythm_id] = ostinated_measures
@@ -130,10 +268,12 @@ class SongLooper:
             if not self.modulating:
                 self.set_modulation_progression((k[0], k[1]), (nk[0], nk[1]), rhythm)
 
-                # indicating that we're modulating and that it is not yet complete
-                self.modulating = True
-                self.modulation_complete = False
-                self.modulation_progression_index = 0
+                # indicating that we're modulating and that it is not yet complete (unless there's nothing
+                # to modulate through, e.g. between two spellings of the same key)
+                if self.modulation_progression:
+                    self.modulating = True
+                    self.modulation_complete = False
+                    self.modulation_progression_index = 0
 
             else:
                 self.modulation_complete = True
@@ -147,6 +287,11 @@ class SongLooper:
         if part_indexes is None:
             part_indexes = [i for i in range(len(self.parts))]
 
+        # only the upcoming measures get transformed, as they're needed
+        if self.lazy:
+            self._transform_lazily(part_indexes, key, rhythm)
+            return
+
         ## ITERATION STEP ##
         return_parts = []
         for i in range(len(self.parts)):
@@ -170,18 +315,13 @@ class SongLooper:
 
                 # if not, generate the transformation
                 if return_measures == None:
-                    if rhythm_change and key_change:
-                        rhythm_id = self.rhythm_to_string(rhythm)
-                        base_rhythm_measures = self.transformation_cache.get(self.get_cache_key(i, self.initial_key, rhythm_id))
+                    k = key.split(" ")
+                    tonic = k[0]
+                    mode = k[1]
 
-                        if base_rhythm_measures == None:
-                            base_rhythm_measures = self._transform_rhythm(self.original_parts[i], rhythm)
-
-                        k = key.split(" ")
-                        tonic = k[0]
-                        mode = k[1]
-
-                        return_measures = self._transform_key(base_rhythm_measures, tonic, mode)
+                    if rhythm_change and key_change:
+                        # ostinato and transposition in a single pass over the original measures
+                        return_measures = self._transform_key_and_rhythm(self.original_parts[i], tonic, mode, rhythm)
 
                         #set current key and current rhythm for this part
                         self.current_key = key # TODO: Currently setting key multiple times
@@ -210,7 +350,11 @@ class SongLooper:
         self.modulating = False
 
         #get current measure
-        self.current_measure_in_parts = [part[self.measure_index] for part in self.parts]
+        self.current_measure_in_parts = self._get_measures_in_parts(self.measure_index)
+
+        if key_change:
+            self.current_key = key
+            self.warm_modulation_blocks()
 
         # TODO: Decide if we want to reset to the beginning of the song after each key change
         # self.reset()
@@ -219,6 +363,13 @@ class SongLooper:
         return self.current_measure_in_parts
 
     def get_all_parts(self):
+        """
+        Returns every measure of every part under the current key and rhythms. In lazy mode, this forces
+        the transform of all of the measures that haven't been built yet (only the upcoming ones usually are),
+        so it's for tools that need the whole song, not for playback.
+        """
+        if self.lazy:
+            return [[self.get_transformed_measure(i, m) for m in range(self.length)] for i in range(len(self.parts))]
         return self.parts
 
     def get_measure_index(self):
@@ -227,6 +378,9 @@ class SongLooper:
     def get_last_measure_beat(self):
         return self.last_measure_beat
 
+    def get_dedup_stats(self):
+        return self.measure_interner.get_stats()
+
     def rhythm_to_string(self, rhythm):
         return "".join([str(beat) for beat in rhythm])
 
@@ -234,9 +388,70 @@ class SongLooper:
         return "part " + str(part) + ": " + key + " " + self.rhythm_to_string(rhythm)
 
     def set_modulation_progression(self, start_key, end_key, rhythm=None):
+        self.modulation_progression = self.get_modulation_block(start_key, end_key, rhythm)
+        self.modulation_progression_index = 0
+
+    def get_modulation_block(self, start_key, end_key, rhythm=None):
+        """
+        Returns the measures that modulate from start_key to end_key ((tonic, mode) tuples) in the rhythm,
+        building and caching them if they haven't been built yet.
+        """
+        block_key = self.get_modulation_block_key(start_key, end_key, rhythm)
+
+        block = self.modulation_block_cache.get(block_key)
+        if block is None:
+            block = self._build_modulation_block(start_key, end_key, rhythm)
+            self.modulation_block_cache[block_key] = block
+
+        return block
+
+    def get_modulation_block_key(self, start_key, end_key, rhythm=None):
+        # enharmonic keys (e.g. a# and b- major) share the same block
+        start_key = self.key_modulator.get_key_id(start_key[0], start_key[1])
+        end_key = self.key_modulator.get_key_id(end_key[0], end_key[1])
+        rhythm_id = self.rhythm_to_string(rhythm) if rhythm else None
+
+        return (start_key, end_key, rhythm_id, self.time_signature.numerator)
+
+    def _build_modulation_block(self, start_key, end_key, rhythm=None):
+        # no modulation block (an empty one) when the keys are the same, or there's no path between them
         progression = self.key_modulator.find_chord_path(start_key, end_key)
+        if not progression:
+            return []
+
         progression_measures = self.key_modulator.get_modulation_measures(self.time_signature.numerator, progression)
-        self.modulation_progression = progression_measures[-2:]
-        self.modulation_progression_index = 0
+
         if rhythm:
-            self.modulation_progression = transformer.fill_ostinato(progression_measures, rhythm)
+            return transformer.fill_ostinato(progression_measures, rhythm, self.measure_cache)
+        else:
+            return progression_measures[-2:]
+
+    def warm_modulation_blocks(self):
+        """
+        In the background, builds the modulation blocks from the current key to each of its neighboring keys,
+        (in the original rhythm, and in the current rhythm) so that a key change can start on the very next measure.
+        """
+        # anything still queued for the previous key is no longer useful
+        if self.warm_future is not None:
+            self.warm_future.cancel()
+
+        start_key = tuple(self.current_key.split(' '))
+        rhythms = [None]
+        if self.current_rhythms[0] != 'ORIGINAL':
+            rhythms.append(self.current_rhythms[0])
+
+        self.warm_future = self.warm_executor.submit(self._warm_modulation_blocks, start_key, rhythms)
+
+    def _warm_modulation_blocks(self, start_key, rhythms):
+        for end_key in self.key_modulator.get_neighboring_keys(start_key):
+            for rhythm in rhythms:
+                # stop if the key changed in the meantime
+                if tuple(self.current_key.split(' ')) != start_key:
+                    return
+
+                # warming is only a head start (the block is built again when it's needed), so a
+                # failure shouldn't stop the other keys from warming, but it shouldn't go unnoticed either
+                try:
+                    self.get_modulation_block(start_key, end_key, rhythm)
+                except Exception:
+                    traceback.print_exc()
@@ -1,23 +1,56 @@
-import music21 as m21
-from collections import defaultdict
+import numpy as np
+from collections import defaultdict, namedtuple
+import heapq
 import random
+import json
 import analyzer
+from common.lazy import lazy_import
+
+m21 = lazy_import('music21')
 
 PITCHES = ['A-', 'A', 'A#', 'B-', 'B', 'C', 'C#', 'D-', 'D', 'D#', 'E-', 'E', 'F', 'F#', 'G-', 'G', 'G#']
 WHOLE_NOTE_DURATION = 4.0
 QUARTER_NOTE_DURATION = 1.0
 BEGINNING_OF_MEASURE = 1.0
 
+# all-pairs cheapest modulation paths (for the default cost profile), persisted between runs
+MODULATION_TABLE_PATH = './synth_data/modulation_paths.json'
+
+# cost of a modulation path: every key change costs modulation_cost, plus the voice-leading distance
+# (in semitones) between consecutive chords of the progression, scaled by voice_leading_weight
+CostProfile = namedtuple('CostProfile', ['modulation_cost', 'voice_leading_weight'])
+DEFAULT_COST_PROFILE = CostProfile(modulation_cost=6.0, voice_leading_weight=1.0)
+
+def voice_leading_distances(chords, other_chords):
+    """
+    Voice-leading distance between pairs of chords given as pitch class arrays (broadcast along the first axis):
+    the number of semitones each voice of one chord is from the closest voice of the other chord,
+    summed over both chords.
+    """
+    differences = np.abs(chords[:, :, np.newaxis] - other_chords[:, np.newaxis, :]) % 12
+    differences = np.minimum(differences, 12 - differences)
+
+    return differences.min(axis=2).sum(axis=1) + differences.min(axis=1).sum(axis=1)
+
 class KeyNode:
-    def __init__(self, tonic, mode):
-        self.tonic = tonic.lower()
+    """
+    A key of the modulation graph. Keys are identified by the pitch class of their tonic and their mode,
+    so enharmonic spellings (e.g. a# and b- major) are the same node; tonic is only the spelling
+    used to present the key.
+    """
+    def __init__(self, pitch_class, mode, tonic):
+        self.pitch_class = pitch_class
         self.mode = mode.lower()
-        self.edges = {} # commond chord edges
+        self.tonic = tonic.lower()
+        self.edges = {} # commond chord edges, spelled in this key
 
-    def insert_edge(self, other_node, chords):
+    def get_id(self):
+        return (self.pitch_class, self.mode)
+
+    def insert_edge(self, other_node, chords, other_chords):
         if chords:
             self.edges[other_node] = chords
-            other_node.edges[self] = chords
+            other_node.edges[self] = other_chords
 
     def get_adjacent_vertices(self):
         return self.edges.keys()
@@ -26,13 +59,13 @@ class KeyNode:
         return (other in self.get_adjacent_vertices()) or (self in other.get_adjacent_vertices())
 
     def __eq__(self, other):
-        return self.tonic == other.tonic and self.mode == other.mode
+        return self.pitch_class == other.pitch_class and self.mode == other.mode
 
     def __hash__(self):
-        return hash((self.tonic, self.mode))
+        return hash((self.pitch_class, self.mode))
 
 class KeyModulator:
-    def __init__(self):
+    def __init__(self, table_path=MODULATION_TABLE_PATH):
 
         # triad dictionaries by key
         self.triads_by_major_key = {}
@@ -46,9 +79,13 @@ class KeyModulator:
         self.tonic_by_major_key = {}
         self.tonic_by_minor_key = {}
 
-        # graph container
-        self.common_chord_graph = []
+        # graph container: (tonic pitch class, mode) -> KeyNode
+        self.common_chord_graph = {}
 
+        # tonic spelling -> pitch class
+        self.tonic_pitch_classes = {}
+        # chord spelling -> pitch class array
+        self.pitch_classes = {}
 
         # MAJOR TRIADS PRE-PROCESSING
         for pitch in PITCHES:
@@ -106,84 +143,266 @@ class KeyModulator:
 
             self.triads_by_minor_key[pitch] = triads
 
-        for pitch1 in PITCHES:
+        # one node per pitch class and mode, spelled the way the analyzer spells keys
+        triads_by_node = {}
+        for mode, tonics, triads_by_key in [('major', analyzer.MAJOR_TONICS, self.triads_by_major_key),
+                                            ('minor', analyzer.MINOR_TONICS, self.triads_by_minor_key)]:
+            for tonic in tonics:
+                node = KeyNode(self.get_tonic_pitch_class(tonic), mode, tonic)
+                self.common_chord_graph[node.get_id()] = node
 
-            node_1_major = KeyNode(pitch1, 'major')
-            node_1_minor = KeyNode(pitch1, 'minor')
+                # the triads of the key by their pitch classes, so that enharmonic chords match
+                triads = triads_by_key[tonic.upper()]
+                triads_by_node[node] = {frozenset(self.get_pitch_classes(t).tolist()): t for t in triads}
 
-            # get the current major node if it already exists
-            if node_1_major in self.common_chord_graph:
-                get_index = self.common_chord_graph.index(node_1_major)
-                node_1_major = self.common_chord_graph[get_index]
-            else:
-                self.common_chord_graph.append(node_1_major)
+        nodes = list(self.common_chord_graph.values())
+        for i, node1 in enumerate(nodes):
+            triads1 = triads_by_node[node1]
 
-            # get the current minor node if it already exists
-            if node_1_minor in self.common_chord_graph:
-                get_index = self.common_chord_graph.index(node_1_minor)
-                node_1_minor = self.common_chord_graph[get_index]
-            else:
-                self.common_chord_graph.append(node_1_minor)
-
-            # get the major and minor triads for this scale
-            major_triads1 = self.triads_by_major_key[pitch1]
-            minor_triads1 = self.triads_by_minor_key[pitch1]
-
-            for pitch2 in PITCHES:
-
-                node_2_major = KeyNode(pitch2, 'major')
-                node_2_minor = KeyNode(pitch2, 'minor')
+            for node2 in nodes[i + 1:]:
+                triads2 = triads_by_node[node2]
 
-                # get the current major node if it already exists
-                if node_2_major in self.common_chord_graph:
-                    get_index = self.common_chord_graph.index(node_2_major)
-                    node_2_major = self.common_chord_graph[get_index]
-                else:
-                    self.common_chord_graph.append(node_2_major)
-
-                # get the current minor node if it already exists
-                if node_2_minor in self.common_chord_graph:
-                    get_index = self.common_chord_graph.index(node_2_minor)
-                    node_2_minor = self.common_chord_graph[get_index]
-                else:
-                    self.common_chord_graph.append(node_2_major)
-
-                major_triads2 = self.triads_by_major_key[pitch2]
-                minor_triads2 = self.triads_by_minor_key[pitch2]
-
-                if pitch1[0] != pitch2[0]:
-                    # Major Key -> Major Key
-                    if node_2_major not in node_1_major.get_adjacent_vertices():
-                        major_major = list(major_triads1.intersection(major_triads2))
-                        node_1_major.insert_edge(node_2_major, major_major)
-
-                    # Minor Key -> Minor Key
-                    if node_2_minor not in node_1_minor.get_adjacent_vertices():
-                        minor_minor = list(minor_triads1.intersection(minor_triads2))
-                        node_1_minor.insert_edge(node_2_minor, minor_minor)
-
-                    # Major Key -> Minor Key
-                    if node_2_minor not in node_1_major.get_adjacent_vertices():
-                        major_minor = list(major_triads1.intersection(minor_triads2))
-                        node_1_major.insert_edge(node_2_minor, major_minor)
-
-                    # Minor Key -> Major Key
-                    if node_2_major not in node_1_minor.get_adjacent_vertices():
-                        minor_major = list(minor_triads1.intersection(major_triads2))
-                        node_1_minor.insert_edge(node_2_major, minor_major)
+                if node1.pitch_class != node2.pitch_class:
+                    # common chords of the two keys
+                    shared = triads1.keys() & triads2.keys()
                 else:
                     # Parallel Major <-> Minor can use modal mixture (any chord in either key)
-                    if node_2_minor not in node_1_major.get_adjacent_vertices():
-                        major_minor = list(major_triads1.union(minor_triads2))
-                        node_1_major.insert_edge(node_2_minor, major_minor)
+                    shared = triads1.keys() | triads2.keys()
+
+                # sorted, so that ties between pivots are broken the same way every run
+                shared = sorted(shared, key=sorted)
+
+                # each direction of the edge is spelled in its own key (falling back to the other key's spelling)
+                chords1 = [triads1.get(s) or triads2[s] for s in shared]
+                chords2 = [triads2.get(s) or triads1[s] for s in shared]
+                node1.insert_edge(node2, chords1, chords2)
+
+        # best pivot chord (and its voice-leading distance) for each edge, filled in as needed
+        self.edge_voice_leading = {}
+
+        # cheapest paths, by cost profile -> start key -> end key
+        self.table_path = table_path
+        self.modulation_paths = {DEFAULT_COST_PROFILE: self.load_modulation_paths()}
+
+    def get_tonic_pitch_class(self, tonic):
+        """
+        Returns the pitch class of the tonic spelling, or None if it isn't a pitch.
+        """
+        pitch_class = self.tonic_pitch_classes.get(tonic)
+        if pitch_class is None:
+            try:
+                pitch_class = m21.pitch.Pitch(tonic).pitchClass
+            except m21.pitch.PitchException:
+                return None
+            self.tonic_pitch_classes[tonic] = pitch_class
+
+        return pitch_class
+
+    def get_key_id(self, tonic, mode):
+        """
+        Returns the (pitch class, mode) identifying the key in the graph, which is the same for
+        all the enharmonic spellings of the key.
+        """
+        pitch_class = self.get_tonic_pitch_class(tonic)
+        if pitch_class is None:
+            return None
 
-                    if node_2_major not in node_1_minor.get_adjacent_vertices():
-                        minor_major = list(minor_triads1.union(major_triads2))
-                        node_1_minor.insert_edge(node_2_major, minor_major)
+        return (pitch_class, mode.lower())
+
+    def get_node(self, tonic, mode):
+        """
+        Returns the graph node of the key (in any spelling), or None if it isn't in the graph.
+        """
+        return self.common_chord_graph.get(self.get_key_id(tonic, mode))
+
+    def get_spelling(self, tonic, mode):
+        """
+        Returns the tonic spelled as requested if there are chords for that spelling,
+        or else as the graph spells the key.
+        """
+        if tonic.upper() in self.tonic_by_major_key:
+            return tonic
+
+        return self.get_node(tonic, mode).tonic
+
+    def get_pitch_classes(self, chord_tuple):
+        """
+        Returns the pitch classes of the (spelled) chord as a numpy array.
+        """
+        pitch_classes = self.pitch_classes.get(chord_tuple)
+        if pitch_classes is None:
+            pitch_classes = np.array([m21.pitch.Pitch(p).pitchClass for p in chord_tuple])
+            self.pitch_classes[chord_tuple] = pitch_classes
+
+        return pitch_classes
+
+    def get_tonic_chord(self, node):
+        if node.mode == 'major':
+            return self.tonic_by_major_key[node.tonic.upper()]
+        else:
+            return self.tonic_by_minor_key[node.tonic.upper()]
 
+    def get_cadence_chord(self, node):
+        # the cadence's seventh chord (dominant in major, diminished in minor)
+        if node.mode == 'major':
+            return self.dominant_7th_by_key[node.tonic.upper()]
+        else:
+            return self.diminished_7th_by_key[node.tonic.upper()]
+
+    def get_edge_voice_leading(self, node, other_node):
+        """
+        Returns the pivot chord for modulating from node to other_node with the smoothest voice leading,
+        along with its total voice-leading distance: tonic of node -> pivot -> seventh chord of other_node
+        -> tonic of other_node.
+        """
+        edge = (node, other_node)
+
+        if edge not in self.edge_voice_leading:
+            pivots = node.edges[other_node]
+            pivot_classes = np.array([self.get_pitch_classes(chord) for chord in pivots])
+
+            tonic = self.get_pitch_classes(self.get_tonic_chord(node))
+            seventh = self.get_pitch_classes(self.get_cadence_chord(other_node))
+            resolution = self.get_pitch_classes(self.get_tonic_chord(other_node))
+
+            # distances of all the candidate pivots at once
+            distances = voice_leading_distances(tonic[np.newaxis, :], pivot_classes)
+            distances += voice_leading_distances(pivot_classes, seventh[np.newaxis, :])
+            distances += voice_leading_distances(seventh[np.newaxis, :], resolution[np.newaxis, :])
+
+            best = int(np.argmin(distances))
+            self.edge_voice_leading[edge] = (pivots[best], float(distances[best]))
+
+        return self.edge_voice_leading[edge]
+
+    def find_cheapest_paths(self, start_node, cost_profile):
+        """
+        Dijkstra search from the start node, returning the cheapest path to every other node
+        it can reach, as a list of (node, pivot chord into that node) with no pivot for the start node.
+        """
+        costs = {start_node: 0.0}
+        parents = {start_node: (None, None)}
+        done = set()
+
+        # the counter keeps ties in the order they were found
+        counter = 0
+        heap = [(0.0, counter, start_node)]
+
+        while heap:
+            cost, _, current_node = heapq.heappop(heap)
+            if current_node in done:
+                continue
+            done.add(current_node)
+
+            for node in current_node.get_adjacent_vertices():
+                if node in done:
+                    continue
+
+                pivot, distance = self.get_edge_voice_leading(current_node, node)
+                new_cost = cost + cost_profile.modulation_cost + cost_profile.voice_leading_weight * distance
+
+                if node not in costs or new_cost < costs[node]:
+                    costs[node] = new_cost
+                    parents[node] = (current_node, pivot)
+                    counter += 1
+                    heapq.heappush(heap, (new_cost, counter, node))
+
+        paths = {}
+        for node in parents:
+            if node is start_node:
+                continue
+
+            path = []
+            current_node = node
+            while current_node:
+                parent, pivot = parents[current_node]
+                path.append((current_node, pivot))
+                current_node = parent
+
+            paths[node] = path[::-1]
+
+        return paths
+
+    def get_modulation_paths(self, start_key, cost_profile):
+        """
+        Returns the cheapest paths from the start key to every other key under the cost profile,
+        as end key -> [(key, pivot chord), ...], with keys given as (pitch class, mode).
+        Memoized per start key and profile.
+        """
+        profile_paths = self.modulation_paths.setdefault(cost_profile, {})
+
+        if start_key not in profile_paths:
+            start_node = self.common_chord_graph.get(start_key)
+            if start_node is None:
+                return {}
+
+            paths = self.find_cheapest_paths(start_node, cost_profile)
+            profile_paths[start_key] = {end.get_id(): [(n.get_id(), pivot) for n, pivot in path] for end, path in paths.items()}
+
+        return profile_paths[start_key]
+
+    def compute_modulation_paths(self, cost_profile=DEFAULT_COST_PROFILE):
+        """
+        Returns the cheapest path between every pair of keys, as
+        (start pitch class, start mode) -> (end pitch class, end mode) -> [((pitch class, mode), pivot chord), ...]
+        """
+        table = {}
+        for start_key, start_node in self.common_chord_graph.items():
+            paths = self.find_cheapest_paths(start_node, cost_profile)
+            table[start_key] = {end.get_id(): [(n.get_id(), pivot) for n, pivot in path] for end, path in paths.items()}
+
+        return table
+
+    def load_modulation_paths(self):
+        """
+        Loads the table of cheapest paths (for the default cost profile) from disk, or computes it (and saves it)
+        if it hasn't been saved yet, or was saved for a different set of keys or cost profile.
+        """
+        try:
+            with open(self.table_path, 'r') as f:
+                data = json.load(f)
+
+            if data['tonics'] == [analyzer.MAJOR_TONICS, analyzer.MINOR_TONICS] and data['profile'] == list(DEFAULT_COST_PROFILE):
+                table = {}
+                for start, ends in data['paths'].items():
+                    table[self.parse_key_id(start)] = {self.parse_key_id(end): [(tuple(k), tuple(p) if p else None) for k, p in path] for end, path in ends.items()}
+                return table
+        except (IOError, ValueError, KeyError):
+            pass
+
+        table = self.compute_modulation_paths()
+
+        try:
+            with open(self.table_path, 'w') as f:
+                paths = {}
+                for start, ends in table.items():
+                    paths[self.format_key_id(start)] = {self.format_key_id(end): path for end, path in ends.items()}
+                json.dump({'tonics': [analyzer.MAJOR_TONICS, analyzer.MINOR_TONICS], 'profile': list(DEFAULT_COST_PROFILE), 'paths': paths}, f)
+        except IOError:
+            print("couldn't save modulation paths to " + self.table_path)
+
+        return table
+
+    def format_key_id(self, key_id):
+        return str(key_id[0]) + ' ' + key_id[1]
+
+    def parse_key_id(self, key_string):
+        pitch_class, mode = key_string.split(' ')
+        return (int(pitch_class), mode)
+
+    def get_neighboring_keys(self, key_tuple):
+        """
+        Returns the (tonic, mode) of every key sharing a common chord with the given key (in any spelling),
+        spelled the way the graph spells them.
+        """
+        node = self.get_node(key_tuple[0], key_tuple[1])
+        if node is None:
+            return []
+
+        return [(n.tonic, n.mode) for n in node.get_adjacent_vertices()]
 
     def print_graph(self):
-        for node in self.common_chord_graph:
+        for node in self.common_chord_graph.values():
             print (node.tonic + ' ' + node.mode)
             for k, v in node.edges.items():
                 print (k.tonic + ' ' + k.mode, v)
@@ -198,28 +417,25 @@ class KeyModulator:
     def add_cadence(self, key, mode, current_path):
         new_key = m21.key.Key(key, mode)
 
-        # I chord
+        # seventh chord -> I chord
         if mode.lower() == 'major':
 
-            # get chord and create analyzed element with new_key as context
-            chord_tuple = self.tonic_by_major_key[key.upper()]
-            current_path.append(self.wrap_chord_analyzed(new_key, chord_tuple))
-
             # I like the sound of either dominant or diminshed 7ths in major, so randomize
             k = random.randint(0, 1)
             if k == 0:
                 seventh_chord_tuple = self.dominant_7th_by_key[key.upper()]
-                current_path.append(self.wrap_chord_analyzed(new_key, seventh_chord_tuple))
             else:
                 seventh_chord_tuple = self.diminished_7th_by_key[key.upper()]
-                current_path.append(self.wrap_chord_analyzed(new_key, seventh_chord_tuple))
+
+            # get chord and create analyzed element with new_key as context
+            chord_tuple = self.tonic_by_major_key[key.upper()]
         else:
             # I prefer only diminished triads in minor
+            seventh_chord_tuple = self.diminished_7th_by_key[key.upper()]
             chord_tuple = self.tonic_by_minor_key[key.upper()]
-            current_path.append(self.wrap_chord_analyzed(new_key, chord_tuple))
 
-            seventh_chord_tuple = self.diminished_7th_by_key[key.upper()]
-            current_path.append(self.wrap_chord_analyzed(new_key, seventh_chord_tuple))
+        current_path.append(self.wrap_chord_analyzed(new_key, seventh_chord_tuple))
+        current_path.append(self.wrap_chord_analyzed(new_key, chord_tuple))
 
     def add_tonic(self, key, mode, current_path):
         key_object = m21.key.Key(key, mode)
@@ -255,59 +471,42 @@ class KeyModulator:
 
         return measures
 
-    def find_chord_path(self, start_tuple, end_tuple):
-
-        start_node = KeyNode(start_tuple[0].lower(), start_tuple[1].lower())
-        index = self.common_chord_graph.index(start_node)
-        start_node = self.common_chord_graph[index]
+    def find_chord_path(self, start_tuple, end_tuple, cost_profile=DEFAULT_COST_PROFILE):
 
-        levels = {}
-        queue = []
+        start_id = self.get_key_id(start_tuple[0], start_tuple[1])
+        end_id = self.get_key_id(end_tuple[0], end_tuple[1])
+        if start_id is None or end_id is None:
+            return None
 
-        levels[start_node] = None
-        for node in start_node.get_adjacent_vertices():
-            queue.append(node)
-            levels[node] = start_node
+        # the same key (possibly spelled differently, e.g. a# and b- major) needs no modulation
+        if start_id == end_id:
+            return []
 
-        goal_node = None
-        while queue:
-            current_node = queue.pop(0)
-            if current_node.tonic == end_tuple[0].lower() and current_node.mode == end_tuple[1].lower():
-                goal_node = current_node
-                break
-            else:
-                for node in current_node.get_adjacent_vertices():
-                    if node not in set(levels.keys()):
-                        queue.append(node)
-                        levels[node] = current_node
+        # look up the cheapest path of keys (and pivot chords) between the two keys
+        key_path = self.get_modulation_paths(start_id, cost_profile).get(end_id)
 
-        if not goal_node:
+        if not key_path:
             return None
 
+        # start on the tonic
         path = []
-        # end the path  with 7th chord function -> tonic (path is reversed, so put it first)
+        self.add_tonic(self.get_spelling(start_tuple[0], start_tuple[1]), start_tuple[1], path)
 
-        self.add_cadence(end_tuple[0], end_tuple[1], path)
+        # pivot into each key of the path, and establish it with a 7th chord function -> tonic cadence
+        for i in range(1, len(key_path)):
+            parent_node = self.common_chord_graph[key_path[i - 1][0]]
+            key_id, pivot_chord = key_path[i]
+            node = self.common_chord_graph[key_id]
 
-        # get the chord progression path
-        while goal_node:
-            parent = levels[goal_node]
-            if parent:
+            # pivots are spelled in the key they leave from
+            path.append(self.wrap_chord_analyzed(m21.key.Key(parent_node.tonic, parent_node.mode), pivot_chord))
 
-                pivot_chord = parent.edges[goal_node][0]
-                analyzed_pivot_chord = self.wrap_chord_analyzed(m21.key.Key(parent.tonic, parent.mode), pivot_chord)
-
-                # we're starting with the tonic, don't add a cadence to where we've started... (redundant)
-                if levels[parent]:
-                    self.add_cadence(parent.tonic, parent.mode, path)
-
-                path.append(analyzed_pivot_chord)
-
-            # set up next iteration of while loop, up the ancestry tree
-            goal_node = parent
+            if i == len(key_path) - 1:
+                self.add_cadence(self.get_spelling(end_tuple[0], end_tuple[1]), end_tuple[1], path)
+            else:
+                self.add_cadence(node.tonic, node.mode, path)
 
-        self.add_tonic(start_tuple[0], start_tuple[1], path)
-        return path[::-1]
+        return path
 
 
 # mod = KeyModulator()
@@ -22,8 +22,8 @@ import timeit
 # plt.plot(y, x, 'ro')
 # plt.show()
 
-# print (analyzer.mode_intervals['major'])
-# print(analyzer.mode_intervals['minor'])
+# print (analyzer.get_mode_intervals()['major'])
+# print(analyzer.get_mode_intervals()['minor'])
 
 # k = m21.key.Key('C')
 # nk = m21.key.Key('b')
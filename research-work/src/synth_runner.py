@@ -19,8 +19,13 @@ import analyzer
 import transformer
 import looper
 import av_grid
+import av_input
+from dispatcher import CoalescingDispatcher
 import concurrent.futures as fut
 import time
+import colorsys
+from collections import defaultdict
+from common.fluidsynth import EVENT_NOTEON, EVENT_NOTEOFF, new_event_array, Sequencer
 
 STRING_PATCH = 48
 BRASS_PATCH = 61
@@ -34,6 +39,47 @@ SUSTAIN_CC = 64
 REVERB_CC = 91
 CHORUS_CC = 93
 
+# time notes in FluidSynth's sequencer instead of splitting audio blocks in python
+USE_SEQUENCER = False
+
+# where arousal/valence values come from: 'file' (data/av.txt), 'fifo' (data/av.fifo) or 'socket' (data/av.sock)
+AV_SOURCE = 'file'
+
+# arousal/valence grids of each parameter
+TEMPO_POINTS_PATH = './av-grid-points/tempo-mario.txt'
+RHYTHM_POINTS_PATH = './av-grid-points/rhythm-mario.txt'
+INSTRUMENT_POINTS_PATH = './av-grid-points/instruments_multi-mario.txt'
+KEY_POINTS_PATH = './av-grid-points/key-mario.txt'
+
+# look samples up in precomputed rasters of the grids, instead of measuring the distance to every point
+RASTERIZE_GRIDS = True
+
+# smoothing of the arousal/valence input (One Euro filter: cutoff in Hz when still, and how much
+# faster movement raises it. AV_BETA = 0 is plain exponential smoothing)
+AV_MIN_CUTOFF = 1.0
+AV_BETA = 0.5
+
+# how far the smoothed arousal/valence must move before the transformations hear about it
+AV_MIN_CHANGE = 0.005
+
+# parameter -> (distance the input must move in the AV plane, beats it must wait) before it changes again
+PARAMETER_GATES = {
+    'tempo': (0.05, 1),
+    'rhythm': (0.15, 4),
+    'instruments': (0.2, 8),
+    'key': (0.25, 8),
+}
+
+# how far ahead of playback measures are posted
+LOOKAHEAD_BEATS = 4
+
+# most voices the synth plays at once, before stealing from lower priority parts
+MAX_VOICES = 96
+
+# most musical events (notes, measures, key changes) the visuals handle per frame, and most pulses on screen
+MAX_EVENTS_PER_FRAME = 64
+MAX_PULSES = 200
+
 class MainWidget(BaseWidget) :
     def __init__(self):
         super(MainWidget, self).__init__()
@@ -41,18 +87,24 @@ class MainWidget(BaseWidget) :
         self.audio = Audio(2) # set up audio
         self.song_path = '../scores/mario-song.musicxml' # set song path
 
-        # create TempoMap, AudioScheduler
+        # Set up FluidSynth
+        self.synth = Synth('./synth_data/FluidR3_GM.sf2')
+        self.note_velocity = 127
+
+        # create TempoMap, AudioScheduler (or one that times notes in FluidSynth's sequencer)
         self.tempo = 120 #TODO: grab tempo from file
         self.tempo_map  = SimpleTempoMap(self.tempo)
-        self.sched = AudioScheduler(self.tempo_map)
+        if USE_SEQUENCER:
+            self.sched = SequencerScheduler(self.tempo_map, Sequencer(self.synth, Audio.sample_rate))
+        else:
+            self.sched = AudioScheduler(self.tempo_map)
 
-        # Add a looper
-        self.looper = looper.SongLooper(self.song_path, self.tempo)
+        # Add a looper (measures are transformed lazily, just ahead of playback)
+        self.looper = looper.SongLooper(self.song_path, self.tempo, lazy=True)
         self.looper.initialize()
 
-        # Set up FluidSynth
-        self.synth = Synth('./synth_data/FluidR3_GM.sf2')
-        self.note_velocity = 127
+        # notes go through a voice manager, which keeps the polyphony within budget
+        self.voices = VoiceManager(self.synth, MAX_VOICES)
 
         # set up a midi channel for each part
         for i in range(len(self.looper.parts)):
@@ -60,6 +112,12 @@ class MainWidget(BaseWidget) :
             base_channel = 2*i
             switch_channel = 2*i + 1
 
+            # earlier parts keep their voices over later ones, and the switch channel is
+            # silent (so muted) except during instrument switches
+            self.voices.set_priority(base_channel, len(self.looper.parts) - i)
+            self.voices.set_priority(switch_channel, len(self.looper.parts) - i)
+            self.voices.mute(switch_channel)
+
             self.synth.program(base_channel, 0, 0)
             self.synth.program(switch_channel, 0, 0)
 
@@ -87,18 +145,78 @@ class MainWidget(BaseWidget) :
 
         self.current_rhythm = 'ORIGINAL'
 
+        # the visuals react to the music through the events the scheduler publishes as it plays
+        self.event_bus = EventBus()
+        self.sched.set_event_bus(self.event_bus)
+        self.event_bus.subscribe('note_on', self.on_note_event)
+        self.event_bus.subscribe('measure', self.on_measure_event)
+        self.event_bus.subscribe('key_change', self.on_key_event)
+
+        self.pulses = AnimGroup()
+        self.canvas.add(self.pulses)
+        self.pulse_hue = self.get_key_hue(self.looper.current_key)
+        self.posted_key = self.looper.current_key
+
         # concurrent processing of transformations
         self.executor = fut.ThreadPoolExecutor(max_workers=4)
 
+        # transformations go through a dispatcher, so that a burst of changes only runs the latest
+        self.dispatcher = CoalescingDispatcher(self.executor)
+
+        # each frame's work, timed separately. Only the audio pump has to run every frame: the rest
+        # can wait for a frame with time to spare
+        self.frame_scheduler.add_task('audio', self.audio.on_update, critical=True)
+        self.frame_scheduler.add_task('events', self.dispatch_events)
+        self.frame_scheduler.add_task('pulses', self.pulses.on_update)
+        self.frame_scheduler.add_task('label', self.update_label)
+
+        # post measures ahead of playback from a thread of their own, starting a beat from now
+        self.lookahead = LookaheadScheduler(self.sched, self.post_measure, LOOKAHEAD_BEATS, start_tick=kTicksPerQuarter)
+        self.lookahead.start()
+        register_terminate_func(self.lookahead.stop)
+
     def on_cmd(self,tick, pitch, channel, velocity):
-        self.synth.noteon(channel, pitch, velocity)
+        self.voices.noteon(channel, pitch, velocity)
 
     def off_cmd(self,tick, pitch, channel):
-        self.synth.noteoff(channel, pitch)
+        self.voices.noteoff(channel, pitch)
+
+    def events_cmd(self, tick, events, notes):
+        self.voices.apply_events(events)
+        if notes:
+            self.sched.publish(tick, 'note_on', notes)
+
+    def post_events(self, tick, events, notes):
+        """
+        Posts the midi events to play at tick, publishing notes, a list of (part, pitch, velocity), as they play.
+        """
+        if USE_SEQUENCER:
+            # the sequencer plays the notes itself, so muted channels can only be filtered ahead of time
+            self.sched.post_events_at_tick(tick, self.voices.filter_muted(events))
+            if notes:
+                self.sched.publish_at_tick(tick, 'note_on', notes)
+        else:
+            self.sched.post_at_tick(tick, self.events_cmd, events, notes)
 
-    def measure_update(self, now_beat, now_tick):
+    def post_measure(self, tick):
+        """
+        Posts the next measure of the loop to play from tick on, and returns its length in ticks.
+        """
         # next step in the loop
-        self.looper.step(now_beat + 1)
+        self.looper.step(int(tick / kTicksPerQuarter))
+
+        # transform the upcoming measures in the background
+        self.executor.submit(self.looper.prefetch)
+
+        # the visuals hear about the measure (and the key it's in) as it starts playing
+        self.sched.publish_at_tick(tick, 'measure', self.looper.measure_index)
+        if self.looper.current_key != self.posted_key:
+            self.posted_key = self.looper.current_key
+            self.sched.publish_at_tick(tick, 'key_change', self.posted_key)
+
+        # note events of the measure, grouped by the tick they happen on, and the notes they start
+        events_by_tick = defaultdict(list)
+        notes_by_tick = defaultdict(list)
 
         # schedule each element that appears within the measure
         for i in range(len(self.looper.current_measure_in_parts)):
@@ -109,57 +227,78 @@ class MainWidget(BaseWidget) :
                 element = part[j]
                 dur = element.element.duration.quarterLength
 
-                # ge millisecond timestamps that the element will be scheduled on
-                on_tick = now_tick + (element.beatOffset + 1)*kTicksPerQuarter
+                # ticks that the element will be scheduled on (beat offsets start at 1)
+                on_tick = tick + (element.beatOffset - 1)*kTicksPerQuarter
                 off_tick = on_tick + kTicksPerQuarter*dur
 
                 # if the element is a note
                 if element.is_note():
-                    pitch = element.element.pitch.midi
-
-                    # schedule note on and off
-                    self.sched.post_at_tick(on_tick, self.on_cmd, pitch, 2*i, self.note_velocity)
-                    self.sched.post_at_tick(off_tick, self.off_cmd, pitch, 2*i)
-
-                    # switch channel should mirror silently
-                    self.sched.post_at_tick(on_tick, self.on_cmd, pitch, 2*i + 1, self.note_velocity)
-                    self.sched.post_at_tick(off_tick, self.off_cmd, pitch, 2*i + 1)
+                    pitches = [element.element.pitch.midi]
 
                 # else if the element is a chord
                 elif element.is_chord():
                     pitches = [pitch.midi for pitch in list(element.element.pitches)]
-
-                    # schedule off and on events for each pitch in the chord
-                    for pitch in pitches:
-                        self.sched.post_at_tick(on_tick, self.on_cmd, pitch, 2*i, self.note_velocity)
-                        self.sched.post_at_tick(off_tick, self.off_cmd, pitch, 2*i)
-
-                        # swtich channel should mirror silently
-                        self.sched.post_at_tick(on_tick, self.on_cmd, pitch, 2*i + 1, self.note_velocity)
-                        self.sched.post_at_tick(off_tick, self.off_cmd, pitch, 2*i + 1)
-
-    def on_update(self):
-        self.audio.on_update()
-
-        # current time
-        now_beat = self.sched.get_current_beat()
-        now_tick = self.sched.get_tick()
-
-        #time of last measure
-        previous_beat = self.looper.get_last_measure_beat()
-
-        # take the difference, and see if it falls within the buffer-zone
-        diff = now_beat - previous_beat
-        mb = 3
-
-        if (diff >= mb):
-            # self.executor.submit(self.measure_update, now_beat, now_tick)
-            self.measure_update(now_beat, now_tick)
-
-        self.label.text = "Synthesizer and accompanying code via Eran Egozy (21M.385)" + '\n\n'
-        self.label.text += self.sched.now_str() + '\n'
-        self.label.text += 'key = ' + self.note_letter + self.accidental_letter + ' ' + self.mode + '\n'
-        self.label.text += 'tempo = ' + str(self.tempo) + '\n'
+                else:
+                    continue
+
+                # note on and off for each pitch, and the switch channel should mirror silently
+                for pitch in pitches:
+                    notes_by_tick[on_tick].append((i, pitch, self.note_velocity))
+                    for channel in (2*i, 2*i + 1):
+                        events_by_tick[on_tick].append((EVENT_NOTEON, channel, pitch, self.note_velocity))
+                        events_by_tick[off_tick].append((EVENT_NOTEOFF, channel, pitch, 0))
+
+        # one command per tick, releasing notes before starting the ones that replace them
+        for event_tick in sorted(events_by_tick):
+            events = new_event_array(sorted(events_by_tick[event_tick], key=lambda e: e[0] != EVENT_NOTEOFF))
+            self.post_events(event_tick, events, notes_by_tick.get(event_tick))
+
+        return int(self.looper.time_signature.barDuration.quarterLength * kTicksPerQuarter)
+
+    def get_key_hue(self, key):
+        # a hue per tonic, around the color wheel by fifths so that close keys get close colors
+        tonic = m21.pitch.Pitch(key.split(' ')[0])
+        return (tonic.pitchClass * 7 % 12) / 12.0
+
+    def on_note_event(self, tick, notes):
+        for part, pitch, velocity in notes:
+            if self.pulses.size() >= MAX_PULSES:
+                break
+
+            # pitch across the screen, one row per part, louder notes bigger
+            x = Window.width * (pitch - 21) / 88.0
+            y = Window.height * (part + 1) / (len(self.looper.parts) + 1.0)
+            rgb = colorsys.hsv_to_rgb(self.pulse_hue, 0.7, 1.0)
+            self.pulses.add(Pulse((x, y), rgb + (0.8,), size=20 + velocity * 0.5))
+
+    def on_measure_event(self, tick, measure_index):
+        if self.pulses.size() < MAX_PULSES:
+            rgb = colorsys.hsv_to_rgb(self.pulse_hue, 0.3, 0.6)
+            self.pulses.add(Pulse((Window.width * 0.5, Window.height * 0.5), rgb + (0.3,), size=Window.height, duration=1.0))
+
+    def on_key_event(self, tick, key):
+        self.pulse_hue = self.get_key_hue(key)
+
+    def get_label_text(self):
+        text = "Synthesizer and accompanying code via Eran Egozy (21M.385)" + '\n\n'
+        text += self.sched.now_str() + '\n'
+        text += 'key = ' + self.note_letter + self.accidental_letter + ' ' + self.mode + '\n'
+        text += 'tempo = ' + str(self.tempo) + '\n'
+        text += self.voices.now_str() + '\n'
+        text += self.synth.now_str() + '\n'
+        text += self.dispatcher.now_str() + '\n'
+        text += self.event_bus.now_str() + '\n'
+        text += self.frame_scheduler.now_str() + '\n'
+        if self.lookahead.error is not None:
+            text += 'lookahead stopped: ' + repr(self.lookahead.error) + '\n'
+        return text
+
+    def update_label(self):
+        self.label.text = self.get_label_text()
+
+    # react to what played since the last frame
+    def dispatch_events(self):
+        self.event_bus.drain(MAX_EVENTS_PER_FRAME)
 
 class TransformationWidget(MainWidget):
     def __init__(self):
@@ -178,6 +317,7 @@ class TransformationWidget(MainWidget):
         self.rhythm_changing = False
 
         self.checking_transformation_done = False
+        self.frame_scheduler.add_task('transformations', self.check_transformations)
 
         self.last_key_change_beat = 0
 
@@ -187,6 +327,11 @@ class TransformationWidget(MainWidget):
         self.tempo_map.set_tempo(self.tempo, cur_time)
         self.looper.set_tempo(self.tempo)
 
+        # the sequencer has the notes already queued at sample times, so move them to their times under
+        # the new tempo (other schedulers keep commands by tick, which are already right)
+        if isinstance(self.sched, SequencerScheduler):
+            self.sched.retime()
+
     def tempoUp(self):
         self.tempo += 8
         self.tempoChanged()
@@ -203,12 +348,12 @@ class TransformationWidget(MainWidget):
     def keyChanged(self, rhythm = None):
         new_key = self.note_letter + self.accidental_letter + ' ' + self.mode
         if new_key != self.looper.current_key:
-            # # submit the actual transformation task to the executor
-            self.executor.submit(self.looper.transform, None, new_key, rhythm)
+            # # submit the actual transformation task (replacing any key change still waiting to run)
+            self.dispatcher.submit('key-transform', self.looper.transform, None, new_key, rhythm)
 
     def rhythmChanged(self):
-        # submit the actual transformation task to the executor
-        self.executor.submit(self.looper.transform, None, None, self.current_rhythm)
+        # submit the actual transformation task (replacing any rhythm change still waiting to run)
+        self.dispatcher.submit('rhythm-transform', self.looper.transform, None, None, self.current_rhythm)
 
     def checkKeyChange(self, note, accidental, mode):
         # if this results in a key change, then calculate the new transformation
@@ -250,7 +395,8 @@ class TransformationWidget(MainWidget):
             self.synth.program(2*i, 0, patches[i])
             self.setChannelVolume(2*i, 0)
 
-            # play sound from switch CHANNELS
+            # play sound from switch CHANNELS (which start mirroring the base channels' notes)
+            self.voices.unmute(2*i + 1, sync_from=2*i)
             self.setChannelVolume(2*i + 1, self.current_volume)
 
         # create the *linear* volume arc (list of values to iteratively set channels to for crescendo/decrescendo effect)
@@ -269,6 +415,9 @@ class TransformationWidget(MainWidget):
             # switch instruments base channels and make them quiet
             self.synth.program(2*i + 1, 0, patches[i])
 
+            # the switch channels are silent until the next switch
+            self.voices.mute(2*i + 1)
+
 
     def setVolume(self):
         for i in range(len(self.looper.parts)):
@@ -277,7 +426,8 @@ class TransformationWidget(MainWidget):
     def setChannelVolume(self, i, value):
         self.synth.cc(i, VOLUME_CC, value)
 
-    def on_update(self):
+    # apply the key and rhythm changes whose transformations are done
+    def check_transformations(self):
         if self.checking_transformation_done:
             if self.key_changing and not self.rhythm_changing:
                 self.keyChanged()
@@ -292,8 +442,6 @@ class TransformationWidget(MainWidget):
 
             self.checking_transformation_done = False
 
-        super(TransformationWidget, self).on_update()
-
 class KeyboardWidget(TransformationWidget):
     """
     Control the music transformer via various keyboard inputs.
@@ -367,7 +515,7 @@ class KeyboardWidget(TransformationWidget):
             self.held_r = False
             if len(self.r_log) >= 4:
                 self.rhythm = self.r_log[-4:]
-                self.executor.submit(self.looper.transform, [self.current_part_index], None, self.rhythm)
+                self.dispatcher.submit(('part-transform', self.current_part_index), self.looper.transform, [self.current_part_index], None, self.rhythm)
         elif keycode[1] == 's':
             self.held_s = False
             if len(self.s_log) == 1:
@@ -375,11 +523,12 @@ class KeyboardWidget(TransformationWidget):
             elif len(self.s_log) >= 2:
                 self.synth.program(self.current_part_index, 0, int("".join(self.s_log[-2:])))
 
-    def on_update(self):
-        self.label.text += 'rhythm = ' + str(self.r_log[-4:]) + '\n'
-        self.label.text += 'patch = ' + "".join(self.s_log[-2:]) + '\n'
-        self.label.text += 'selected part = ' + str(self.current_part_index + 1) + '\n'
-        super(KeyboardWidget, self).on_update()
+    def get_label_text(self):
+        text = super(KeyboardWidget, self).get_label_text()
+        text += 'rhythm = ' + str(self.r_log[-4:]) + '\n'
+        text += 'patch = ' + "".join(self.s_log[-2:]) + '\n'
+        text += 'selected part = ' + str(self.current_part_index + 1) + '\n'
+        return text
 
 class ArousalValenceWidget(TransformationWidget):
     """
@@ -391,19 +540,43 @@ class ArousalValenceWidget(TransformationWidget):
 
         self.arousal = 0
         self.valence = 0
-        self.file = open('./data/av.txt', 'r')
+
+        # arousal/valence values arrive on a background thread
+        if AV_SOURCE == 'socket':
+            self.av_source = av_input.SocketSource()
+        elif AV_SOURCE == 'fifo':
+            self.av_source = av_input.FifoSource()
+        else:
+            self.av_source = av_input.FileTailSource()
+        self.av_source.start()
+        register_terminate_func(self.av_source.stop)
+
+        # smooth the input, and only let each parameter change again once the input moved far enough, long enough after
+        self.av_smoother = av_input.AVSmoother(AV_MIN_CUTOFF, AV_BETA)
+        self.parameter_gates = {name: av_input.ParameterGate(distance, dwell) for name, (distance, dwell) in PARAMETER_GATES.items()}
+        self.frame_scheduler.add_task('av', self.poll_av)
 
         self.tempo_grid = av_grid.TempoGrid()
-        self.tempo_grid.parse_point_file('./av-grid-points/tempo-mario.txt')
+        self.tempo_grid.parse_point_file(TEMPO_POINTS_PATH)
 
         self.rhythm_grid = av_grid.RhythmGrid()
-        self.rhythm_grid.parse_point_file('./av-grid-points/rhythm-mario.txt')
+        self.rhythm_grid.parse_point_file(RHYTHM_POINTS_PATH)
 
         self.instrument_grid = av_grid.InstrumentGrid()
-        self.instrument_grid.parse_point_file('./av-grid-points/instruments_multi-mario.txt')
+        self.instrument_grid.parse_point_file(INSTRUMENT_POINTS_PATH)
+
+        # load every instrument the grid can switch to now, rather than on its first note
+        self.synth.preload(self.instrument_grid.get_patches() | {STRING_PATCH, BRASS_PATCH})
 
         self.key_grid = av_grid.KeySignatureGrid()
-        self.key_grid.parse_point_file('./av-grid-points/key-mario.txt')
+        self.key_grid.parse_point_file(KEY_POINTS_PATH)
+
+        # sample the grids from precomputed rasters (saved next to the point files)
+        if RASTERIZE_GRIDS:
+            self.tempo_grid.build_raster(TEMPO_POINTS_PATH)
+            self.rhythm_grid.build_raster(RHYTHM_POINTS_PATH)
+            self.instrument_grid.build_raster(INSTRUMENT_POINTS_PATH)
+            self.key_grid.build_raster(KEY_POINTS_PATH)
 
     def transform_arousal_valence(self, arousal, valence):
 
@@ -417,33 +590,39 @@ class ArousalValenceWidget(TransformationWidget):
         except Exception as e:
             pass
 
+        beat = self.sched.get_tick() / kTicksPerQuarter
+
         try:
             # tempo
-            tempo_point, _ = self.tempo_grid.sample_parameter_point(arousal, valence)
-            self.setTempo(tempo_point.get_value())
+            if self.parameter_gates['tempo'].check(arousal, valence, beat):
+                tempo_point, _ = self.tempo_grid.sample_parameter_point(arousal, valence)
+                self.setTempo(tempo_point.get_value())
         except Exception as e:
             pass
 
 
         try:
             # rhythm
-            rhythm_point, _ = self.rhythm_grid.sample_parameter_point(arousal, valence)
-            self.checkRhythmChange(list(rhythm_point.get_value()))
+            if self.parameter_gates['rhythm'].check(arousal, valence, beat):
+                rhythm_point, _ = self.rhythm_grid.sample_parameter_point(arousal, valence)
+                self.checkRhythmChange(list(rhythm_point.get_value()))
         except Exception as e:
             pass
 
         try:
             # instrument
-            instrument_point, _ = self.instrument_grid.sample_parameter_point(arousal, valence)
-            self.executor.submit(self.switchInstruments, list(instrument_point.get_value()))
+            if self.parameter_gates['instruments'].check(arousal, valence, beat):
+                instrument_point, _ = self.instrument_grid.sample_parameter_point(arousal, valence)
+                self.dispatcher.submit('instruments', self.switchInstruments, list(instrument_point.get_value()))
         except Exception as e:
             print("couldn't switch instruments")
 
         try:
             # key
-            key_point, _ = self.key_grid.sample_parameter_point(arousal, valence)
-            key_tuple = key_point.get_value()
-            self.checkKeyChange(key_tuple[0], key_tuple[1], key_tuple[2])
+            if self.parameter_gates['key'].check(arousal, valence, beat):
+                key_point, _ = self.key_grid.sample_parameter_point(arousal, valence)
+                key_tuple = key_point.get_value()
+                self.checkKeyChange(key_tuple[0], key_tuple[1], key_tuple[2])
         except Exception as e:
             pass
 
@@ -459,21 +638,20 @@ class ArousalValenceWidget(TransformationWidget):
         self.note_velocity = max(45, int(velocity))
 
 
-    def on_update(self):
-        where = self.file.tell()
-        line = self.file.readline()
-        if not line:
-            self.file.seek(where)
-        else:
-
-            values = line.split(' ')
-            self.arousal = float(values[0])
-            self.valence = float(values[1])
-            self.executor.submit(self.transform_arousal_valence, self.arousal, self.valence)
-
-        super(ArousalValenceWidget, self).on_update()
-
+    def poll_av(self):
+        # smooth all the values that arrived since the last frame, then keep the filter moving toward
+        # the latest one (samples are sparse, and the filter only moves when it's stepped)
+        for sample in self.av_source.poll():
+            self.av_smoother.filter(sample)
 
+        smoothed = self.av_smoother.step(time.time())
+        if smoothed is not None:
+            moved = max(abs(smoothed.arousal - self.arousal), abs(smoothed.valence - self.valence))
+            if moved >= AV_MIN_CHANGE:
+                self.arousal = smoothed.arousal
+                self.valence = smoothed.valence
+                self.dispatcher.submit('av', self.transform_arousal_valence, self.arousal, self.valence)
 
 
-run(eval('ArousalValenceWidget'))
+if __name__ == '__main__':
+    run(eval('ArousalValenceWidget'))
@@ -0,0 +1,36 @@
+import unittest
+import music21 as m21
+import analyzer
+import transformer
+
+SONG_FILE = '../scores/bare-necessities.xml'
+
+
+class KeyAnalysisTests(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.parts, cls.song = analyzer.analyze(SONG_FILE)
+
+    def test_global_key(self):
+        self.assertEqual(str(analyzer.get_global_key(self.song)).lower(), 'c major')
+
+    def test_measures_keep_tonic(self):
+        # bare necessities stays in C major throughout, so no measure should drift to its relative minor
+        for key in analyzer.analyze_keys_by_measure(self.song):
+            self.assertEqual(str(key), 'C major')
+
+    def test_transposed_notes_in_key(self):
+        key = m21.key.Key('G', 'major')
+        scale = set(p.pitchClass for p in key.getScale().getPitches())
+
+        for part in self.parts:
+            measure = transformer.transpose_to_new_key([part[0]], key)[0]
+            for element in measure:
+                if element.is_note() or element.is_chord():
+                    for p in element.element.pitches:
+                        self.assertIn(p.pitchClass, scale, p.nameWithOctave)
+
+
+if __name__ == '__main__':
+    unittest.main()
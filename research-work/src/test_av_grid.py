@@ -0,0 +1,165 @@
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+import av_grid
+
+POINTS_DIR = './av-grid-points'
+
+# smaller than RASTER_SIZE, to keep the tests quick
+TEST_RASTER_SIZE = 24
+
+
+def get_cell_center(grid, size, i, j):
+    arousal = np.linspace(grid.min_arousal, grid.max_arousal, size)[i]
+    valence = np.linspace(grid.min_valence, grid.max_valence, size)[j]
+    return arousal, valence
+
+
+class RasterTests(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        # points with distinct values, so that each is its own entry of a distribution
+        random_state = np.random.RandomState(0)
+        cls.grid = av_grid.TempoGrid()
+        cls.grid.insert_points(list(range(60, 120)), random_state.uniform(-1, 1, 60), random_state.uniform(-1, 1, 60))
+        cls.raster = cls.grid.compute_raster(TEST_RASTER_SIZE)
+
+    def get_raster_distribution(self, i, j):
+        candidates = self.raster['candidates'][i, j]
+        count = int((candidates >= 0).sum())
+        probabilities = np.diff(np.concatenate([[0.0], self.raster['cumulative'][i, j, :count]]))
+        return {self.grid.points[c]: p for c, p in zip(candidates[:count], probabilities)}
+
+    def test_matches_direct_sampling(self):
+        checked = 0
+        for i in range(TEST_RASTER_SIZE):
+            for j in range(TEST_RASTER_SIZE):
+                arousal, valence = get_cell_center(self.grid, TEST_RASTER_SIZE, i, j)
+                within = [p for p in self.grid.points if p.distance_between(arousal, valence) <= av_grid.DISTANCE_CUTOFF]
+
+                raster_distribution = self.get_raster_distribution(i, j)
+                if len(within) < 2:
+                    # no distribution to sample from (no point, or only one, within the cutoff)
+                    self.assertEqual(raster_distribution, {})
+                    continue
+
+                _, distribution = self.grid.sample_parameter_point(arousal, valence)
+
+                self.assertEqual(set(raster_distribution), set(distribution), (i, j))
+                for point, probability in distribution.items():
+                    self.assertAlmostEqual(raster_distribution[point], probability, places=5)
+                checked += 1
+
+        self.assertGreater(checked, 0)
+
+    def test_sample_raster_picks_candidate(self):
+        grid = av_grid.TempoGrid()
+        grid.points = self.grid.points
+        grid.raster = self.raster
+
+        for arousal, valence in [(0.0, 0.0), (0.5, -0.5), (-0.9, 0.9)]:
+            i = int(round((arousal + 1) / 2 * (TEST_RASTER_SIZE - 1)))
+            j = int(round((valence + 1) / 2 * (TEST_RASTER_SIZE - 1)))
+            candidates = self.get_raster_distribution(i, j)
+            if not candidates:
+                continue
+
+            for n in range(20):
+                point, distribution = grid.sample_parameter_point(arousal, valence)
+                self.assertIsNone(distribution)
+                self.assertIn(point, candidates)
+
+    def test_saved_raster_is_reused(self):
+        directory = tempfile.mkdtemp()
+        try:
+            filepath = os.path.join(directory, 'key.txt')
+            shutil.copy(os.path.join(POINTS_DIR, 'key.txt'), filepath)
+
+            grid = av_grid.KeySignatureGrid()
+            grid.parse_point_file(filepath)
+            grid.build_raster(filepath, TEST_RASTER_SIZE)
+            self.assertTrue(os.path.exists(filepath + av_grid.RASTER_SUFFIX))
+
+            loaded = av_grid.KeySignatureGrid()
+            loaded.parse_point_file(filepath)
+            loaded.build_raster(filepath, TEST_RASTER_SIZE)
+
+            np.testing.assert_array_equal(loaded.raster['candidates'], grid.raster['candidates'])
+            np.testing.assert_array_equal(loaded.raster['cumulative'], grid.raster['cumulative'])
+        finally:
+            shutil.rmtree(directory)
+
+
+class PointFileTests(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def get_points(self, grid):
+        return [(p.get_value(), p.arousal, p.valence) for p in grid.points]
+
+    def test_binary_round_trip(self):
+        for grid_class, filename in [(av_grid.InstrumentGrid, 'instruments_multi.txt'),
+                                     (av_grid.KeySignatureGrid, 'key.txt'),
+                                     (av_grid.RhythmGrid, 'rhythm.txt')]:
+            filepath = os.path.join(POINTS_DIR, filename)
+            npy_filepath = av_grid.convert_point_file(filepath, os.path.join(self.directory, filename + '.npy'))
+
+            text_grid = grid_class()
+            text_grid.parse_point_file(filepath)
+            binary_grid = grid_class()
+            binary_grid.parse_point_file(npy_filepath)
+
+            self.assertGreater(len(text_grid.points), 0)
+            self.assertEqual(self.get_points(binary_grid), self.get_points(text_grid), filename)
+
+    def test_long_values_are_kept(self):
+        filepath = os.path.join(self.directory, 'long.txt')
+        value = ' '.join(['1'] * 100)
+        with open(filepath, 'w') as f:
+            f.write(value + '\t0.5\t-0.5\n')
+
+        values, arousals, valences = av_grid.read_point_file(av_grid.convert_point_file(filepath))
+        self.assertEqual(str(values[0]), value)
+        self.assertEqual((arousals[0], valences[0]), (0.5, -0.5))
+
+    def test_unstorable_values_raise(self):
+        filepath = os.path.join(self.directory, 'null.txt')
+        with open(filepath, 'w') as f:
+            f.write('1\x00\t0.5\t-0.5\n')
+
+        # numpy strings lose trailing null characters
+        with self.assertRaises(ValueError):
+            av_grid.convert_point_file(filepath)
+
+    def test_bulk_insert_matches_single_inserts(self):
+        values = [(4, 3, 2, 2), (1, 1, 1, 1), (2, 2, 2, 2), (4, 4, 4, 4)]
+        arousals = [0.5, 1.5, -0.2, 0.5]
+        valences = [0.1, 0.0, -2.0, -0.3]
+
+        bulk = av_grid.RhythmGrid()
+        bulk.insert_points(values, arousals, valences)
+
+        single = av_grid.RhythmGrid()
+        for value, arousal, valence in zip(values, arousals, valences):
+            single.insert(value, arousal, valence)
+
+        # clamped to the grid, and sorted by valence then arousal
+        self.assertEqual(self.get_points(bulk), self.get_points(single))
+        self.assertEqual(bulk.points[0].valence, -1.0)
+        self.assertEqual(max(p.arousal for p in bulk.points), 1.0)
+
+    def test_bulk_insert_checks_values(self):
+        grid = av_grid.TempoGrid()
+        grid.insert_points([20, 120, 400], [0, 0, 0], [-0.5, 0, 0.5])
+        self.assertEqual([p.get_value() for p in grid.points], [60, 120, 240])
+
+
+if __name__ == '__main__':
+    unittest.main()
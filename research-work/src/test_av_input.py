@@ -0,0 +1,86 @@
+import math
+import unittest
+import av_input
+
+
+class OneEuroFilterTests(unittest.TestCase):
+
+    def test_first_value_passes_through(self):
+        f = av_input.OneEuroFilter(min_cutoff=1.0)
+        self.assertEqual(f.filter(0.5, 0.0), 0.5)
+
+    def test_exponential_smoothing_without_beta(self):
+        f = av_input.OneEuroFilter(min_cutoff=1.0, beta=0.0)
+        f.filter(0.0, 0.0)
+
+        # with beta = 0, each step is plain exponential smoothing at min_cutoff
+        alpha = 1.0 / (1.0 + 1.0 / (2 * math.pi * 1.0) / 0.1)
+        self.assertAlmostEqual(f.filter(1.0, 0.1), alpha)
+
+    def test_beta_follows_fast_moves_closer(self):
+        slow = av_input.OneEuroFilter(min_cutoff=1.0, beta=0.0)
+        fast = av_input.OneEuroFilter(min_cutoff=1.0, beta=5.0)
+        for f in (slow, fast):
+            f.filter(0.0, 0.0)
+
+        self.assertGreater(fast.filter(1.0, 0.05), slow.filter(1.0, 0.05))
+
+    def test_same_time_keeps_value(self):
+        f = av_input.OneEuroFilter()
+        f.filter(0.0, 1.0)
+        self.assertEqual(f.filter(1.0, 1.0), 0.0)
+
+
+class AVSmootherTests(unittest.TestCase):
+
+    def test_nothing_before_first_sample(self):
+        self.assertIsNone(av_input.AVSmoother().step(0.0))
+
+    def test_steps_toward_latest_sample(self):
+        smoother = av_input.AVSmoother(min_cutoff=1.0)
+        smoother.filter(av_input.AVSample(0.0, 0.0, 0.0))
+        smoother.filter(av_input.AVSample(0.01, 1.0, -1.0))
+
+        # no new samples arrive, but stepping every frame keeps moving toward the last one
+        last = smoother.step(0.01)
+        for frame in range(1, 300):
+            value = smoother.step(0.01 + frame / 60.)
+            self.assertGreaterEqual(value.arousal, last.arousal)
+            self.assertLessEqual(value.valence, last.valence)
+            last = value
+
+        self.assertAlmostEqual(last.arousal, 1.0, places=3)
+        self.assertAlmostEqual(last.valence, -1.0, places=3)
+
+
+class ParameterGateTests(unittest.TestCase):
+
+    def setUp(self):
+        self.gate = av_input.ParameterGate(distance=0.2, dwell=4)
+
+    def test_first_change_passes(self):
+        self.assertTrue(self.gate.check(0.0, 0.0, 0))
+
+    def test_small_moves_are_held(self):
+        self.gate.check(0.0, 0.0, 0)
+        self.assertFalse(self.gate.check(0.1, 0.1, 10))
+
+    def test_dwell_holds_big_moves(self):
+        self.gate.check(0.0, 0.0, 0)
+        self.assertFalse(self.gate.check(0.5, 0.5, 2))
+        self.assertTrue(self.gate.check(0.5, 0.5, 4))
+
+    def test_hysteresis_from_last_change(self):
+        self.gate.check(0.0, 0.0, 0)
+        self.assertTrue(self.gate.check(0.3, 0.0, 4))
+
+        # distance is measured from where it last changed, not from where it started
+        self.assertFalse(self.gate.check(0.2, 0.0, 8))
+        self.assertTrue(self.gate.check(0.0, 0.0, 8))
+
+        self.assertEqual(self.gate.passed, 3)
+        self.assertEqual(self.gate.held, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
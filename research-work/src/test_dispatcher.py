@@ -0,0 +1,87 @@
+import unittest
+import time
+import threading
+import concurrent.futures as fut
+from dispatcher import CoalescingDispatcher
+
+# how long to wait for a job before failing, in seconds
+TIMEOUT = 5
+
+
+class CoalescingDispatcherTests(unittest.TestCase):
+
+    def setUp(self):
+        self.executor = fut.ThreadPoolExecutor(max_workers=2)
+        self.dispatcher = CoalescingDispatcher(self.executor)
+
+        self.ran = []
+        self.release = threading.Event()
+        self.started = threading.Event()
+
+    def tearDown(self):
+        self.release.set()
+        self.executor.shutdown(wait=True)
+
+    def blocking_job(self, value):
+        self.started.set()
+        self.release.wait(TIMEOUT)
+        self.ran.append(value)
+
+    def job(self, value):
+        self.ran.append(value)
+
+    def wait_until_idle(self):
+        for i in range(int(TIMEOUT / 0.01)):
+            if self.dispatcher.get_queue_depth() == 0:
+                return
+            time.sleep(0.01)
+        self.fail('jobs still queued')
+
+    def test_latest_value_wins(self):
+        self.dispatcher.submit('av', self.blocking_job, 0)
+        self.assertTrue(self.started.wait(TIMEOUT))
+
+        # only the last of the jobs submitted while one runs gets to run
+        for value in range(1, 5):
+            self.dispatcher.submit('av', self.job, value)
+
+        self.release.set()
+        self.wait_until_idle()
+
+        self.assertEqual(self.ran, [0, 4])
+        stats = self.dispatcher.get_stats()
+        self.assertEqual(stats['submitted'], 5)
+        self.assertEqual(stats['dropped'], 3)
+        self.assertEqual(stats['completed'], 2)
+
+    def test_keys_are_independent(self):
+        self.dispatcher.submit('av', self.blocking_job, 'av')
+        self.assertTrue(self.started.wait(TIMEOUT))
+
+        # a job for another key doesn't wait for (or replace) the running one
+        self.dispatcher.submit('key', self.job, 'key')
+        for i in range(int(TIMEOUT / 0.01)):
+            if 'key' in self.ran:
+                break
+            time.sleep(0.01)
+
+        self.assertEqual(self.ran, ['key'])
+
+        self.release.set()
+        self.wait_until_idle()
+        self.assertEqual(sorted(self.ran), ['av', 'key'])
+
+    def test_failed_job_frees_key(self):
+        def failing_job():
+            raise ValueError('failed')
+
+        self.dispatcher.submit('av', failing_job)
+        self.wait_until_idle()
+
+        self.dispatcher.submit('av', self.job, 1)
+        self.wait_until_idle()
+        self.assertEqual(self.ran, [1])
+
+
+if __name__ == '__main__':
+    unittest.main()
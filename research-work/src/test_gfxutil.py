@@ -0,0 +1,49 @@
+import unittest
+import numpy as np
+
+try:
+    from common.gfxutil import KFAnim, KFAnimBatch
+except ImportError:
+    # common.gfxutil needs Kivy
+    KFAnim = None
+
+
+@unittest.skipIf(KFAnim is None, 'needs Kivy')
+class KFAnimBatchTests(unittest.TestCase):
+
+    def test_matches_single_value_anims(self):
+        # different numbers of keyframes: shorter ones hold their last value
+        anims = [KFAnim((0, 1), (1, 3)),
+                 KFAnim((0, 0), (0.5, 10), (2, -10)),
+                 KFAnim((1, 5), (2, 5), (3, 0), (4, 1))]
+        batch = KFAnimBatch(anims)
+
+        for t in [-1, 0, 0.25, 0.5, 1, 1.5, 2, 3.5, 4, 10]:
+            expected = [a.eval(t) for a in anims]
+            np.testing.assert_allclose(batch.eval(t), expected, err_msg=str(t))
+
+    def test_matches_multi_value_anims(self):
+        anims = [KFAnim((0, 0, 1), (1, 10, -1)),
+                 KFAnim((0.5, 2, 2), (1, 4, 0), (3, 0, 8))]
+        batch = KFAnimBatch(anims)
+
+        for t in [0, 0.5, 0.75, 2, 5]:
+            expected = [a.eval(t) for a in anims]
+            np.testing.assert_allclose(batch.eval(t), expected, err_msg=str(t))
+
+    def test_time_per_anim(self):
+        anims = [KFAnim((0, 0), (1, 1)), KFAnim((0, 0), (2, 4))]
+        batch = KFAnimBatch(anims)
+
+        np.testing.assert_allclose(batch.eval([0.5, 1.5]), [anims[0].eval(0.5), anims[1].eval(1.5)])
+
+    def test_is_active(self):
+        anims = [KFAnim((0, 0), (1, 1)), KFAnim((0, 0), (2, 4))]
+        batch = KFAnimBatch(anims)
+
+        self.assertEqual(list(batch.is_active(1.5)), [a.is_active(1.5) for a in anims])
+        self.assertEqual(list(batch.is_active(2)), [False, False])
+
+
+if __name__ == '__main__':
+    unittest.main()
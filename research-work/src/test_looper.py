@@ -0,0 +1,78 @@
+import time
+import threading
+import unittest
+import analyzer
+import looper
+
+SONG_FILE = '../scores/bare-necessities.xml'
+TEMPO = 120
+
+# how long a transform may take before failing, in seconds
+TIMEOUT = 60
+
+
+def get_signatures(parts):
+    return [[analyzer.get_measure_signature(measure) for measure in part] for part in parts]
+
+
+class LazyLooperTests(unittest.TestCase):
+
+    def setUp(self):
+        self.eager = looper.SongLooper(SONG_FILE, TEMPO)
+        self.lazy = looper.SongLooper(SONG_FILE, TEMPO, lazy=True)
+        for l in (self.eager, self.lazy):
+            l.reset()
+
+    def transform(self, l, **kwargs):
+        """
+        Runs the transform on its own thread, stepping the looper meanwhile like playback does
+        (a key change waits for its modulation to be played through).
+        """
+        thread = threading.Thread(target=l.transform, kwargs=kwargs)
+        thread.start()
+
+        start = time.time()
+        while thread.is_alive() and time.time() - start < TIMEOUT:
+            l.step(0)
+            time.sleep(0.001)
+
+        thread.join(TIMEOUT)
+        self.assertFalse(thread.is_alive(), 'transform timed out')
+
+    def assert_same_parts(self):
+        self.assertEqual(get_signatures(self.lazy.get_all_parts()), get_signatures(self.eager.get_all_parts()))
+
+    def test_untransformed(self):
+        self.assert_same_parts()
+
+    def test_rhythm(self):
+        for l in (self.eager, self.lazy):
+            self.transform(l, rhythm=[2, 2, 2, 2])
+        self.assert_same_parts()
+
+    def test_key(self):
+        for l in (self.eager, self.lazy):
+            self.transform(l, key='d major')
+            self.assertEqual(l.current_key, 'd major')
+        self.assert_same_parts()
+
+    def test_rhythm_then_key(self):
+        for l in (self.eager, self.lazy):
+            self.transform(l, rhythm=[1, 2, 1, 2])
+            self.transform(l, key='a minor')
+        self.assert_same_parts()
+
+    def test_lazy_transforms_on_demand(self):
+        # a rhythm change doesn't modulate, so it doesn't wait for playback. Only the current measure is transformed
+        self.lazy.transform(rhythm=[2, 2, 2, 2])
+        current = self.lazy.measure_index
+        self.assertEqual(set(self.lazy.lazy_measures[0]), {current})
+
+        # prefetching transforms the next few measures, and nothing else
+        self.lazy.prefetch()
+        upcoming = [(current + i) % self.lazy.length for i in range(1, self.lazy.lookahead + 1)]
+        self.assertEqual(set(self.lazy.lazy_measures[0]), {current} | set(upcoming))
+
+
+if __name__ == '__main__':
+    unittest.main()
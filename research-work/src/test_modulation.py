@@ -0,0 +1,152 @@
+import os
+import json
+import shutil
+import tempfile
+import unittest
+import modulation
+
+
+class ModulationTableTests(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.mkdtemp()
+        cls.table_path = os.path.join(cls.directory, 'modulation_paths.json')
+        cls.modulator = modulation.KeyModulator(table_path=cls.table_path)
+        cls.table = cls.modulator.modulation_paths[modulation.DEFAULT_COST_PROFILE]
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.directory)
+
+    def test_table_is_saved_and_loaded(self):
+        self.assertTrue(os.path.exists(self.table_path))
+
+        loaded = modulation.KeyModulator(table_path=self.table_path)
+        self.assertEqual(loaded.modulation_paths[modulation.DEFAULT_COST_PROFILE], self.table)
+
+    def test_table_covers_all_pairs(self):
+        keys = set(self.modulator.common_chord_graph)
+        self.assertEqual(len(keys), 24)
+        self.assertEqual(set(self.table), keys)
+
+        for start, ends in self.table.items():
+            self.assertEqual(set(ends), keys - {start}, start)
+
+    def test_paths_follow_graph(self):
+        graph = self.modulator.common_chord_graph
+        for start, ends in self.table.items():
+            for end, path in ends.items():
+                self.assertEqual(path[0], (start, None))
+                self.assertEqual(path[-1][0], end)
+
+                for (key, _), (next_key, pivot) in zip(path, path[1:]):
+                    self.assertTrue(graph[key].is_connected(graph[next_key]), (key, next_key))
+                    self.assertIsNotNone(pivot)
+
+    def test_stale_table_is_rebuilt(self):
+        path = os.path.join(self.directory, 'stale.json')
+        with open(path, 'w') as f:
+            json.dump({'tonics': [], 'profile': [0, 0], 'paths': {}}, f)
+
+        modulator = modulation.KeyModulator(table_path=path)
+        self.assertEqual(modulator.modulation_paths[modulation.DEFAULT_COST_PROFILE], self.table)
+
+        with open(path, 'r') as f:
+            self.assertEqual(json.load(f)['profile'], list(modulation.DEFAULT_COST_PROFILE))
+
+
+class ModulationCostTests(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.mkdtemp()
+        cls.modulator = modulation.KeyModulator(table_path=os.path.join(cls.directory, 'modulation_paths.json'))
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.directory)
+
+    def get_edge_cost(self, key, next_key, cost_profile):
+        graph = self.modulator.common_chord_graph
+        _, distance = self.modulator.get_edge_voice_leading(graph[key], graph[next_key])
+        return cost_profile.modulation_cost + cost_profile.voice_leading_weight * distance
+
+    def get_path_cost(self, path, cost_profile):
+        keys = [key for key, _ in path]
+        return sum(self.get_edge_cost(key, next_key, cost_profile) for key, next_key in zip(keys, keys[1:]))
+
+    def test_paths_are_cheapest(self):
+        profile = modulation.DEFAULT_COST_PROFILE
+        graph = self.modulator.common_chord_graph
+
+        for start in graph:
+            paths = self.modulator.get_modulation_paths(start, profile)
+            costs = {end: self.get_path_cost(path, profile) for end, path in paths.items()}
+            costs[start] = 0.0
+
+            # no edge leads anywhere more cheaply than its cheapest path
+            for key, node in graph.items():
+                for other in node.get_adjacent_vertices():
+                    self.assertLessEqual(costs[other.get_id()],
+                                         costs[key] + self.get_edge_cost(key, other.get_id(), profile) + 1e-9)
+
+    def test_pivots_match_edge_voice_leading(self):
+        graph = self.modulator.common_chord_graph
+        start = self.modulator.get_key_id('c', 'major')
+
+        for end, path in self.modulator.get_modulation_paths(start, modulation.DEFAULT_COST_PROFILE).items():
+            for (key, _), (next_key, pivot) in zip(path, path[1:]):
+                expected, _ = self.modulator.get_edge_voice_leading(graph[key], graph[next_key])
+                self.assertEqual(pivot, expected)
+
+    def test_modulation_cost_limits_key_changes(self):
+        # when key changes cost far more than voice leading, paths take as few of them as possible
+        profile = modulation.CostProfile(modulation_cost=1000.0, voice_leading_weight=1.0)
+        graph = self.modulator.common_chord_graph
+        start = self.modulator.get_key_id('c', 'major')
+
+        # fewest key changes to each key, breadth first
+        hops = {start: 0}
+        frontier = [start]
+        while frontier:
+            next_frontier = []
+            for key in frontier:
+                for node in graph[key].get_adjacent_vertices():
+                    if node.get_id() not in hops:
+                        hops[node.get_id()] = hops[key] + 1
+                        next_frontier.append(node.get_id())
+            frontier = next_frontier
+
+        for end, path in self.modulator.get_modulation_paths(start, profile).items():
+            self.assertEqual(len(path) - 1, hops[end], end)
+
+
+class ChordPathTests(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.mkdtemp()
+        cls.modulator = modulation.KeyModulator(table_path=os.path.join(cls.directory, 'modulation_paths.json'))
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.directory)
+
+    def test_enharmonic_keys_are_one_node(self):
+        self.assertEqual(self.modulator.get_key_id('a#', 'major'), self.modulator.get_key_id('b-', 'major'))
+        self.assertEqual(self.modulator.get_key_id('g#', 'minor'), self.modulator.get_key_id('a-', 'minor'))
+
+    def test_same_key_needs_no_modulation(self):
+        self.assertEqual(self.modulator.find_chord_path(('a#', 'major'), ('b-', 'major')), [])
+        self.assertEqual(self.modulator.find_chord_path(('c', 'major'), ('c', 'major')), [])
+
+    def test_path_starts_and_ends_in_its_keys(self):
+        path = self.modulator.find_chord_path(('c', 'major'), ('a-', 'major'))
+        self.assertGreater(len(path), 1)
+        self.assertEqual(path[0].key.tonic.name, 'C')
+        self.assertEqual(path[-1].key.tonic.name, 'A-')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+import unittest
+
+try:
+    from common.synth import VoiceManager
+except ImportError:
+    # common.synth needs the FluidSynth library
+    VoiceManager = None
+
+
+class FakeSynth:
+    """
+    Records the notes it's asked to play, in place of a Synth.
+    """
+    def __init__(self):
+        self.sounding = set()
+        self.noteoffs = []
+
+    def noteon(self, chan, key, vel):
+        self.sounding.add((chan, key))
+
+    def noteoff(self, chan, key):
+        self.sounding.discard((chan, key))
+        self.noteoffs.append((chan, key))
+
+
+@unittest.skipIf(VoiceManager is None, 'needs the FluidSynth library')
+class VoiceManagerTests(unittest.TestCase):
+
+    def setUp(self):
+        self.synth = FakeSynth()
+        self.voices = VoiceManager(self.synth, max_voices=2)
+
+    def test_steals_oldest_voice(self):
+        self.voices.noteon(0, 60, 100)
+        self.voices.noteon(0, 62, 100)
+        self.assertTrue(self.voices.noteon(0, 64, 100))
+
+        self.assertEqual(self.synth.sounding, {(0, 62), (0, 64)})
+        self.assertEqual(self.synth.noteoffs, [(0, 60)])
+        self.assertEqual(self.voices.get_num_voices(), 2)
+        self.assertEqual(self.voices.stolen, 1)
+
+    def test_keeps_higher_priority_voices(self):
+        self.voices.set_priority(0, 1)
+        self.voices.noteon(0, 60, 100)
+        self.voices.noteon(0, 62, 100)
+
+        # every voice outranks the new note, so it's dropped
+        self.assertFalse(self.voices.noteon(1, 64, 100))
+        self.assertEqual(self.synth.sounding, {(0, 60), (0, 62)})
+        self.assertEqual(self.voices.suppressed, 1)
+
+        # but a higher priority note takes the place of a lower one
+        self.voices.set_priority(1, 2)
+        self.assertTrue(self.voices.noteon(1, 64, 100))
+        self.assertEqual(self.synth.sounding, {(0, 62), (1, 64)})
+
+    def test_retriggered_note_reuses_voice(self):
+        self.voices.noteon(0, 60, 100)
+        self.voices.noteon(0, 60, 80)
+
+        self.assertEqual(self.voices.get_num_voices(), 1)
+        self.assertEqual(self.voices.stolen, 0)
+
+    def test_muted_notes_counted_apart(self):
+        self.voices.noteon(1, 60, 100)
+        self.voices.mute(1)
+
+        # muting releases what's sounding, and drops new notes
+        self.assertEqual(self.synth.sounding, set())
+        self.assertFalse(self.voices.noteon(1, 62, 100))
+
+        metrics = self.voices.get_metrics()
+        self.assertEqual(metrics['muted'], 1)
+        self.assertEqual(metrics['suppressed'], 0)
+
+        self.voices.unmute(1)
+        self.assertTrue(self.voices.noteon(1, 62, 100))
+
+    def test_noteoff_of_stolen_note_is_ignored(self):
+        self.voices.noteon(0, 60, 100)
+        self.voices.noteon(0, 62, 100)
+        self.voices.noteon(0, 64, 100)
+
+        self.voices.noteoff(0, 60)
+        self.assertEqual(self.synth.noteoffs, [(0, 60)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,13 +1,11 @@
-import music21 as m21
 import numpy as np
-import sklearn as skl
-import sys
 from collections import defaultdict
-from random import shuffle
 import copy
-import unittest
 import random
 import analyzer
+from common.lazy import lazy_import
+
+m21 = lazy_import('music21')
 
 # TODO: Test cases
 # class TransformationTests(unittest.TestCase):
@@ -15,143 +13,241 @@ import analyzer
 
 
 # transformation 1
-def transpose_to_new_key(measures, key):
+def transpose_to_new_key(measures, key, measure_cache=None):
     """
-    Translates all notes from their current key to the new key
+    Translates all notes from their current key to the new key. Measures with identical content
+    are only transposed once, and share the same transposed measure.
 
     Args:
         measures (List[List[AnalyzedNotes]]): Song notes grouped by measure
         key (music21.key.Key): The key signature context.
+        measure_cache (dict): optional cache of transformed measures, shared between calls
 
     Returns:
         transposed_measures (List[List[AnalyzedNote]]): List of transposed notes grouped by their
                                                         corresponding measures.
     """
+    if measure_cache is None:
+        measure_cache = {}
+
+    key_name = str(key)
+
     transposed_measures = []
     for measure in measures:
-        m = [note.in_new_key(key) for note in measure]
+        cache_key = ('key', key_name, analyzer.get_measure_key(measure))
+
+        m = measure_cache.get(cache_key)
+        if m is None:
+            m = analyzer.Measure([note.in_new_key(key) for note in measure])
+            measure_cache[cache_key] = m
 
         transposed_measures.append(m)
 
     return transposed_measures
 
 # transformation 2
-def fill_ostinato(measures, rhythm):
+def fill_ostinato(measures, rhythm, measure_cache=None):
     """
     Takes the rhythm and applies the rhythm over the
     measures in the song. Forms a song structured on a single
-    rhythmic idea.
+    rhythmic idea. Measures with identical content are only ostinated once, and share
+    the same ostinated measure.
 
     Args:
         measures (List[List[AnalyzedNote]]) Analyzed notes grouped in measures
         rhythm (List[int]) List, whose length == 4, where each index specifies the quarter-note
                            division being played. Ex: 2 = eighth notes, 3 = eighth note triplets, etc.
+        measure_cache (dict): optional cache of transformed measures, shared between calls
 
     Returns:
         ostinated_measures(List[List[AnalyzedNote]]): list of measures with the repeated rhythm applied
     """
     assert(len(rhythm) == 4)
 
+    if measure_cache is None:
+        measure_cache = {}
+
     # ostinato doesn't currently work on rests, so replace them with notes
     # measures = replace_rests(measures)
 
+    rhythm_key = tuple(rhythm)
+
     ostinated_measures = []
     for measure in measures:
+        cache_key = ('rhythm', rhythm_key, analyzer.get_measure_key(measure))
 
-        # dictonary that maps the present elementss to the previous quarter-note beat
-        # for example, if beat 2 of the measure has sixteenth notes, there will then 2 -> [N, N, N, N]
-        prev_elements_on_beats = defaultdict(list)
+        m = measure_cache.get(cache_key)
+        if m is None:
+            m = analyzer.Measure(ostinate_measure(measure, rhythm))
+            measure_cache[cache_key] = m
 
-        #return measure
-        m = []
+        ostinated_measures.append(m)
+
+    return ostinated_measures
+
+# transformations 1 + 2
+def fill_ostinato_in_key(measures, rhythm, key, measure_cache=None):
+    """
+    Applies the rhythm over the measures and translates the notes to the new key in a single
+    pass. Gives the same result as transpose_to_new_key(fill_ostinato(measures, rhythm), key),
+    but only creates one new note per note in the result.
 
-        # map each element to its previous strong beat
-        for element in measure:
-            if not element.is_rest():
-                # previous quarter note beat number
-                beat = int(element.beatOffset)
+    Args:
+        measures (List[List[AnalyzedNote]]) Analyzed notes grouped in measures
+        rhythm (List[int]) List, whose length == 4, where each index specifies the quarter-note
+                           division being played.
+        key (music21.key.Key): The key signature context.
+        measure_cache (dict): optional cache of transformed measures, shared between calls
+
+    Returns:
+        transformed_measures(List[List[AnalyzedNote]]): list of measures with the repeated rhythm applied,
+                                                        in the new key
+    """
+    assert(len(rhythm) == 4)
+
+    if measure_cache is None:
+        measure_cache = {}
 
-                # place the element to its prev beat.
-                prev_elements_on_beats[beat].append(element)
+    rhythm_key = tuple(rhythm)
+    key_name = str(key)
 
-        beat_to_element_keys = prev_elements_on_beats.keys()
+    transformed_measures = []
+    for measure in measures:
+        cache_key = ('rhythm+key', rhythm_key, key_name, analyzer.get_measure_key(measure))
 
-        for i in range(len(rhythm)):
-            # current quarter note beat == i + 1
-            elements = []
-            cur_index = i + 1
+        m = measure_cache.get(cache_key)
+        if m is None:
+            m = analyzer.Measure(ostinate_measure(measure, rhythm, key))
+            measure_cache[cache_key] = m
 
-            if cur_index not in beat_to_element_keys:
-                rest_element = m21.note.Rest()
-                rest_element.duration =  m21.duration.Duration(quarterLength=1.0)
+        transformed_measures.append(m)
 
-                analyzed_rest = analyzer.AnalyzedElement(m21.key.Key('c', 'major'), rest_element, beatOffset=cur_index)
-                m.append(analyzed_rest)
+    return transformed_measures
 
-            else:
-                # find elements. if current index beat doesn't have note attacks, look at previous beats
-                # this takes care of the case where the previous element has duration > quarter length (i.e. a half note),
-                # such that the next beat has no attack (and thus no elements)
-                while len(elements) == 0 and cur_index > 0:
-                    if cur_index in beat_to_element_keys:
-                        elements = prev_elements_on_beats[cur_index]
-                    cur_index -= 1
+def ostinate_measure(measure, rhythm, key=None):
+    """
+    Applies the rhythm over a single measure, optionally translating its notes to a new key
+    at the same time.
 
-                # 1 = quarter, 2 = eighth, 3 = eighth triplet, 4 = sixteenth notes, etc.
-                num_elements_for_rhythm = rhythm[i]
-                ql = 1.0/num_elements_for_rhythm
+    Args:
+        measure (List[AnalyzedNote]) Analyzed notes of the measure
+        rhythm (List[int]) List, whose length == 4, where each index specifies the quarter-note
+                           division being played.
+        key (music21.key.Key): optional new key signature context
 
-                # if there are equal notes as required for the new rhythm
-                if num_elements_for_rhythm == len(elements):
-                    for element in elements:
-                        new_element = copy.deepcopy(element.element) # TODO: Deep copying can be slow
-                        new_element.duration = m21.duration.Duration(quarterLength=ql)
+    Returns:
+        m (List[AnalyzedNote]): the measure with the repeated rhythm applied
+    """
 
-                        m.append(element.copy(element=new_element))
+    # dictonary that maps the present elementss to the previous quarter-note beat
+    # for example, if beat 2 of the measure has sixteenth notes, there will then 2 -> [N, N, N, N]
+    prev_elements_on_beats = defaultdict(list)
 
-                elif num_elements_for_rhythm > len(elements):
-                    # divide the rhythm evenly along notes
-                    times = [int(num_elements_for_rhythm/len(elements)) for n in range(len(elements))]
+    #return measure
+    m = []
 
-                    extra = num_elements_for_rhythm % len(elements)
+    # map each element to its previous strong beat
+    for element in measure:
+        if not element.is_rest():
+            # previous quarter note beat number
+            beat = int(element.beatOffset)
 
-                    # if not even, add extra notes from the beginning
-                    if extra != 0:
-                        for x in range(extra):
-                            times[x] += 1
+            # place the element to its prev beat.
+            prev_elements_on_beats[beat].append(element)
 
-                    internal_offset = 0
-                    for j in range(len(elements)):
-                        element = elements[j]
-                        t = times[j]
+    beat_to_element_keys = prev_elements_on_beats.keys()
 
-                        # t = some integer
-                        for repeat in range(t):
-                            offset = (i + 1) + (internal_offset)*ql
+    for i in range(len(rhythm)):
+        # current quarter note beat == i + 1
+        elements = []
+        cur_index = i + 1
 
-                            new_element = copy.deepcopy(element.element) #TODO Deep copy might be slow
-                            new_element.duration = m21.duration.Duration(quarterLength=ql)
+        if cur_index not in beat_to_element_keys:
+            rest_element = m21.note.Rest()
+            rest_element.duration =  m21.duration.Duration(quarterLength=1.0)
 
-                            m.append(element.copy(element=new_element, beatOffset=offset))
-                            internal_offset += 1
+            analyzed_rest = analyzer.AnalyzedElement(m21.key.Key('c', 'major'), rest_element, beatOffset=cur_index)
+            m.append(analyzed_rest)
 
-                else:
-                    first = elements[::2]
-                    then = elements[1::2]
+        else:
+            # find elements. if current index beat doesn't have note attacks, look at previous beats
+            # this takes care of the case where the previous element has duration > quarter length (i.e. a half note),
+            # such that the next beat has no attack (and thus no elements)
+            while len(elements) == 0 and cur_index > 0:
+                if cur_index in beat_to_element_keys:
+                    elements = prev_elements_on_beats[cur_index]
+                cur_index -= 1
 
-                    seq = first + then
-                    for j in range(num_elements_for_rhythm):
-                        element = seq[j]
+            # 1 = quarter, 2 = eighth, 3 = eighth triplet, 4 = sixteenth notes, etc.
+            num_elements_for_rhythm = rhythm[i]
+            ql = 1.0/num_elements_for_rhythm
 
-                        new_element = copy.deepcopy(element.element)
-                        new_element.duration = m21.duration.Duration(quarterLength=ql)
+            # if there are equal notes as required for the new rhythm
+            if num_elements_for_rhythm == len(elements):
+                for element in elements:
+                    m.append(retime_element(element, ql, key))
 
-                        offset = (i + 1) + j*ql
-                        m.append(element.copy(element=new_element, beatOffset=offset))
+            elif num_elements_for_rhythm > len(elements):
+                # divide the rhythm evenly along notes
+                times = [int(num_elements_for_rhythm/len(elements)) for n in range(len(elements))]
 
-        ostinated_measures.append(m)
+                extra = num_elements_for_rhythm % len(elements)
 
-    return ostinated_measures
+                # if not even, add extra notes from the beginning
+                if extra != 0:
+                    for x in range(extra):
+                        times[x] += 1
+
+                internal_offset = 0
+                for j in range(len(elements)):
+                    element = elements[j]
+                    t = times[j]
+
+                    # t = some integer
+                    for repeat in range(t):
+                        offset = (i + 1) + (internal_offset)*ql
+
+                        m.append(retime_element(element, ql, key, offset))
+                        internal_offset += 1
+
+            else:
+                first = elements[::2]
+                then = elements[1::2]
+
+                seq = first + then
+                for j in range(num_elements_for_rhythm):
+                    element = seq[j]
+
+                    offset = (i + 1) + j*ql
+                    m.append(retime_element(element, ql, key, offset))
+
+    return m
+
+def retime_element(element, ql, key=None, beatOffset=None):
+    """
+    Returns a copy of the (non-rest) element with a new duration, and optionally a new key and beat offset.
+
+    Args:
+        element (AnalyzedNote) the element to copy
+        ql (float) quarter length of the new element
+        key (music21.key.Key): optional new key signature context
+        beatOffset (float): optional new beat offset
+
+    Returns:
+        (AnalyzedNote) the re-timed element
+    """
+    duration = m21.duration.Duration(quarterLength=ql)
+
+    if key is None:
+        new_element = copy.deepcopy(element.element) # TODO: Deep copying can be slow
+        new_element.duration = duration
+
+        return element.copy(element=new_element, beatOffset=beatOffset)
+    else:
+        # transposing creates the new element, so no need to copy it first
+        new_element = element.transpose_element(key, duration)
+
+        return element.copy(key=key, element=new_element, beatOffset=beatOffset)
 
 # transformation 3
 def replace_rests(measures):